@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+from __future__ import division
+import argparse
+import os
+import sys
+import tempfile
+import time
+import libcache
+import libffprobe
+import libmovie
+import libpipeline
+
+### Measure what --detect-crop adds to probing a file: the cropdetect passes on
+### a cold cache, the lookup on a warm one, against the plain video stream probe.
+
+aparse = argparse.ArgumentParser(description='Benchmark the cost of crop detection')
+aparse.add_argument('files', nargs='+', help='movie files or directories of movie files')
+aparse.add_argument('--ffprobe', dest='ffprobe', default='/usr/bin/ffprobe', help='path to ffprobe')
+aparse.add_argument('--ffmpeg', dest='ffmpeg', default='/usr/bin/ffmpeg', help='path to ffmpeg')
+aparse.add_argument('--segments', dest='segments', type=int, default=3, help='segments to run cropdetect over')
+aparse.add_argument('--seconds', dest='seconds', type=int, default=10, help='length of each segment')
+
+args = aparse.parse_args()
+
+files = []
+for path in args.files:
+        if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                        files += [ os.path.join(root, name) for name in sorted(names) ]
+        else:
+                files.append(os.path.abspath(path))
+
+if not files:
+        print('No files to benchmark.')
+        sys.exit(1)
+
+cache_db = os.path.join( tempfile.mkdtemp(), 'cache.db' )
+
+options = {
+        'ffprobe': args.ffprobe,
+        'ffmpeg': args.ffmpeg,
+        'crop_segments': args.segments,
+        'crop_seconds': args.seconds,
+        'cache_db': cache_db,
+}
+
+probe_time = 0
+cold_time = 0
+warm_time = 0
+cropped = 0
+
+for f in files:
+        start = time.time()
+        probe = libffprobe.parseFFProbeOutput( libffprobe.runFFProbe( libffprobe.getFFProbeCmd( args.ffprobe, f, 'v' ) ) )
+        video = libffprobe.getVideoInfo( probe ) if probe else None
+        probe_time += time.time() - start
+
+        if not video:
+                continue
+
+        start = time.time()
+        active_pixels = libpipeline.runTask( libmovie.detectCrop( f, video.pixels, options ) )
+        cold_time += time.time() - start
+
+        start = time.time()
+        libpipeline.runTask( libmovie.detectCrop( f, video.pixels, options ) )
+        warm_time += time.time() - start
+
+        if active_pixels and active_pixels < video.pixels:
+                cropped += 1
+                print(f + ': ' + str(int( 100 * active_pixels / video.pixels )) + '% of the frame is picture')
+
+count = len(files)
+
+print('files:            ' + str(count) + ', ' + str(cropped) + ' letterboxed')
+print('video probe:      ' + str(int( 1000 * probe_time / count )) + 'ms per file')
+print('cropdetect cold:  ' + str(int( 1000 * cold_time / count )) + 'ms per file')
+print('cropdetect warm:  ' + str(round( 1000 * warm_time / count, 2 )) + 'ms per file')
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+from __future__ import division
+import argparse
+import os
+import sys
+import time
+import logging
+import libmovie
+import libmvdb
+import libpipeline
+import libsections
+
+### Compare throughput of the one-at-a-time and concurrent drivers over the same
+### files. Nothing is moved or deleted, only dispositions are compared.
+
+aparse = argparse.ArgumentParser(description='Benchmark runTask against runPipeline')
+aparse.add_argument('files', nargs='+', help='movie files or directories of movie files')
+aparse.add_argument('--ffprobe', dest='ffprobe', default='/usr/bin/ffprobe', help='path to ffprobe')
+aparse.add_argument('--plexdb', dest='plexdb', required=True, help='path to the Plex library database')
+aparse.add_argument('--section', dest='section', default='Movies', help='Plex library section name')
+aparse.add_argument('--mvdb-api-key', dest='mvdb_apikey', required=True, help='mvdb api key')
+aparse.add_argument('-j', '--jobs', dest='jobs', type=int, default=8, help='ffprobe processes to run at once')
+aparse.add_argument('--http-workers', dest='http_workers', type=int, default=4, help='threads for MVDB calls')
+aparse.add_argument('--db-workers', dest='db_workers', type=int, default=1, help='threads for Plex DB calls')
+
+args = aparse.parse_args()
+
+logging.basicConfig(level=logging.CRITICAL)
+
+files = []
+for path in args.files:
+        if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                        files += [ os.path.join(root, name) for name in sorted(names) ]
+        else:
+                files.append(os.path.abspath(path))
+
+if not files:
+        print('No files to benchmark.')
+        sys.exit(1)
+
+sections = libsections.getSectionIndex( args.plexdb, args.section )
+if not sections:
+        print('Plex section ' + args.section + ' not found.')
+        sys.exit(1)
+
+def newTask( inFile, inSession ):
+        return libmovie.processMovie( inFile, args.ffprobe, args.plexdb, sections, args.mvdb_apikey, inSession )
+
+### ONE FILE AT A TIME
+session = libmvdb.getMVDBSession( 1 )
+start = time.time()
+sync_results = [ libpipeline.runTask( newTask( f, session ) ) for f in files ]
+sync_time = time.time() - start
+
+### CONCURRENT PIPELINE
+session = libmvdb.getMVDBSession( args.http_workers )
+start = time.time()
+pipe_results = libpipeline.runPipeline( [ newTask( f, session ) for f in files ], args.jobs, args.http_workers, args.db_workers )
+pipe_time = time.time() - start
+
+mismatch = 0
+for idx in range(len(files)):
+        sync_disp = libmovie.getDisposition( sync_results[idx], True )
+        pipe_disp = libmovie.getDisposition( pipe_results[idx], True )
+        if sync_disp != pipe_disp:
+                mismatch += 1
+                print('MISMATCH ' + files[idx] + ': ' + sync_disp + ' != ' + pipe_disp)
+
+print('files:            ' + str(len(files)))
+print('runTask:          ' + str(round(sync_time, 2)) + 's, ' + str(round(len(files) / sync_time, 2)) + ' files/s')
+print('runPipeline:      ' + str(round(pipe_time, 2)) + 's, ' + str(round(len(files) / pipe_time, 2)) + ' files/s')
+print('speedup:          ' + str(round(sync_time / pipe_time, 2)) + 'x')
+print('mismatches:       ' + str(mismatch))
+
+sys.exit(1 if mismatch else 0)
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+from __future__ import division
+import argparse
+import os
+import sys
+import time
+import libffprobe
+import libremote
+
+### Measure what --prefetch-remote saves when probing files on network storage:
+### the three header probes against the file itself, against the prefetch plus
+### the same probes on the local copy. Drop the page cache (or use files not
+### read recently) between runs, or the first pass warms it for the second.
+
+aparse = argparse.ArgumentParser(description='Benchmark probing network files directly against through a local prefetch')
+aparse.add_argument('files', nargs='+', help='movie files or directories of movie files')
+aparse.add_argument('--ffprobe', dest='ffprobe', default='/usr/bin/ffprobe', help='path to ffprobe')
+aparse.add_argument('--temp-dir', dest='temp_dir', help='local directory for the prefetched copies')
+
+args = aparse.parse_args()
+
+files = []
+for path in args.files:
+        if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                        files += [ os.path.join(root, name) for name in sorted(names) ]
+        else:
+                files.append(os.path.abspath(path))
+
+if not files:
+        print('No files to benchmark.')
+        sys.exit(1)
+
+def probeAll( inFile ):
+        return [ libffprobe.parseFFProbeOutput( libffprobe.runFFProbe( libffprobe.getFFProbeCmd( args.ffprobe, inFile, stream ) ) )
+                 for stream in [ 'v', 'a', 's' ] ]
+
+direct_time = 0
+prefetch_time = 0
+local_time = 0
+mismatch = 0
+remote = 0
+
+for f in files:
+        if libremote.isRemoteFile( f ):
+                remote += 1
+
+        start = time.time()
+        direct = probeAll( f )
+        direct_time += time.time() - start
+
+        start = time.time()
+        local_file = libremote.prefetchFile( f, args.temp_dir )
+        prefetch_time += time.time() - start
+
+        if not local_file:
+                continue
+
+        start = time.time()
+        local = probeAll( local_file )
+        local_time += time.time() - start
+
+        libremote.removePrefetch( local_file )
+
+        if local != direct:
+                mismatch += 1
+                print('MISMATCH ' + f)
+
+count = len(files)
+stats = libremote.getIOStats()
+
+print('files:            ' + str(count) + ', ' + str(remote) + ' on network storage')
+print('direct probes:    ' + str(int( 1000 * direct_time / count )) + 'ms per file')
+print('prefetch:         ' + str(int( 1000 * prefetch_time / count )) + 'ms per file, ' + str(int( stats['bytes'] / 1048576 )) + 'MB of ' \
+      + str(int( stats['file_bytes'] / 1048576 )) + 'MB in ' + str(stats['reads']) + ' reads')
+print('local probes:     ' + str(int( 1000 * local_time / count )) + 'ms per file')
+print('mismatches:       ' + str(mismatch))
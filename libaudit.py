@@ -0,0 +1,147 @@
+from __future__ import division
+import heapq
+import libplexdb
+import librules
+import libscore
+from libmediainfo import MediaInfo, VideoInfo
+
+######
+### Library-wide audit. libplexdb.iterPlexMediaStreams hands back one row per
+### stream, sorted so that every stream of a media item, and every copy of a
+### movie, arrive next to each other. Only the current movie is held in memory
+### while it is scored; the reports keep just the top inLimit entries.
+######
+
+def getMediaInfo( inItem ):
+### getMediaInfo
+#       Input : inItem (dict)
+#       Output: media (MediaInfo)
+
+        codec = libscore.mungeCodec( inItem['codec'] ) if inItem['codec'] else ''
+        pixels = inItem['width'] * inItem['height'] if inItem['width'] and inItem['height'] else 0
+
+        video = VideoInfo( codec, inItem['bitrate'], None, pixels, inItem['fps'] )
+        audio = libplexdb.pickPlexAudio( inItem['audio'] )
+
+        return MediaInfo( video, audio, inItem['eng_subtitles'] )
+
+
+def isHighDefGenre( inGenres, inRules=None ):
+### isHighDefGenre
+#       Input : inGenres (string) Plex genre tags, separated by '|', inRules (dict) from librules
+#       Output: high_def (BOOL)
+
+        genres = [ g.strip().lower() for g in inGenres.split('|') ] if inGenres else []
+        rules = inRules if inRules else librules.rules
+
+        for genre in genres:
+                if genre in rules['high_def_names']:
+                        return True
+
+        return False
+
+
+def iterPlexMovies( inPlexDB, inSection, inRules=None ):
+### iterPlexMovies
+#       Input : inPlexDB (string), inSection (int), inRules (dict) from librules
+#       Output: generator of ( title, year, high_def, items ), one per movie, where items is a list of
+#               dicts, one per copy in the library
+
+        key = None
+        movie = None
+        item = None
+
+        for row in libplexdb.iterPlexMediaStreams( inPlexDB, inSection ):
+                norm_title, title, year, genres, media_id, width, height, fps, video_codec, size, filename, \
+                        codec, bitrate, language, channels, stream_type = row
+
+                if ( norm_title, year ) != key:
+                        if movie:
+                                yield movie
+                        key = ( norm_title, year )
+                        movie = ( title, year, isHighDefGenre( genres, inRules ), [] )
+                        item = None
+
+                if not item or item['id'] != media_id:
+                        item = {
+                                'id': media_id,
+                                'file': filename,
+                                'size': int(size) if size else 0,
+                                'width': width,
+                                'height': height,
+                                'fps': fps,
+                                'codec': None,
+                                'bitrate': None,
+                                'audio': [],
+                                'eng_subtitles': False,
+                        }
+                        movie[3].append( item )
+
+                if not codec:
+                        continue
+
+                if stream_type == 3:
+                        if language and language.lower() in [ 'en', 'eng', 'english' ]:
+                                item['eng_subtitles'] = True
+                elif codec == video_codec and not item['codec']:
+                        item['codec'] = codec
+                        item['bitrate'] = bitrate
+                else:
+                        item['audio'].append( [ codec, language, channels, bitrate ] )
+
+        if movie:
+                yield movie
+
+
+def keepTop( inHeap, inLimit, inEntry ):
+### keepTop
+#       Input : inHeap (list), inLimit (int), inEntry (tuple)
+#       Output: None, inHeap keeps the inLimit largest entries
+
+        if len(inHeap) < inLimit:
+                heapq.heappush( inHeap, inEntry )
+        elif inEntry > inHeap[0]:
+                heapq.heapreplace( inHeap, inEntry )
+
+
+def auditLibrary( inPlexDB, inSection, inLimit, inRules=None ):
+### auditLibrary
+#       Input : inPlexDB (string), inSection (int), inLimit (int), inRules (dict) from librules
+#       Output: upgrades (list), redundant (list), totals (dict)
+#               upgrades are ( score, title, year, file ), lowest score first, for movies whose best
+#               copy would only have made it to staging
+#               redundant are ( bytes, title, year, [ files ] ), most reclaimable bytes first, for movies
+#               with more than one copy where all but the best scoring copy could be removed
+
+        limit = int(inLimit) if inLimit else 50
+        rules = inRules if inRules else librules.rules
+
+        upgrades = []
+        redundant = []
+        totals = { 'movies': 0, 'items': 0, 'upgrades': 0, 'redundant': 0, 'reclaimable': 0 }
+
+        for title, year, high_def, items in iterPlexMovies( inPlexDB, inSection, rules ):
+                totals['movies'] += 1
+                totals['items'] += len(items)
+
+                scored = sorted([ ( libscore.calcMediaScore( getMediaInfo( item ), year, high_def, rules ), item['size'], item ) for item in items ],
+                                key=lambda s: ( s[0], -s[1] ), reverse=True)
+
+                best_score, best_size, best = scored[0]
+
+                if best_score <= rules['staging_score']:
+                        totals['upgrades'] += 1
+                        keepTop( upgrades, limit, ( -best_score, title, year, best['file'] ) )
+
+                if len(scored) > 1:
+                        extra = scored[1:]
+                        reclaim = sum([ s[1] for s in extra ])
+                        totals['redundant'] += len(extra)
+                        totals['reclaimable'] += reclaim
+                        keepTop( redundant, limit, ( reclaim, title, year, [ s[2]['file'] for s in extra ] ) )
+
+        upgrades = [ ( -u[0], u[1], u[2], u[3] ) for u in sorted(upgrades, reverse=True) ]
+        redundant = sorted(redundant, reverse=True)
+
+        return upgrades, redundant, totals
+
@@ -0,0 +1,80 @@
+import json
+import os
+import sqlite3
+
+######
+### Small local SQLite cache for facts about a file that are slow to work out
+### and never change while the file doesn't. Entries are keyed by kind and by
+### the file's path, size and modification time, so a changed file misses.
+######
+
+def getFileKey( inFile ):
+### getFileKey
+#       Input : inFile (string)
+#       Output: key (string) path, size and mtime of the file
+#               Errors to None
+
+        try:
+                stat = os.stat( inFile )
+        except OSError:
+                return None
+
+        return os.path.abspath( inFile ) + '|' + str(stat.st_size) + '|' + str(int(stat.st_mtime))
+
+
+def openCache( inCacheDB ):
+### openCache
+#       Input : inCacheDB (string)
+#       Output: db_conn (sqlite3 connection)
+
+        cache_dir = os.path.dirname( os.path.abspath( inCacheDB ) )
+
+        if not os.path.isdir( cache_dir ):
+                os.makedirs( cache_dir )
+
+        db_conn = sqlite3.connect( inCacheDB, timeout=30 )
+        db_conn.execute( 'CREATE TABLE IF NOT EXISTS cache ( kind TEXT, key TEXT, value TEXT, PRIMARY KEY ( kind, key ) )' )
+
+        return db_conn
+
+
+def getCachedValue( inCacheDB, inKind, inFile ):
+### getCachedValue
+#       Input : inCacheDB (string), inKind (string), inFile (string)
+#       Output: value (JSON object)
+#               Errors to None
+
+        key = getFileKey( inFile )
+
+        if not inCacheDB or not key:
+                return None
+
+        db_conn = openCache( inCacheDB )
+
+        try:
+                row = db_conn.execute( 'SELECT value FROM cache WHERE kind = ? AND key = ?', ( inKind, key ) ).fetchone()
+        finally:
+                db_conn.close()
+
+        return json.loads( row[0] ) if row else None
+
+
+def setCachedValue( inCacheDB, inKind, inFile, inValue ):
+### setCachedValue
+#       Input : inCacheDB (string), inKind (string), inFile (string), inValue (JSON object)
+#       Output: None
+
+        key = getFileKey( inFile )
+
+        if not inCacheDB or not key:
+                return None
+
+        db_conn = openCache( inCacheDB )
+
+        try:
+                with db_conn:
+                        db_conn.execute( 'INSERT OR REPLACE INTO cache ( kind, key, value ) VALUES ( ?, ?, ? )',
+                                         ( inKind, key, json.dumps( inValue ) ) )
+        finally:
+                db_conn.close()
+
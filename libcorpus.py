@@ -0,0 +1,264 @@
+import cPickle
+import logging
+import os
+import sqlite3
+import sys
+import time
+import libmovie
+
+log = logging.getLogger('process_files.py')
+
+######
+### Recorded runs for offline simulation. recordTask wraps a processMovie task
+### and keeps every step it yields with the value sent back and how long the
+### driver took to answer it, so a corpus holds the ffprobe output, MVDB
+### responses and Plex rows of real files without the files themselves.
+### simulateCorpus runs processMovie again over the recording, feeding each
+### step its recorded value instead of running it, which takes the whole
+### pipeline's decision logic through thousands of files in seconds and shows
+### which dispositions change under new code or rules. processMovie does all
+### its file, network and database work in steps, so a replay has no side
+### effects: nothing is probed, read, fetched, written or removed.
+### A file whose replay asks for a different step than was recorded (the code
+### now probes something it didn't) is counted as diverged and left out.
+######
+
+def openCorpus( inCorpusDB ):
+### openCorpus
+#       Input : inCorpusDB (string)
+#       Output: db_conn (sqlite3 connection)
+
+        corpus_dir = os.path.dirname( os.path.abspath( inCorpusDB ) )
+
+        if not os.path.isdir( corpus_dir ):
+                os.makedirs( corpus_dir )
+
+        db_conn = sqlite3.connect( inCorpusDB, timeout=30 )
+        db_conn.execute( 'CREATE TABLE IF NOT EXISTS run ( key TEXT PRIMARY KEY, value BLOB )' )
+        db_conn.execute( 'CREATE TABLE IF NOT EXISTS files ( file TEXT PRIMARY KEY, result BLOB, seconds REAL, recorded REAL )' )
+        db_conn.execute( 'CREATE TABLE IF NOT EXISTS steps ( file TEXT, seq INTEGER, kind TEXT, name TEXT, value BLOB, \
+                          seconds REAL, failed INTEGER, PRIMARY KEY ( file, seq ) )' )
+
+        return db_conn
+
+
+def packValue( inValue ):
+### packValue
+#       Input : inValue (object)
+#       Output: blob (sqlite3.Binary)
+
+        return sqlite3.Binary( cPickle.dumps( inValue, cPickle.HIGHEST_PROTOCOL ) )
+
+
+def unpackValue( inBlob ):
+### unpackValue
+#       Input : inBlob (buffer) from packValue
+#       Output: value (object)
+
+        return cPickle.loads( str(inBlob) ) if inBlob != None else None
+
+
+def getStepName( inStep ):
+### getStepName
+#       Input : inStep (tuple) pipeline step
+#       Output: name (string) the program a probe runs, or the module and function a call runs
+
+        if inStep[0] == 'probe':
+                return os.path.basename( inStep[1][0] ) if inStep[1] else 'none'
+
+        return inStep[1].__module__ + '.' + inStep[1].__name__
+
+
+def saveRun( inCorpusDB, inFFProbe, inPlexDB, inSections, inOptions, inReplace ):
+### saveRun
+#       Input : inCorpusDB (string), inFFProbe (string), inPlexDB (string), inSections (dict) from libsections.getSectionIndex,
+#               inOptions (dict) see libmovie.processMovie, inReplace (BOOL)
+#       Output: None
+#               The arguments processMovie was run with, a replay runs with the same ones
+
+        options = dict( inOptions )
+        options['ledger_db'] = None
+
+        run = { 'ffprobe': inFFProbe, 'plexdb': inPlexDB, 'sections': inSections, 'options': options, 'replace': inReplace }
+
+        db_conn = openCorpus( inCorpusDB )
+
+        try:
+                with db_conn:
+                        for key in run:
+                                db_conn.execute( 'INSERT OR REPLACE INTO run ( key, value ) VALUES ( ?, ? )', ( key, packValue( run[key] ) ) )
+        finally:
+                db_conn.close()
+
+
+def saveFile( inCorpusDB, inFile, inSteps, inResult, inSeconds ):
+### saveFile
+#       Input : inCorpusDB (string), inFile (string), inSteps (list) of ( kind, name, value, seconds, failed ),
+#               inResult (dict) from processMovie, inSeconds (float) the file took end to end
+#       Output: None
+#               Replaces any earlier recording of the file
+
+        db_conn = openCorpus( inCorpusDB )
+
+        try:
+                with db_conn:
+                        db_conn.execute( 'DELETE FROM steps WHERE file = ?', ( inFile, ) )
+                        db_conn.executemany( 'INSERT INTO steps ( file, seq, kind, name, value, seconds, failed ) VALUES ( ?, ?, ?, ?, ?, ?, ? )',
+                                             [ ( inFile, seq, inSteps[seq][0], inSteps[seq][1], packValue( inSteps[seq][2] ), inSteps[seq][3],
+                                                 1 if inSteps[seq][4] else 0 ) for seq in range(len(inSteps)) ] )
+                        db_conn.execute( 'INSERT OR REPLACE INTO files ( file, result, seconds, recorded ) VALUES ( ?, ?, ?, ? )',
+                                         ( inFile, packValue( inResult ), inSeconds, time.time() ) )
+        finally:
+                db_conn.close()
+
+
+def recordTask( inCorpusDB, inFile, inTask ):
+### recordTask
+#       Input : inCorpusDB (string), inFile (string), inTask (generator) from libmovie.processMovie
+#       Output: generator of the same pipeline steps, the file is saved to the corpus when its result comes back
+#               Runs in whichever driver runs inTask, the recording is written from the driver's own thread
+
+        steps = []
+        start = time.time()
+
+        step = inTask.send( None )
+
+        while step[0] != 'result':
+                step_start = time.time()
+
+                try:
+                        value = yield step
+                except Exception, e:
+                        steps.append( ( step[0], getStepName( step ), None, time.time() - step_start, True ) )
+                        step = inTask.throw( *sys.exc_info() )
+                        continue
+
+                steps.append( ( step[0], getStepName( step ), value, time.time() - step_start, False ) )
+                step = inTask.send( value )
+
+        try:
+                saveFile( inCorpusDB, os.path.abspath( inFile ), steps, step[1], time.time() - start )
+        except sqlite3.Error, e:
+                log.warn('Unable to record ' + inFile + ' in ' + inCorpusDB + ': ' + str(e))
+
+        yield step
+
+
+def loadCorpus( inCorpusDB ):
+### loadCorpus
+#       Input : inCorpusDB (string)
+#       Output: corpus (dict) everything in memory, so a replay never waits on the disk
+#                       run (dict) from saveRun
+#                       files (list of dict) file, result, seconds, steps (list of ( kind, name, value, seconds, failed ))
+#               Errors to None
+
+        if not os.path.isfile( inCorpusDB ):
+                log.error('Corpus does not exist: ' + inCorpusDB)
+                return None
+
+        db_conn = openCorpus( inCorpusDB )
+
+        try:
+                run = dict([ ( key, unpackValue( value ) ) for key, value in db_conn.execute( 'SELECT key, value FROM run' ) ])
+
+                files = []
+                by_file = {}
+                for path, result, seconds in db_conn.execute( 'SELECT file, result, seconds FROM files ORDER BY file' ):
+                        by_file[path] = { 'file': path, 'result': unpackValue( result ), 'seconds': seconds, 'steps': [] }
+                        files.append( by_file[path] )
+
+                for path, kind, name, value, seconds, failed in db_conn.execute( 'SELECT file, kind, name, value, seconds, failed FROM steps ORDER BY file, seq' ):
+                        if path in by_file:
+                                by_file[path]['steps'].append( ( kind, name, unpackValue( value ), seconds, failed ) )
+        finally:
+                db_conn.close()
+
+        if not run.get('options'):
+                log.error('Corpus has no recorded run: ' + inCorpusDB)
+                return None
+
+        return { 'run': run, 'files': files }
+
+
+def replayTask( inTask, inSteps ):
+### replayTask
+#       Input : inTask (generator) from libmovie.processMovie, inSteps (list) recorded steps of the file
+#       Output: result (dict), diverged (BOOL) the task asked for a step that was not recorded
+#               Errors to None
+
+        seq = 0
+        result = None
+
+        try:
+                step = inTask.send( None )
+                while step[0] != 'result':
+                        if seq >= len(inSteps) or inSteps[seq][0] != step[0] or inSteps[seq][1] != getStepName( step ):
+                                return None, True
+
+                        kind, name, value, seconds, failed = inSteps[seq]
+                        seq += 1
+
+                        if failed:
+                                step = inTask.throw( RuntimeError, RuntimeError('Recorded step failed: ' + name) )
+                        else:
+                                step = inTask.send( value )
+                result = step[1]
+        except StopIteration:
+                result = None
+        except Exception, e:
+                log.exception('Replay failed: ' + str(e))
+                return None, True
+        finally:
+                inTask.close()
+
+        return result, seq != len(inSteps)
+
+
+def simulateCorpus( inCorpus, inRules=None ):
+### simulateCorpus
+#       Input : inCorpus (dict) from loadCorpus, inRules (dict) compiled candidate rules, the recorded ones if not given
+#       Output: report (dict)
+#                       files (int), seconds (float) the replay took, recorded_seconds (float) the files took when recorded,
+#                       steps (dict) of step name to { kind, count, seconds } recorded, so the time each stage waited on
+#                       ffprobe (probe), MVDB (http), Plex (db) or the disk (io),
+#                       diverged (list of file), changed (list of ( file, recorded disposition, replayed disposition ))
+
+        run = inCorpus['run']
+        options = dict( run['options'] )
+
+        if inRules:
+                options['rules'] = inRules
+
+        report = { 'files': len(inCorpus['files']), 'seconds': 0.0, 'recorded_seconds': 0.0, 'steps': {}, 'diverged': [], 'changed': [] }
+
+        for entry in inCorpus['files']:
+                report['recorded_seconds'] += entry['seconds']
+                for kind, name, value, seconds, failed in entry['steps']:
+                        stats = report['steps'].setdefault( name, { 'kind': kind, 'count': 0, 'seconds': 0.0 } )
+                        stats['count'] += 1
+                        stats['seconds'] += seconds
+
+        start = time.time()
+        replayed = []
+
+        for entry in inCorpus['files']:
+                task = libmovie.processMovie( entry['file'], run['ffprobe'], run['plexdb'], run['sections'], None, None, options )
+                replayed.append( replayTask( task, entry['steps'] ) )
+
+        report['seconds'] = time.time() - start
+
+        for idx in range(len(replayed)):
+                entry = inCorpus['files'][idx]
+                result, diverged = replayed[idx]
+
+                if diverged:
+                        report['diverged'].append( entry['file'] )
+                        continue
+
+                recorded = libmovie.getDisposition( entry['result'], run['replace'] )
+                disposition = libmovie.getDisposition( result, run['replace'] )
+
+                if recorded != disposition:
+                        report['changed'].append( ( entry['file'], recorded, disposition ) )
+
+        return report
@@ -2,77 +2,288 @@ from __future__ import division
 import json
 import os
 import subprocess
+from libmediainfo import VideoInfo, AudioInfo, BitrateInfo
 
-def getFFProbeInfo( inFFProbe, inFile, inStream ):
-### getFFProbeInfo
+def getFFProbeCmd( inFFProbe, inFile, inStream ):
+### getFFProbeCmd
 #       Input: inFFProbe (string), inFile (string), inStream (string)
-#       Output: res (JSON object)
+#       Output: cmd (list)
 #               Errors to None
 
         ffprobe_path = os.path.abspath( inFFProbe ) if inFFProbe else None
 
-        res = None
+        cmd = None
 
-        if os.path.isfile( inFile ) and inStream in ['a', 'v', 's'] and ffprobe_path:
+        if inFile and inStream in ['a', 'v', 's'] and ffprobe_path:
                 cmd = [ ffprobe_path ]
                 arg = '-v quiet -print_format json -select_streams ' + inStream + ': -show_streams'
 
                 cmd = cmd + arg.split()
                 cmd.append(inFile)
 
+        return cmd
+
+
+def runFFProbe( inCmd, inStderr=False ):
+### runFFProbe
+#       Input: inCmd (list), inStderr (BOOL) return what the command logs to stderr instead of stdout
+#       Output: output (string)
+#               Errors to None
+
+        output = None
+
+        if inCmd and inStderr:
                 try:
-                        output = subprocess.check_output( cmd )
+                        proc = subprocess.Popen( inCmd, stdout=open( os.devnull, 'w' ), stderr=subprocess.PIPE )
+                        output = proc.communicate()[1]
+                        output = output if proc.returncode == 0 else None
+                except Exception, e:
+                        output = None
+        elif inCmd:
+                try:
+                        output = subprocess.check_output( inCmd )
                 except Exception, e:
                         output = None
 
-                if output:
-                        try:
-                                res = json.loads(output)
-                        except ValueError:
-                                res = None
+        return output
+
+
+def parseFFProbeOutput( inOutput ):
+### parseFFProbeOutput
+#       Input: inOutput (string)
+#       Output: res (JSON object)
+#               Errors to None
+
+        res = None
+
+        if inOutput:
+                try:
+                        res = json.loads(inOutput)
+                except ValueError:
+                        res = None
 
         return res
 
-def calcBitRate( inFFProbe, inFile ):
-### calcBitRate
+
+def getFFProbeInfo( inFFProbe, inFile, inStream ):
+### getFFProbeInfo
+#       Input: inFFProbe (string), inFile (string), inStream (string)
+#       Output: res (JSON object)
+#               Errors to None
+
+        cmd = getFFProbeCmd( inFFProbe, inFile, inStream )
+
+        return parseFFProbeOutput( runFFProbe( cmd ) )
+
+def getDurationCmd( inFFProbe, inFile ):
+### getDurationCmd
 #       Input : inFFProbe (string), inFile (string)
-#       Output: bitrate (int)
+#       Output: cmd (list)
 #               Errors to None
 
         ffprobe_path = os.path.abspath( inFFProbe ) if inFFProbe else None
 
-        bitrate = None
-        filesize = 0
-        duration = 0
+        cmd = None
 
-        if os.path.isfile( inFile ) and ffprobe_path:
+        if inFile and ffprobe_path:
                 cmd = [ ffprobe_path ]
                 arg = '-v quiet -show_entries format=duration -of default=noprint_wrappers=1:nokey=1'
 
                 cmd = cmd + arg.split()
                 cmd.append(inFile)
 
-                try:
-                        output = subprocess.check_output( cmd )
-                except Exception, e:
-                        output = 0
+        return cmd
+
+
+def parseDuration( inOutput ):
+### parseDuration
+#       Input : inOutput (string) output of the getDurationCmd command
+#       Output: duration (float)
+#               Errors to 0
+
+        try:
+                duration = float(inOutput) if inOutput else 0
+        except ValueError:
+                duration = 0
+
+        return duration
+
 
-                duration = float(output) if output else 0
+def calcBitRateFromOutput( inFile, inOutput, inFileSize=None ):
+### calcBitRateFromOutput
+#       Input : inFile (string), inOutput (string), inFileSize (int) if already known
+#       Output: bitrate (int)
+#               Errors to None
+
+        bitrate = None
+        filesize = int(inFileSize) if inFileSize else 0
+
+        duration = parseDuration( inOutput )
 
+        if duration and not filesize and os.path.isfile( inFile ):
                 filesize = os.path.getsize(inFile)
 
         if filesize and duration:
                 bitrate = ( filesize * 8 ) / duration
-                
+
         bitrate = int(bitrate) if bitrate else None
 
         return bitrate
 
 
+def getPacketSampleCmd( inFFProbe, inFile, inDuration, inWindows, inSeconds ):
+### getPacketSampleCmd
+#       Input : inFFProbe (string), inFile (string), inDuration (float), inWindows (int), inSeconds (int)
+#       Output: cmd (list) reading only the video packet headers in inWindows windows of inSeconds,
+#               spread evenly through the file. Nothing is decoded.
+#               Errors to None
+
+        ffprobe_path = os.path.abspath( inFFProbe ) if inFFProbe else None
+        duration = float(inDuration) if inDuration else 0
+        windows = int(inWindows) if inWindows else 0
+        seconds = int(inSeconds) if inSeconds else 0
+
+        cmd = None
+
+        if inFile and ffprobe_path and duration and windows and seconds:
+                seconds = min( seconds, int( duration / windows ) )
+                intervals = []
+
+                for idx in range(windows):
+                        start = max( 0, ( duration * ( idx + 0.5 ) / windows ) - ( seconds / 2 ) )
+                        intervals.append( str(round(start, 3)) + '%+' + str(seconds) )
+
+                cmd = [ ffprobe_path ]
+                arg = '-v quiet -print_format json -select_streams v:0 -show_entries packet=pts_time,duration_time,size'
+
+                cmd = cmd + arg.split()
+                cmd = cmd + [ '-read_intervals', ','.join(intervals) ]
+                cmd.append(inFile)
+
+        return cmd
+
+
+def calcPacketStats( inJSON ):
+### calcPacketStats
+#       Input : inJSON (JSON object) output of the getPacketSampleCmd command
+#       Output: BitrateInfo( bitrate (int), peak (int), stddev (int), seconds (float) )
+#               bitrate is the average over all sampled windows, peak and stddev are over
+#               whole seconds inside the windows
+#               Errors to None
+
+        packets = inJSON.get('packets') if inJSON else None
+
+        if not packets:
+                return None
+
+        ### Split packets into windows wherever there is a jump of more than 2 seconds
+        samples = []
+        for packet in packets:
+                try:
+                        pts = float(packet['pts_time'])
+                        size = int(packet['size'])
+                except (KeyError, ValueError):
+                        continue
+                try:
+                        dur = float(packet.get('duration_time'))
+                except (TypeError, ValueError):
+                        dur = 0
+                samples.append( ( pts, dur, size ) )
+
+        samples.sort()
+
+        windows = []
+        for sample in samples:
+                if not windows or sample[0] - windows[-1][-1][0] > 2:
+                        windows.append( [] )
+                windows[-1].append( sample )
+
+        total_bytes = 0
+        total_time = 0
+        buckets = []
+
+        for window in windows:
+                start = window[0][0]
+                end = max([ pts + dur for pts, dur, size in window ])
+                if end <= start:
+                        continue
+
+                total_bytes += sum([ size for pts, dur, size in window ])
+                total_time += end - start
+
+                ### Only whole seconds, the partial ones at the edges would skew the peak
+                second_bytes = {}
+                for pts, dur, size in window:
+                        second = int( pts - start )
+                        second_bytes[second] = second_bytes.get( second, 0 ) + size
+
+                for second in range( 1, int( end - start ) - 1 ):
+                        buckets.append( second_bytes.get( second, 0 ) * 8 )
+
+        if not total_time:
+                return None
+
+        bitrate = total_bytes * 8 / total_time
+
+        if buckets:
+                mean = sum(buckets) / len(buckets)
+                peak = max(buckets)
+                stddev = ( sum([ ( b - mean ) ** 2 for b in buckets ]) / len(buckets) ) ** 0.5
+        else:
+                peak = bitrate
+                stddev = 0
+
+        return BitrateInfo( int(bitrate), int(peak), int(stddev), round(total_time, 3) )
+
+
+def getCropDetectCmd( inFFmpeg, inFile, inTime, inSeconds ):
+### getCropDetectCmd
+#       Input : inFFmpeg (string), inFile (string), inTime (float), inSeconds (int)
+#       Output: cmd (list) running cropdetect over the keyframes of inSeconds starting at inTime,
+#               the crop it finds is logged to stderr
+#               Errors to None
+
+        ffmpeg_path = os.path.abspath( inFFmpeg ) if inFFmpeg else None
+        seconds = int(inSeconds) if inSeconds else 0
+
+        cmd = None
+
+        if inFile and ffmpeg_path and seconds:
+                cmd = [ ffmpeg_path ]
+                arg = '-v info -nostdin -nostats -timelimit ' + str(seconds) + ' -skip_frame nokey -ss ' + str(round(float(inTime), 3))
+
+                cmd = cmd + arg.split()
+                cmd = cmd + [ '-i', inFile ]
+                cmd = cmd + ( '-t ' + str(seconds) + ' -map 0:v:0 -vf cropdetect=limit=24:round=2:reset=0 -f null -' ).split()
+
+        return cmd
+
+
+def parseCropDetect( inOutput ):
+### parseCropDetect
+#       Input : inOutput (string) stderr of the getCropDetectCmd command
+#       Output: width (int), height (int) of the last crop cropdetect logged
+#               Errors to None, None
+
+        width = None
+        height = None
+
+        for line in ( inOutput.splitlines() if inOutput else [] ):
+                if 'crop=' in line:
+                        crop = line.rsplit( 'crop=', 1 )[1].split(':')
+                        try:
+                                width = int(crop[0])
+                                height = int(crop[1])
+                        except (IndexError, ValueError):
+                                continue
+
+        return width, height
+
+
 def getVideoInfo( inJSON ):
 ### getVideoInfo
 #       Input: inJSON (JSON object)
-#       Output: codec (string), birate (int), aspect (float), pixels (int), framerate (float)
+#       Output: VideoInfo( codec (string), birate (int), aspect (float), pixels (int), framerate (float) )
 #               Errors to None
 
         try:
@@ -117,13 +328,13 @@ def getVideoInfo( inJSON ):
                 pixels = int(pixels) if pixels else None
                 framerate = float(framerate) if framerate else None
 
-                return codec, bitrate, aspect, pixels, framerate
+                return VideoInfo( codec, bitrate, aspect, pixels, framerate )
 
 
 def getAudioInfo( inJSON ):
 ### getAudioInfo
 #       Input: inJSON (JSON object)
-#       Output: language (string), channels (int), bitrate (string)
+#       Output: AudioInfo( codec (string), language (string), channels (int), bitrate (int) )
 #               Errors to None
         try:
                 isJSON = json.dumps(inJSON)
@@ -188,7 +399,7 @@ def getAudioInfo( inJSON ):
         channels = int(channels) if channels else None
         language = str(language) if language else None
 
-        return codec, language, channels, bitrate
+        return AudioInfo( codec, language, channels, bitrate )
 
 
 def hasEngSubtitles( inJSON ):
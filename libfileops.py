@@ -0,0 +1,228 @@
+from __future__ import division
+import logging
+import os
+import shutil
+import tempfile
+import time
+import libffprobe
+
+log = logging.getLogger('process_files.py')
+
+### Buffer size for copying movie files
+copy_buffer = 4 * 1024 * 1024
+
+######
+### Replacing a library file is done in steps so a crash or a bad copy never
+### leaves a half-written file where Plex can see it:
+###       copy      the new file into a hidden temp file next to the old one, or
+###                 hard link it there when it is already on the same filesystem
+###       verify    the temp file has the same size and duration as the new file
+###       trash     the old file is hard linked (or copied) into the trash area
+###       swap      the temp file is renamed over the old one, which is atomic
+###                 on the same filesystem
+###       cleanup   the download and, if the extension changed, the old name are removed
+### A failed step removes the temp file and leaves the library untouched.
+### rollbackReplace puts a trashed file back.
+######
+
+def getFileSize( inFile ):
+### getFileSize
+#       Input : inFile (string)
+#       Output: size (int)
+#               Errors to None
+
+        if not os.path.isfile( inFile ):
+                return None
+
+        return os.path.getsize( inFile )
+
+
+def copyFile( inSource, inTarget ):
+### copyFile
+#       Input : inSource (string), inTarget (string) open file object
+#       Output: bytes (int)
+
+        copied = 0
+
+        with open( inSource, 'rb' ) as source:
+                while True:
+                        buf = source.read( copy_buffer )
+                        if not buf:
+                                break
+                        inTarget.write( buf )
+                        copied += len(buf)
+
+        inTarget.flush()
+        os.fsync( inTarget.fileno() )
+
+        return copied
+
+
+def getDuration( inFFProbe, inFile ):
+### getDuration
+#       Input : inFFProbe (string), inFile (string)
+#       Output: duration (float)
+#               Errors to None
+
+        output = libffprobe.runFFProbe( libffprobe.getDurationCmd( inFFProbe, inFile ) )
+
+        return libffprobe.parseDuration( output ) or None
+
+
+def verifyCopy( inFFProbe, inSource, inCopy ):
+### verifyCopy
+#       Input : inFFProbe (string), inSource (string), inCopy (string)
+#       Output: ok (BOOL), reason (string)
+
+        if os.path.getsize( inSource ) != os.path.getsize( inCopy ):
+                return False, 'size mismatch'
+
+        src_duration = getDuration( inFFProbe, inSource )
+        copy_duration = getDuration( inFFProbe, inCopy )
+
+        if not copy_duration:
+                return False, 'copy could not be probed'
+
+        if src_duration and abs( src_duration - copy_duration ) > 0.01:
+                return False, 'duration mismatch'
+
+        return True, ''
+
+
+def trashFile( inFile, inTrashDir, inReplacement ):
+### trashFile
+#       Input : inFile (string), inTrashDir (string), inReplacement (string) path of the file replacing it
+#       Output: trash_file (string), bytes (int) copied, 0 when it could be hard linked
+
+        if not os.path.isdir( inTrashDir ):
+                os.makedirs( inTrashDir )
+
+        ### A directory of its own for every replacement, two in the same second must not share one
+        trash_dir = tempfile.mkdtemp( dir=inTrashDir, prefix=time.strftime('%Y%m%d-%H%M%S') + '-' )
+
+        trash_file = os.path.join( trash_dir, os.path.basename(inFile) )
+
+        ### Remember where it came from, and what replaced it, for rollbackReplace
+        with open( trash_file + '.origin', 'w' ) as origin:
+                origin.write( inFile + '\n' + inReplacement + '\n' )
+
+        try:
+                os.link( inFile, trash_file )
+                copied = 0
+        except OSError:
+                shutil.copy2( inFile, trash_file )
+                copied = os.path.getsize( trash_file )
+
+        return trash_file, copied
+
+
+def replaceFile( inSource, inOldFile, inFFProbe, inTrashDir ):
+### replaceFile
+#       Input : inSource (string), inOldFile (string), inFFProbe (string), inTrashDir (string)
+#       Output: target (string), steps (list of ( step, seconds, bytes ))
+#               Errors to None, steps
+#               A copy is checked with verifyCopy before the swap. A hard link on the same filesystem is
+#               the source itself and is trusted without verification.
+
+        target_dir = os.path.dirname( inOldFile )
+        target = os.path.splitext( inOldFile )[0] + os.path.splitext( inSource )[1]
+
+        steps = []
+        temp_file = None
+
+        def step( inName, inStart, inBytes ):
+                seconds = time.time() - inStart
+                steps.append( ( inName, seconds, inBytes ) )
+                log.info('Replace ' + inName + ': ' + str(round(seconds, 2)) + 's, ' + str(int( inBytes / 1000000 )) + 'MB')
+
+        try:
+                start = time.time()
+                fd, temp_file = tempfile.mkstemp( dir=target_dir, prefix='.' + os.path.basename(target) + '.', suffix='.partial' )
+                if os.stat( inSource ).st_dev == os.stat( target_dir ).st_dev:
+                        ### Same filesystem, a hard link is as good as a copy
+                        os.close( fd )
+                        os.remove( temp_file )
+                        os.link( inSource, temp_file )
+                        linked = True
+                        copied = 0
+                else:
+                        with os.fdopen( fd, 'wb' ) as temp:
+                                copied = copyFile( inSource, temp )
+                        linked = False
+                shutil.copymode( inOldFile, temp_file )
+                step( 'link' if linked else 'copy', start, copied )
+
+                ### Checking a hard link would compare the source with itself
+                if not linked:
+                        start = time.time()
+                        ok, reason = verifyCopy( inFFProbe, inSource, temp_file )
+                        step( 'verify', start, 0 )
+                        if not ok:
+                                log.error('Replace verify failed for ' + temp_file + ': ' + reason)
+                                os.remove( temp_file )
+                                return None, steps
+
+                start = time.time()
+                trash_file, copied = trashFile( inOldFile, inTrashDir, target )
+                step( 'trash', start, copied )
+                log.info('Old file kept for rollback: ' + trash_file)
+
+                start = time.time()
+                os.rename( temp_file, target )
+                temp_file = None
+                step( 'swap', start, 0 )
+
+                start = time.time()
+                if target != inOldFile:
+                        os.remove( inOldFile )
+                os.remove( inSource )
+                step( 'cleanup', start, 0 )
+
+        except (IOError, OSError), e:
+                log.error('Replace failed for ' + inOldFile + ': ' + str(e))
+                if temp_file and os.path.exists( temp_file ):
+                        os.remove( temp_file )
+                return None, steps
+
+        return target, steps
+
+
+def rollbackReplace( inTrashFile ):
+### rollbackReplace
+#       Input : inTrashFile (string)
+#       Output: restored (string) path the file was put back to
+#               Errors to None
+
+        try:
+                with open( inTrashFile + '.origin' ) as origin:
+                        restored, replacement = origin.read().splitlines()[:2]
+        except (IOError, ValueError):
+                log.error('Rollback failed, no origin recorded for ' + inTrashFile)
+                return None
+
+        try:
+                if not os.path.isdir( os.path.dirname( restored ) ):
+                        os.makedirs( os.path.dirname( restored ) )
+
+                ### Put the old file back under a temp name first so the swap is atomic
+                temp_file = restored + '.rollback'
+                try:
+                        os.link( inTrashFile, temp_file )
+                except OSError:
+                        shutil.copy2( inTrashFile, temp_file )
+                os.rename( temp_file, restored )
+
+                if replacement != restored and os.path.exists( replacement ):
+                        os.remove( replacement )
+
+                os.remove( inTrashFile )
+                os.remove( inTrashFile + '.origin' )
+
+        except (IOError, OSError), e:
+                log.error('Rollback failed for ' + inTrashFile + ': ' + str(e))
+                return None
+
+        log.info('Rolled back ' + restored)
+
+        return restored
+
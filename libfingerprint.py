@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import libcache
+
+log = logging.getLogger('process_files.py')
+
+######
+### Content fingerprints for spotting the same release a second time (a
+### re-download, another tracker, a retry) before anything is probed.
+### A fingerprint is the file size and a SHA-1 over a few chunks at fixed
+### offsets, each read in one large sequential read, so even a 50GB file costs
+### a handful of MB of reading. The index holds the fingerprints of processed
+### downloads, with their disposition, and of library files, either as they
+### are moved in or from indexLibrary. A download matching one of them is an
+### exact repeat and is removed without running the pipeline. Within a batch,
+### a download matching one seen earlier in the same batch is a repeat too.
+######
+
+### Chunks hashed per file and the size of each
+fingerprint_chunks = 4
+chunk_size = 1024 * 1024
+
+### Dispositions of an earlier download that make a later identical one redundant
+repeat_dispositions = ( 'library', 'replace', 'staging', 'remove' )
+
+### Dispositions that moved a download into the library, it is a repeat only while the library copy is
+library_dispositions = ( 'library', 'replace' )
+
+### Guards the fingerprints seen in the current batch, findRepeat may run on several DB threads
+seen_lock = threading.Lock()
+
+def openIndex( inIndexDB ):
+### openIndex
+#       Input : inIndexDB (string)
+#       Output: db_conn (sqlite3 connection)
+
+        index_dir = os.path.dirname( os.path.abspath( inIndexDB ) )
+
+        if not os.path.isdir( index_dir ):
+                os.makedirs( index_dir )
+
+        db_conn = sqlite3.connect( inIndexDB, timeout=30 )
+        db_conn.execute( 'CREATE TABLE IF NOT EXISTS fingerprints ( path TEXT PRIMARY KEY, size INTEGER, digest TEXT, file_key TEXT, \
+                          kind TEXT, disposition TEXT, updated REAL )' )
+        db_conn.execute( 'CREATE INDEX IF NOT EXISTS fingerprints_size_digest ON fingerprints ( size, digest )' )
+
+        return db_conn
+
+
+def getFingerprint( inFile, inChunks=None, inChunkSize=None ):
+### getFingerprint
+#       Input : inFile (string), inChunks (int), inChunkSize (int)
+#       Output: fingerprint (tuple) ( size, hex digest of the chunks ), small files are hashed whole
+#               Errors to None
+
+        chunks = int(inChunks) if inChunks else fingerprint_chunks
+        size_of_chunk = int(inChunkSize) if inChunkSize else chunk_size
+
+        try:
+                size = os.path.getsize( inFile )
+
+                if size <= chunks * size_of_chunk or chunks < 2:
+                        ranges = [ ( 0, size ) ]
+                else:
+                        ### First and last chunk plus evenly spaced ones between, in file order
+                        ranges = [ ( ( size - size_of_chunk ) * idx // ( chunks - 1 ), size_of_chunk ) for idx in range(chunks) ]
+
+                digest = hashlib.sha1()
+
+                with open( inFile, 'rb' ) as f:
+                        for offset, length in ranges:
+                                f.seek( offset )
+                                data = f.read( length )
+                                if len(data) != length:
+                                        log.warn('Short read fingerprinting ' + inFile)
+                                        return None
+                                digest.update( data )
+        except ( IOError, OSError ), e:
+                log.warn('Unable to fingerprint ' + inFile + ': ' + str(e))
+                return None
+
+        return ( size, digest.hexdigest() )
+
+
+def findRepeat( inIndexDB, inFingerprint, inFile, inSeen=None ):
+### findRepeat
+#       Input : inIndexDB (string), inFingerprint (tuple) from getFingerprint, inFile (string) being processed,
+#               inSeen (dict) of fingerprint to path, shared by every file of the current batch
+#       Output: path (string) of an identical library file, of an identical download that went to staging or
+#               was removed, or of an identical download earlier in the batch
+#               Errors to None
+
+        if not inIndexDB or not inFingerprint:
+                return None
+
+        full_path = os.path.abspath( inFile )
+        size, digest = inFingerprint
+
+        db_conn = openIndex( inIndexDB )
+        own_library = False
+
+        try:
+                rows = db_conn.execute( 'SELECT path, kind, disposition FROM fingerprints WHERE size = ? AND digest = ? \
+                                         ORDER BY kind DESC, updated DESC', ( size, digest ) ).fetchall()
+
+                for path, kind, disposition in rows:
+                        if kind == 'library':
+                                ### A library file is never a repeat of itself
+                                if path == full_path:
+                                        own_library = True
+                                        continue
+
+                                ### Library files get replaced and deleted, drop the ones that are gone
+                                if os.path.isfile( path ):
+                                        return path
+                                with db_conn:
+                                        db_conn.execute( 'DELETE FROM fingerprints WHERE path = ?', ( path, ) )
+
+                        ### A download moved into the library is saved with a library row of the same
+                        ### fingerprint, which comes first and matches while the library copy is there.
+                        ### Once that copy is gone the download is no repeat either, drop it with it.
+                        elif disposition in library_dispositions:
+                                if not own_library:
+                                        with db_conn:
+                                                db_conn.execute( 'DELETE FROM fingerprints WHERE path = ?', ( path, ) )
+
+                        ### A download is only saved once it has left its path, so one at the same
+                        ### path now is the same release arriving again
+                        elif disposition in repeat_dispositions:
+                                return path
+        finally:
+                db_conn.close()
+
+        ### The first copy in a batch is processed, later identical ones are repeats of it.
+        ### If the first copy fails it stays in the downloads, so nothing is lost.
+        if inSeen != None:
+                with seen_lock:
+                        first = inSeen.setdefault( inFingerprint, full_path )
+                if first != full_path:
+                        return first
+
+        return None
+
+
+def putFingerprint( inDBConn, inFile, inFingerprint, inFileKey, inKind, inDisposition ):
+### putFingerprint
+#       Input : inDBConn (sqlite3 connection) from openIndex, inFile (string), inFingerprint (tuple) from getFingerprint,
+#               inFileKey (string) from libcache.getFileKey, inKind (string), inDisposition (string)
+#       Output: None
+
+        with inDBConn:
+                inDBConn.execute( 'INSERT OR REPLACE INTO fingerprints ( path, size, digest, file_key, kind, disposition, updated ) \
+                                   VALUES ( ?, ?, ?, ?, ?, ?, ? )', ( os.path.abspath( inFile ), inFingerprint[0], inFingerprint[1],
+                                                                      inFileKey, inKind, inDisposition, time.time() ) )
+
+
+def saveFingerprint( inIndexDB, inFile, inFingerprint, inKind, inDisposition=None ):
+### saveFingerprint
+#       Input : inIndexDB (string), inFile (string), inFingerprint (tuple) from getFingerprint,
+#               inKind (string) 'download' or 'library', inDisposition (string) from libmovie.getDisposition
+#       Output: None
+
+        if not inIndexDB or not inFingerprint:
+                return
+
+        db_conn = openIndex( inIndexDB )
+
+        try:
+                putFingerprint( db_conn, inFile, inFingerprint, libcache.getFileKey( inFile ), inKind, inDisposition )
+        finally:
+                db_conn.close()
+
+
+def indexLibrary( inIndexDB, inFiles ):
+### indexLibrary
+#       Input : inIndexDB (string), inFiles (iterable of string) library files
+#       Output: indexed (int), unchanged (int) already indexed with the same path, size and mtime, missing (int)
+
+        indexed = 0
+        unchanged = 0
+        missing = 0
+
+        db_conn = openIndex( inIndexDB )
+
+        try:
+                for path in inFiles:
+                        path = os.path.abspath( path )
+                        file_key = libcache.getFileKey( path )
+
+                        if not file_key:
+                                missing += 1
+                                continue
+
+                        row = db_conn.execute( 'SELECT file_key FROM fingerprints WHERE path = ?', ( path, ) ).fetchone()
+                        if row and row[0] == file_key:
+                                unchanged += 1
+                                continue
+
+                        fingerprint = getFingerprint( path )
+                        if not fingerprint:
+                                missing += 1
+                                continue
+
+                        putFingerprint( db_conn, path, fingerprint, file_key, 'library', None )
+                        indexed += 1
+        finally:
+                db_conn.close()
+
+        return indexed, unchanged, missing
@@ -0,0 +1,180 @@
+import json
+import os
+import sqlite3
+import time
+import libcache
+
+######
+### Processing ledger. One row per file records what each stage of
+### libmovie.processMovie found, so a batch that stops part way through can
+### pick up where it left off:
+###       probe     MediaInfo of the download, sampled bitrate, duration
+###       match     MVDB title, year and high-def genre
+###       plex      whether it is a duplicate, the library file and its MediaInfo
+###       score     spot check and the remove/staging/error decision
+###       done      the disposition that was carried out
+### Stored stages are only trusted while the file's path, size and mtime match.
+######
+
+ledger_stages = [ 'probe', 'match', 'plex', 'score' ]
+
+def openLedger( inLedgerDB ):
+### openLedger
+#       Input : inLedgerDB (string)
+#       Output: db_conn (sqlite3 connection)
+
+        ledger_dir = os.path.dirname( os.path.abspath( inLedgerDB ) )
+
+        if not os.path.isdir( ledger_dir ):
+                os.makedirs( ledger_dir )
+
+        db_conn = sqlite3.connect( inLedgerDB, timeout=30 )
+        db_conn.execute( 'CREATE TABLE IF NOT EXISTS files ( path TEXT PRIMARY KEY, file_key TEXT, stage TEXT, \
+                          probe TEXT, match TEXT, plex TEXT, score TEXT, disposition TEXT, updated REAL )' )
+
+        return db_conn
+
+
+def loadEntry( inLedgerDB, inFile ):
+### loadEntry
+#       Input : inLedgerDB (string), inFile (string)
+#       Output: entry (dict) with file_key, stage, disposition and the facts of each stored stage
+#               Errors to None
+
+        if not inLedgerDB:
+                return None
+
+        db_conn = openLedger( inLedgerDB )
+
+        try:
+                row = db_conn.execute( 'SELECT file_key, stage, probe, match, plex, score, disposition FROM files WHERE path = ?',
+                                       ( os.path.abspath( inFile ), ) ).fetchone()
+        finally:
+                db_conn.close()
+
+        if not row:
+                return None
+
+        entry = { 'file_key': row[0], 'stage': row[1], 'disposition': row[6] }
+
+        for idx in range(len(ledger_stages)):
+                entry[ledger_stages[idx]] = json.loads( row[2 + idx] ) if row[2 + idx] else None
+
+        return entry
+
+
+def getStoredStages( inEntry, inFileKey ):
+### getStoredStages
+#       Input : inEntry (dict) from loadEntry, inFileKey (string) from libcache.getFileKey
+#       Output: stages (dict) of stage name to facts, only for the stages that can be trusted
+
+        stages = {}
+
+        if not inEntry or inEntry['file_key'] != inFileKey:
+                return stages
+
+        ### Each stage builds on the ones before it, stop at the first gap
+        for stage in ledger_stages:
+                if inEntry.get(stage) == None:
+                        break
+                stages[stage] = inEntry[stage]
+
+        return stages
+
+
+def saveStage( inLedgerDB, inFile, inFileKey, inStage, inFacts ):
+### saveStage
+#       Input : inLedgerDB (string), inFile (string), inFileKey (string), inStage (string), inFacts (JSON object)
+#       Output: None
+#               Saving a stage clears the stages after it, they were worked out from older facts
+
+        if not inLedgerDB or inStage not in ledger_stages:
+                return None
+
+        path = os.path.abspath( inFile )
+        later = ledger_stages[ledger_stages.index(inStage) + 1:]
+
+        db_conn = openLedger( inLedgerDB )
+
+        try:
+                with db_conn:
+                        row = db_conn.execute( 'SELECT file_key FROM files WHERE path = ?', ( path, ) ).fetchone()
+
+                        if not row or row[0] != inFileKey:
+                                db_conn.execute( 'INSERT OR REPLACE INTO files ( path, file_key ) VALUES ( ?, ? )', ( path, inFileKey ) )
+
+                        sets = [ inStage + ' = ?', 'stage = ?', 'disposition = NULL', 'updated = ?' ] + [ stage + ' = NULL' for stage in later ]
+                        db_conn.execute( 'UPDATE files SET ' + ', '.join(sets) + ' WHERE path = ?',
+                                         ( json.dumps( inFacts ), inStage, time.time(), path ) )
+        finally:
+                db_conn.close()
+
+
+def updateStage( inLedgerDB, inFile, inStage, inFacts ):
+### updateStage
+#       Input : inLedgerDB (string), inFile (string), inStage (string), inFacts (JSON object)
+#       Output: None
+#               Rewrites one stage in place, for re-scoring, leaving the rest of the entry alone
+
+        if not inLedgerDB or inStage not in ledger_stages:
+                return None
+
+        db_conn = openLedger( inLedgerDB )
+
+        try:
+                with db_conn:
+                        db_conn.execute( 'UPDATE files SET ' + inStage + ' = ?, updated = ? WHERE path = ?',
+                                         ( json.dumps( inFacts ), time.time(), os.path.abspath( inFile ) ) )
+        finally:
+                db_conn.close()
+
+
+def markDone( inLedgerDB, inFile, inDisposition ):
+### markDone
+#       Input : inLedgerDB (string), inFile (string), inDisposition (string)
+#       Output: None
+
+        if not inLedgerDB:
+                return None
+
+        db_conn = openLedger( inLedgerDB )
+
+        try:
+                with db_conn:
+                        db_conn.execute( 'UPDATE files SET stage = ?, disposition = ?, updated = ? WHERE path = ?',
+                                         ( 'done', inDisposition, time.time(), os.path.abspath( inFile ) ) )
+        finally:
+                db_conn.close()
+
+
+def isDone( inLedgerDB, inFile ):
+### isDone
+#       Input : inLedgerDB (string), inFile (string)
+#       Output: BOOL, the file was dispositioned and has not been replaced by a different file since
+
+        entry = loadEntry( inLedgerDB, inFile )
+
+        if not entry or entry['stage'] != 'done':
+                return False
+
+        ### Moved or deleted, or still there untouched, either way it is finished
+        file_key = libcache.getFileKey( inFile )
+
+        return not file_key or file_key == entry['file_key']
+
+
+def iterScoredEntries( inLedgerDB ):
+### iterScoredEntries
+#       Input : inLedgerDB (string)
+#       Output: generator of ( path, entry ) for every file that got as far as scoring
+
+        db_conn = openLedger( inLedgerDB )
+
+        try:
+                paths = [ row[0] for row in db_conn.execute( 'SELECT path FROM files WHERE score IS NOT NULL ORDER BY path' ) ]
+        finally:
+                db_conn.close()
+
+        for path in paths:
+                yield path, loadEntry( inLedgerDB, path )
+
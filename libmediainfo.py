@@ -0,0 +1,96 @@
+######
+### Compact records for what we know about a file's video, audio and subtitles.
+### Both libffprobe and libplexdb return these so the scoring in libscore can
+### compare a download against a library file field by field. __slots__ keeps
+### them small when a batch or the audit holds many of them, and toDict/fromDict
+### turn them into plain JSON-friendly dicts for caches.
+######
+
+class MediaRecord(object):
+### MediaRecord
+#       Base class, subclasses only list their fields in __slots__
+
+        __slots__ = ()
+
+        def __init__( self, *inArgs, **inKwargs ):
+                for idx in range(len(self.__slots__)):
+                        name = self.__slots__[idx]
+                        value = inArgs[idx] if idx < len(inArgs) else inKwargs.get(name)
+                        setattr( self, name, value )
+
+        def __eq__( self, inOther ):
+                if type(self) != type(inOther):
+                        return NotImplemented
+                return self.toTuple() == inOther.toTuple()
+
+        def __ne__( self, inOther ):
+                res = self.__eq__( inOther )
+                return res if res is NotImplemented else not res
+
+        def __repr__( self ):
+                fields = [ name + '=' + repr(getattr( self, name )) for name in self.__slots__ ]
+                return self.__class__.__name__ + '(' + ', '.join(fields) + ')'
+
+        def toTuple( self ):
+                return tuple([ getattr( self, name ) for name in self.__slots__ ])
+
+        def toDict( self ):
+                return dict([ ( name, getattr( self, name ) ) for name in self.__slots__ ])
+
+        @classmethod
+        def fromDict( cls, inDict ):
+                return cls( **inDict ) if inDict else None
+
+
+class VideoInfo(MediaRecord):
+### VideoInfo
+#       codec (string), bitrate (int), aspect (float), pixels (int), framerate (float),
+#       active_pixels (int) inside any black bars, when crop detection ran
+
+        __slots__ = ( 'codec', 'bitrate', 'aspect', 'pixels', 'framerate', 'active_pixels' )
+
+
+class AudioInfo(MediaRecord):
+### AudioInfo
+#       codec (string), language (string), channels (int), bitrate (int)
+
+        __slots__ = ( 'codec', 'language', 'channels', 'bitrate' )
+
+
+class BitrateInfo(MediaRecord):
+### BitrateInfo
+#       bitrate (int), peak (int), stddev (int), seconds (float) measured from sampled packets
+
+        __slots__ = ( 'bitrate', 'peak', 'stddev', 'seconds' )
+
+
+class QualityInfo(MediaRecord):
+### QualityInfo
+#       frames (int), blockiness (float), sharpness (float), active_aspect (float), seconds (float)
+#       measured from decoded keyframes
+
+        __slots__ = ( 'frames', 'blockiness', 'sharpness', 'active_aspect', 'seconds' )
+
+
+class MediaInfo(MediaRecord):
+### MediaInfo
+#       video (VideoInfo), audio (AudioInfo), eng_subtitles (BOOL), quality (QualityInfo) when spot checked
+
+        __slots__ = ( 'video', 'audio', 'eng_subtitles', 'quality' )
+
+        def toDict( self ):
+                return {
+                        'video': self.video.toDict() if self.video else None,
+                        'audio': self.audio.toDict() if self.audio else None,
+                        'eng_subtitles': self.eng_subtitles,
+                        'quality': self.quality.toDict() if self.quality else None,
+                }
+
+        @classmethod
+        def fromDict( cls, inDict ):
+                if not inDict:
+                        return None
+
+                return cls( VideoInfo.fromDict( inDict.get('video') ), AudioInfo.fromDict( inDict.get('audio') ),
+                            inDict.get('eng_subtitles'), QualityInfo.fromDict( inDict.get('quality') ) )
+
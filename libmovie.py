@@ -0,0 +1,771 @@
+from __future__ import division
+import PTN
+import logging
+import os
+import shutil
+import sys
+import time
+import libcache
+import libffprobe
+import libfileops
+import libfingerprint
+import libledger
+import libmvdb
+import libquality
+import libplexdb
+import libremote
+import librules
+import libscore
+import libsections
+from libmediainfo import MediaInfo, QualityInfo, VideoInfo
+
+log = logging.getLogger('process_files.py')
+
+######
+### processMovie is written as a generator so the same steps can be driven one
+### file at a time (libpipeline.runTask) or many files at once (libpipeline.runPipeline).
+### Every external call is yielded to the driver as one of:
+###       ('probe', cmd)          ffprobe (or ffmpeg) command line, sends back stdout or None
+###       ('probe', cmd, 'stderr') the same, but sends back what it logged to stderr
+###       ('http', func, args)    MVDB call, sends back func(*args)
+###       ('db', func, args)      Plex DB or local cache call, sends back func(*args)
+###       ('io', func, args)      blocking file reads, like prefetching from network storage, sends back func(*args)
+### The last thing yielded is ('result', result).
+### The work is split into stages (probe, match, plex, score) that each end in
+### ('result', facts), so finished stages can be kept in libledger and skipped
+### when a run is resumed.
+######
+
+def newResult( inFile ):
+### newResult
+#       Input : inFile (string)
+#       Output: result (dict)
+
+        result = {
+                'file': inFile,
+                'title': None,
+                'year': None,
+                'dest_dir': None,
+                'library_dir': None,
+                'duplicate': False,
+                'old_file': None,
+                'remove': False,
+                'staging': False,
+                'error': 1,
+                'complete': False,
+                'sampled': None,
+                'quality': None,
+                'fingerprint': None,
+                'repeat_of': None,
+                'library_file': None,
+        }
+
+        return result
+
+
+def detectCrop( inFile, inPixels, inOptions, inDurationOutput=None ):
+### detectCrop
+#       Input : inFile (string), inPixels (int) of the whole frame, inOptions (dict) see processMovie,
+#               inDurationOutput (string) output of getDurationCmd if it has already been run
+#       Output: generator of pipeline steps, ending in ('result', active_pixels)
+#               active_pixels is None when no sensible crop was found
+
+        options = inOptions if inOptions else {}
+        pixels = int(inPixels) if inPixels else 0
+
+        crop = yield ('db', libcache.getCachedValue, ( options.get('cache_db'), 'crop', inFile ))
+
+        if crop == None:
+                duration_output = inDurationOutput
+                if duration_output == None:
+                        duration_output = yield ('probe', libffprobe.getDurationCmd( options.get('ffprobe'), inFile ))
+
+                crop = { 'width': None, 'height': None }
+
+                for start in libquality.getFrameTimes( libffprobe.parseDuration( duration_output ), options.get('crop_segments') ):
+                        output = yield ('probe', libffprobe.getCropDetectCmd( options.get('ffmpeg'), inFile, start, options.get('crop_seconds') ), 'stderr')
+                        width, height = libffprobe.parseCropDetect( output )
+
+                        ### Dark scenes look like bigger bars, keep the largest picture seen
+                        if width and height and width * height > ( crop['width'] or 0 ) * ( crop['height'] or 0 ):
+                                crop = { 'width': width, 'height': height }
+
+                ### A failed run (ffmpeg missing, or stopped by its time limit) is tried again next time
+                if crop['width'] and crop['height']:
+                        yield ('db', libcache.setCachedValue, ( options.get('cache_db'), 'crop', inFile, crop ))
+
+        active_pixels = crop['width'] * crop['height'] if crop['width'] and crop['height'] else None
+
+        if not pixels or not active_pixels or active_pixels > pixels or active_pixels < pixels * 0.5:
+                active_pixels = None
+
+        yield ('result', active_pixels)
+
+
+def getProbeOptions( inOptions ):
+### getProbeOptions
+#       Input : inOptions (dict) see processMovie
+#       Output: probe_options (dict) the options the probe stage's facts depend on
+
+        options = inOptions if inOptions else {}
+
+        probe_options = { 'sample_bitrate': bool(options.get('sample_bitrate')), 'detect_crop': bool(options.get('detect_crop')) }
+
+        if probe_options['sample_bitrate']:
+                probe_options['sample_windows'] = options.get('sample_windows')
+                probe_options['sample_seconds'] = options.get('sample_seconds')
+
+        if probe_options['detect_crop']:
+                probe_options['crop_segments'] = options.get('crop_segments')
+                probe_options['crop_seconds'] = options.get('crop_seconds')
+
+        return probe_options
+
+
+def probeStage( inFile, inFFProbe, inOptions ):
+### probeStage
+#       Input : inFile (string), inFFProbe (string), inOptions (dict) see processMovie
+#       Output: generator of pipeline steps, ending in ('result', facts)
+#               facts (dict) media (MediaInfo as dict), sampled (BitrateInfo as dict), duration (string) ffprobe output,
+#               options (dict) from getProbeOptions
+#               Errors to None
+
+        options = inOptions
+
+        ### GET FFPROBE INFORMATION FROM FILE
+        output = yield ('probe', libffprobe.getFFProbeCmd( inFFProbe, inFile, 'v' ))
+        probe = libffprobe.parseFFProbeOutput( output )
+        video = libffprobe.getVideoInfo( probe ) if probe else None
+        if not video:
+                log.error('#### FINISH: Error reading: ' + inFile)
+                yield ('result', None)
+                return
+
+        video.codec = '' if not video.codec else str(libscore.mungeCodec(video.codec))
+        video.bitrate = 0 if not video.bitrate else video.bitrate
+        duration_output = None
+        sampled = None
+
+        ### Tags are often missing or wrong, measure the real bitrate from a few windows of packets
+        if options.get('sample_bitrate'):
+                duration_output = yield ('probe', libffprobe.getDurationCmd( inFFProbe, inFile ))
+                output = yield ('probe', libffprobe.getPacketSampleCmd( inFFProbe, inFile, libffprobe.parseDuration( duration_output ),
+                                                                         options.get('sample_windows'), options.get('sample_seconds') ))
+                sampled = libffprobe.calcPacketStats( libffprobe.parseFFProbeOutput( output ) )
+                if sampled and sampled.bitrate:
+                        log.debug('Sampled video bitrate: ' + str(int( sampled.bitrate / 1000 )) + 'kbps over ' + str(sampled.seconds) + 's, peak ' \
+                                  + str(int( sampled.peak / 1000 )) + 'kbps, stddev ' + str(int( sampled.stddev / 1000 )) + 'kbps, tagged ' \
+                                  + str(int( video.bitrate / 1000 )) + 'kbps')
+                        video.bitrate = sampled.bitrate
+                else:
+                        sampled = None
+
+        if not video.bitrate:
+                log.warn('Bitrate not found in metadata, calculating average bitrate.')
+                if duration_output == None:
+                        duration_output = yield ('probe', libffprobe.getDurationCmd( inFFProbe, inFile ))
+                filesize = yield ('io', libfileops.getFileSize, ( inFile, ))
+                video.bitrate = libffprobe.calcBitRateFromOutput( inFile, duration_output, filesize )
+
+        video.aspect = 0 if not video.aspect else video.aspect
+        video.pixels = 0 if not video.pixels else video.pixels
+        video.framerate = 0 if not video.framerate else video.framerate
+
+        ### Black bars are cheap to encode, score on the picture inside them
+        if options.get('detect_crop'):
+                crop = detectCrop( inFile, video.pixels, options, duration_output )
+                step = crop.next()
+                while step[0] != 'result':
+                        value = yield step
+                        step = crop.send( value )
+                video.active_pixels = step[1]
+                if video.active_pixels:
+                        log.debug('Active picture: ' + str(int( video.active_pixels / 1000 )) + 'k of ' + str(int( video.pixels / 1000 )) + 'k pixels')
+
+        output = yield ('probe', libffprobe.getFFProbeCmd( inFFProbe, inFile, 'a' ))
+        probe = libffprobe.parseFFProbeOutput( output )
+        if probe:
+                audio = libffprobe.getAudioInfo( probe )
+        else:
+                log.error('#### FINISH: Error reading: ' + inFile)
+                yield ('result', None)
+                return
+
+        audio.codec = '' if not audio.codec else audio.codec
+        audio.language = '' if not audio.language else audio.language
+        audio.channels = 0 if not audio.channels else audio.channels
+        audio.bitrate = 0 if not audio.bitrate else audio.bitrate
+
+        output = yield ('probe', libffprobe.getFFProbeCmd( inFFProbe, inFile, 's' ))
+        probe = libffprobe.parseFFProbeOutput( output )
+
+        if probe:
+                eng_subtitles = libffprobe.hasEngSubtitles( probe )
+        else:
+                eng_subtitles = False
+
+        media = MediaInfo( video, audio, eng_subtitles )
+
+        facts = {
+                'media': media.toDict(),
+                'sampled': sampled.toDict() if sampled else None,
+                'duration': duration_output,
+                'options': getProbeOptions( options ),
+        }
+
+        yield ('result', facts)
+
+
+def matchStage( inFile, inAPIKey, inSession, inOptions ):
+### matchStage
+#       Input : inFile (string), inAPIKey (string), inSession (requests.Session), inOptions (dict) see processMovie
+#       Output: generator of pipeline steps, ending in ('result', facts)
+#               facts (dict) title (string), year (string), genres (list of int) MVDB genre ids, high_def (BOOL)
+#               Errors to None
+
+        src_file = os.path.basename(inFile)
+
+        ### PARSE FILE AND PATH INFORMATION FOR MOVIE TITLE AND DATE
+        file_info = PTN.parse(src_file)
+
+        if 'episode' in file_info:
+                log.error('#### FINISH: TV show detected, skipping.')
+                yield ('result', None)
+                return
+
+        if not 'title' in file_info or not 'year' in file_info:
+                log.warn('Filename parsing failure for ' + src_file + ', fuzzy matching on path.')
+                parent_dir = os.path.basename(os.path.dirname(inFile))
+
+                file_info = PTN.parse(parent_dir)
+
+                if not 'title' in file_info or not 'year' in file_info:
+                        log.error('#### FINISH: Failure parsing path ' + parent_dir + ', manual processing needed.')
+                        yield ('result', None)
+                        return
+
+        title = file_info['title'].replace('.',' ').strip(",'!%/ ").title()
+        year = str(file_info['year'])
+
+        ### SEARCH MVDB FOR INFORMATION
+        log.debug('Checking MVDB for: \'' + title + '\' in ' + year )
+        res = yield ('http', libmvdb.getMVDBResult, ( title, year, inAPIKey, inSession ))
+
+        if not res:
+                log.warn('No results from MVDB for: \'' + title + '\' in ' + year)
+                if '-' in title or ':' in title:
+                        split_title = title.replace('-', ':').strip().split(':')
+                        log.debug('Attempting munge title: \'' + split_title[0] + '\' in ' + year)
+                        res = yield ('http', libmvdb.getMVDBResult, ( split_title[0], year, inAPIKey, inSession ))
+
+                if not res:
+                        log.error('#### FINISH: No results from MVDB, check ' + src_file + ' for naming errors.')
+                        yield ('result', None)
+                        return
+
+        prev_score, mvdb_title, mvdb_date, mvdb_language, mvdb_genres = libmvdb.matchMVDBResult( title, year, res )
+
+        if prev_score:
+                log.debug('MVDB match at ' + str(prev_score) + '%: ' + title + ', ' + year + ' => ' \
+                          +  mvdb_title.title() + ', ' + mvdb_date )
+                title = mvdb_title.strip(",'!%/").replace(":", " -").title()
+        else:
+                log.error('#### FINISH: MVDB has results but a definitive match was not found, edit filename and try again' )
+                yield ('result', None)
+                return
+
+        ### If file is in one of the high-def genres, it wants for a higher quality file
+        high_def = libscore.isHighDef( mvdb_genres, inOptions.get('rules') )
+
+        yield ('result', { 'title': title, 'year': year, 'genres': mvdb_genres, 'high_def': high_def })
+
+
+def plexStage( inFFProbe, inPlexDB, inSections, inTitle, inYear, inVideo, inOptions ):
+### plexStage
+#       Input : inFFProbe (string), inPlexDB (string), inSections (dict) from libsections.getSectionIndex, or a section name,
+#               inTitle (string), inYear (string), inVideo (VideoInfo) of the new file, inOptions (dict) see processMovie
+#       Output: generator of pipeline steps, ending in ('result', facts)
+#               facts (dict) section (string), library_dir (string), duplicate (BOOL), old_file (string),
+#               old_media (MediaInfo as dict), other_sections (list of string) sections that also have the movie
+#               Errors to None
+
+        options = inOptions
+        title = inTitle
+        year = inYear
+
+        ### SEARCH PLEX DATABASE FOR FILE
+        duplicate = False
+        old_file = ''
+        old_media = None
+
+        index = inSections
+        if not isinstance( index, dict ):
+                index = yield ('db', libsections.getSectionIndex, ( inPlexDB, inSections ))
+
+        section = libsections.routeMovie( index, inVideo ) if index else None
+
+        if section:
+                log.debug('Routed to Plex section: ' + str(section['name']))
+
+                ### One pass over the title index finds the movie in every section
+                matches = libsections.findPlexMedia( index, title, year )
+                plex_media_id = matches.get( section['id'] )
+
+                other_sections = [ str(other['name']) for other in index['sections'] if other['id'] != section['id'] and other['id'] in matches ]
+                if other_sections:
+                        log.info('Also found in Plex sections: ' + ', '.join(other_sections))
+
+                if plex_media_id:
+                        duplicate = True
+                        old_dir, old_file = yield ('db', libplexdb.getPlexFileInfo, ( inPlexDB, plex_media_id ))
+
+                        old_dir = '' if not old_dir else old_dir
+                        old_file = '' if not old_file else old_file
+
+                        ### Header probes of a library file on network storage run against a local copy
+                        ### of its head and tail, see libremote. Crop detection still reads the real file.
+                        ### An index past the copied tail (a large moov at the end of an MP4) leaves the copy
+                        ### unreadable, the probe that finds that out and the ones after it read the real file.
+                        probe_file = old_file
+                        local_file = None
+                        if options.get('prefetch_remote') and old_file:
+                                local_file = yield ('io', libremote.prefetchRemoteFile, ( old_file, options.get('prefetch_dir'),
+                                                                                          options.get('prefetch_head'), options.get('prefetch_tail') ))
+                                probe_file = local_file if local_file else old_file
+
+                        ### The copy is removed by a step of its own, even when a step below fails, so a
+                        ### replay (libcorpus) never touches the disk. A driver that drops the file half way
+                        ### leaves the copy in prefetch_dir.
+                        failed = None
+                        try:
+                                old_video = yield ('db', libplexdb.getPlexVideoInfo, ( inPlexDB, plex_media_id ))
+
+                                ### If the information isn't in the Plex library, get it from the file
+                                ### If the file is on remote storage, this could be slow
+                                if ( not old_video.codec or not old_video.bitrate or not old_video.pixels or not old_video.framerate ) and old_file:
+                                        output = yield ('probe', libffprobe.getFFProbeCmd( inFFProbe, probe_file, 'v' ))
+                                        probe = libffprobe.parseFFProbeOutput( output )
+                                        if not probe and probe_file != old_file:
+                                                log.warn('Prefetched copy of ' + old_file + ' does not probe, probing the file itself.')
+                                                probe_file = old_file
+                                                output = yield ('probe', libffprobe.getFFProbeCmd( inFFProbe, probe_file, 'v' ))
+                                                probe = libffprobe.parseFFProbeOutput( output )
+                                        probe_video = libffprobe.getVideoInfo( probe ) if probe else None
+                                        if probe_video:
+                                                old_video = probe_video
+
+                                old_video.codec = '' if not old_video.codec else str(libscore.mungeCodec(old_video.codec))
+                                old_video.bitrate = 0 if not old_video.bitrate else old_video.bitrate
+                                old_video.pixels = 0 if not old_video.pixels else old_video.pixels
+                                old_video.framerate = 0 if not old_video.framerate else old_video.framerate
+
+                                ### Compare like with like, the crop is cached so the library file is only scanned once
+                                old_size = None
+                                if options.get('detect_crop') and old_file:
+                                        old_size = yield ('io', libfileops.getFileSize, ( old_file, ))
+
+                                if old_size:
+                                        crop = detectCrop( old_file, old_video.pixels, options )
+                                        step = crop.next()
+                                        while step[0] != 'result':
+                                                value = yield step
+                                                step = crop.send( value )
+                                        old_video.active_pixels = step[1]
+
+                                old_audio = yield ('db', libplexdb.getPlexAudioInfo, ( inPlexDB, plex_media_id ))
+
+                                ### If the information isn't in the Plex library, get it from the file
+                                ### If the file is on remote storage, this could be slow
+                                if ( not old_audio.codec or not old_audio.language or not old_audio.channels or not old_audio.bitrate ) and old_file:
+                                        output = yield ('probe', libffprobe.getFFProbeCmd( inFFProbe, probe_file, 'a' ))
+                                        probe = libffprobe.parseFFProbeOutput( output )
+                                        if not probe and probe_file != old_file:
+                                                log.warn('Prefetched copy of ' + old_file + ' does not probe, probing the file itself.')
+                                                probe_file = old_file
+                                                output = yield ('probe', libffprobe.getFFProbeCmd( inFFProbe, probe_file, 'a' ))
+                                                probe = libffprobe.parseFFProbeOutput( output )
+                                        if probe:
+                                                old_audio = libffprobe.getAudioInfo( probe )
+
+                                old_audio.codec = '' if not old_audio.codec else old_audio.codec
+                                old_audio.language = 'unknown' if not old_audio.language else old_audio.language
+                                old_audio.channels = 0 if not old_audio.channels else old_audio.channels
+                                old_audio.bitrate = 0 if not old_audio.bitrate else old_audio.bitrate
+
+                                #####
+                                ### INSERT CODE TO EXTRACT SUBTITLES FROM PLEXDB
+                                old_eng_subtitles = None
+                                #####
+
+                                ### If the information isn't in the Plex library, get it from the file
+                                ### If the file is on remote storage, this could be slow
+                                if old_eng_subtitles == None and old_file:
+                                        output = yield ('probe', libffprobe.getFFProbeCmd( inFFProbe, probe_file, 's' ))
+                                        probe = libffprobe.parseFFProbeOutput( output )
+                                        if not probe and probe_file != old_file:
+                                                log.warn('Prefetched copy of ' + old_file + ' does not probe, probing the file itself.')
+                                                probe_file = old_file
+                                                output = yield ('probe', libffprobe.getFFProbeCmd( inFFProbe, probe_file, 's' ))
+                                                probe = libffprobe.parseFFProbeOutput( output )
+                                        if not probe:
+                                                old_eng_subtitles = libffprobe.hasEngSubtitles( probe )
+                                        else:
+                                                old_eng_subtitles = False
+
+                                old_media = MediaInfo( old_video, old_audio, old_eng_subtitles )
+                        except Exception, e:
+                                failed = sys.exc_info()
+
+                        if local_file:
+                                yield ('io', libremote.removePrefetch, ( local_file, ))
+
+                        if failed:
+                                raise failed[0], failed[1], failed[2]
+
+        else:
+                if index:
+                        log.error('#### FINISH: No Plex section takes this file, check the section routing.')
+                yield ('result', None)
+                return
+
+        facts = {
+                'section': str(section['name']),
+                'library_dir': section.get('library_dir'),
+                'duplicate': duplicate,
+                'old_file': old_file,
+                'old_media': old_media.toDict() if old_media else None,
+                'other_sections': other_sections,
+        }
+
+        yield ('result', facts)
+
+
+def scoreStage( inFile, inFFProbe, inFacts, inOptions ):
+### scoreStage
+#       Input : inFile (string), inFFProbe (string), inFacts (dict) of the probe, match and plex stages,
+#               inOptions (dict) see processMovie
+#       Output: generator of pipeline steps, ending in ('result', facts)
+#               facts (dict) quality (QualityInfo as dict), remove (BOOL), staging (BOOL), error (int)
+
+        options = inOptions
+        rules = options.get('rules') if options.get('rules') else librules.rules
+        media = MediaInfo.fromDict( inFacts['probe']['media'] )
+        duration_output = inFacts['probe']['duration']
+        year = inFacts['match']['year']
+        high_def = getHighDef( inFacts['match'], rules )
+
+        ### SPOT CHECK BORDERLINE FILES
+        ### Only worth decoding frames when the score alone would send the file to staging
+        if options.get('spot_check') and libquality.hasNumPy():
+                score = libscore.calcMediaScore( media, year, high_def, rules )
+
+                if score > rules['remove_score'] and score <= rules['staging_score']:
+                        if duration_output == None:
+                                duration_output = yield ('probe', libffprobe.getDurationCmd( inFFProbe, inFile ))
+
+                        budget = options.get('spot_budget') if options.get('spot_budget') else 10
+                        start = time.time()
+                        frames = []
+
+                        for frame_time in libquality.getFrameTimes( libffprobe.parseDuration( duration_output ), options.get('spot_frames') ):
+                                remaining = budget - ( time.time() - start )
+                                if remaining < 1:
+                                        log.warn('Spot check time budget used up after ' + str(len(frames)) + ' frames.')
+                                        break
+
+                                output = yield ('probe', libquality.getFrameCmd( options.get('ffmpeg'), inFile, frame_time, remaining ))
+                                frame = libquality.parsePGM( output )
+                                if frame is not None:
+                                        frames.append( frame )
+
+                        media.quality = libquality.calcQualityInfo( frames, time.time() - start )
+
+        facts = { 'quality': media.quality.toDict() if media.quality else None }
+
+        remove, staging, error = decideMovie( inFacts, facts, rules )
+
+        facts['remove'] = remove
+        facts['staging'] = staging
+        facts['error'] = error
+
+        yield ('result', facts)
+
+
+def getHighDef( inMatchFacts, inRules=None ):
+### getHighDef
+#       Input : inMatchFacts (dict) of the match stage, inRules (dict) from librules
+#       Output: high_def (BOOL) from the MVDB genres under inRules, ledger entries without genres keep what they stored
+
+        if inMatchFacts.get('genres') == None:
+                return inMatchFacts['high_def']
+
+        return libscore.isHighDef( inMatchFacts['genres'], inRules )
+
+
+def decideMovie( inFacts, inScoreFacts, inRules=None ):
+### decideMovie
+#       Input : inFacts (dict) of the probe, match and plex stages, inScoreFacts (dict) with the spot check quality,
+#               inRules (dict) from librules
+#       Output: remove (BOOL), staging (BOOL), error (int) from libscore.dispositionMovie
+#               Needs nothing but stored facts, so changed rules can be replayed over the ledger
+
+        media = MediaInfo.fromDict( inFacts['probe']['media'] )
+        media.quality = QualityInfo.fromDict( inScoreFacts.get('quality') )
+        old_media = MediaInfo.fromDict( inFacts['plex']['old_media'] )
+
+        return libscore.dispositionMovie( media, old_media, inFacts['match']['year'], getHighDef( inFacts['match'], inRules ),
+                                          inFacts['plex']['duplicate'], inFacts['match']['title'], inFacts['plex']['old_file'], inRules )
+
+
+def getDecisionColumns( inFactsList, inRules=None ):
+### getDecisionColumns
+#       Input : inFactsList (list of dict) stored facts of the probe, match, plex and score stages, inRules (dict) from librules
+#       Output: columns (dict) of libscore.decision_columns, for libscore.dispositionColumns
+
+        columns = dict([ ( name, [] ) for name in libscore.decision_columns ])
+
+        for facts in inFactsList:
+                media = facts['probe']['media']
+                quality = facts['score'].get('quality') if facts.get('score') else None
+                old_media = facts['plex']['old_media']
+                duplicate = True if facts['plex']['duplicate'] else False
+                old_video = old_media['video'] if duplicate and old_media else {}
+                old_audio = old_media['audio'] if duplicate and old_media else {}
+
+                row = {
+                        'year': int(facts['match']['year']) if facts['match']['year'] else 0,
+                        'high_def': getHighDef( facts['match'], inRules ),
+                        'duplicate': duplicate,
+                        'codec': media['video']['codec'],
+                        'bitrate': media['video']['bitrate'],
+                        'aspect': media['video']['aspect'],
+                        'pixels': libscore.getEffectivePixels( VideoInfo.fromDict( media['video'] ) ),
+                        'framerate': media['video']['framerate'],
+                        'aud_codec': media['audio']['codec'],
+                        'aud_bitrate': media['audio']['bitrate'],
+                        'channels': media['audio']['channels'],
+                        'language': media['audio']['language'],
+                        'eng_subtitles': media['eng_subtitles'],
+                        'spot_checked': quality != None,
+                        'blockiness': quality['blockiness'] if quality else None,
+                        'sharpness': quality['sharpness'] if quality else None,
+                        'active_aspect': quality.get('active_aspect') if quality else None,
+                        'old_codec': old_video.get('codec'),
+                        'old_bitrate': old_video.get('bitrate'),
+                        'old_pixels': libscore.getEffectivePixels( VideoInfo.fromDict( old_video ) ),
+                        'old_fps': old_video.get('framerate'),
+                        'old_aud_codec': old_audio.get('codec'),
+                        'old_aud_bitrate': old_audio.get('bitrate'),
+                        'old_channels': old_audio.get('channels'),
+                        'old_lang': old_audio.get('language'),
+                        'old_eng_subtitles': old_media['eng_subtitles'] if duplicate and old_media else None,
+                }
+
+                for name in libscore.decision_columns:
+                        columns[name].append( row[name] )
+
+        return columns
+
+
+def processMovie( inFile, inFFProbe, inPlexDB, inSections, inAPIKey, inSession=None, inOptions=None ):
+### processMovie
+#       Input : inFile (string), inFFProbe (string), inPlexDB (string),
+#               inSections (dict) from libsections.getSectionIndex, built once per run, or a single section name,
+#               inAPIKey (string), inSession (requests.Session), inOptions (dict) of optional analysis:
+#                       sample_bitrate (BOOL)   measure the video bitrate from sampled packets
+#                       sample_windows (int)    number of windows to sample
+#                       sample_seconds (int)    length of each window
+#                       spot_check (BOOL)       decode a few keyframes to judge borderline files
+#                       spot_frames (int)       number of keyframes to decode
+#                       spot_budget (int)       seconds the spot check may take per file
+#                       ffmpeg (string)         path to ffmpeg for the spot check and crop detection
+#                       detect_crop (BOOL)      score on the picture inside any black bars
+#                       crop_segments (int)     number of segments to run cropdetect over
+#                       crop_seconds (int)      length of each segment
+#                       cache_db (string)       local cache for facts about files, like the crop
+#                       ledger_db (string)      processing ledger, stages already done for this file are not run again,
+#                                               except scoring, which always runs under the current rules and options
+#                       ledger_readonly (BOOL)  reuse stages from the ledger but save nothing, for a dry run
+#                       rules (dict)            compiled scoring rules from librules, the defaults if not given
+#                       prefetch_remote (BOOL)  probe library files on network storage through a local copy of their head and tail
+#                       prefetch_dir (string)   local directory for those copies
+#                       prefetch_head (int)     bytes to copy from the start of the file
+#                       prefetch_tail (int)     bytes to copy from the end of the file
+#                       fingerprint_db (string) index of content fingerprints, exact repeats of a file already seen are not processed
+#                       fingerprint_seen (dict) shared by every file of a batch, so repeats within the batch are caught too
+#       Output: generator of pipeline steps, ending in ('result', result)
+
+        options = inOptions if inOptions else {}
+        ledger_db = options.get('ledger_db')
+
+        full_path = os.path.abspath(inFile)
+        result = newResult( full_path )
+
+        ### Every look at the filesystem goes through a step too, so a recorded
+        ### run can be replayed without the files, see libcorpus
+        file_key = yield ('io', libcache.getFileKey, ( full_path, ))
+
+        if not file_key:
+                log.error('#### FINISH: File does not exist: ' + full_path)
+                yield ('result', result)
+                return
+
+        log.info('#### START: Processing: ' + full_path )
+
+        ### The same release downloaded again needs no probing, see libfingerprint
+        if options.get('fingerprint_db'):
+                result['fingerprint'] = yield ('io', libfingerprint.getFingerprint, ( full_path, ))
+                if result['fingerprint']:
+                        result['repeat_of'] = yield ('db', libfingerprint.findRepeat, ( options['fingerprint_db'], result['fingerprint'], full_path,
+                                                                                              options.get('fingerprint_seen') ))
+
+                if result['repeat_of']:
+                        log.info('Identical to ' + result['repeat_of'])
+                        result['complete'] = True
+                        result['error'] = 0
+                        yield ('result', result)
+                        return
+
+        facts = {}
+
+        if ledger_db:
+                entry = yield ('db', libledger.loadEntry, ( ledger_db, full_path ))
+                facts = libledger.getStoredStages( entry, file_key )
+
+                ### Probe facts taken with other sampling or crop options don't count, and
+                ### neither does anything built on them
+                if facts.get('probe') and facts['probe'].get('options') != getProbeOptions( options ):
+                        facts = {}
+
+                ### Scoring is cheap and depends on the rules and spot check options, never reuse it
+                facts.pop( 'score', None )
+
+                if facts:
+                        log.debug('Resuming from ledger after stages: ' + ', '.join([ s for s in libledger.ledger_stages if s in facts ]))
+
+        for stage in libledger.ledger_stages:
+                if stage not in facts:
+                        if stage == 'probe':
+                                task = probeStage( full_path, inFFProbe, options )
+                        elif stage == 'match':
+                                task = matchStage( full_path, inAPIKey, inSession, options )
+                        elif stage == 'plex':
+                                video = VideoInfo.fromDict( facts['probe']['media']['video'] )
+                                task = plexStage( inFFProbe, inPlexDB, inSections, facts['match']['title'], facts['match']['year'], video, options )
+                        else:
+                                task = scoreStage( full_path, inFFProbe, facts, options )
+
+                        ### A failed step is thrown into the stage, so it can clean up after itself
+                        step = task.next()
+                        while step[0] != 'result':
+                                try:
+                                        value = yield step
+                                except Exception, e:
+                                        step = task.throw( *sys.exc_info() )
+                                        continue
+                                step = task.send( value )
+
+                        if step[1] == None:
+                                yield ('result', result)
+                                return
+
+                        facts[stage] = step[1]
+
+                        if ledger_db and not options.get('ledger_readonly'):
+                                yield ('db', libledger.saveStage, ( ledger_db, full_path, file_key, stage, step[1] ))
+
+                if stage == 'probe':
+                        result['sampled'] = facts['probe']['sampled']
+                elif stage == 'match':
+                        result['title'] = facts['match']['title']
+                        result['year'] = facts['match']['year']
+                        result['dest_dir'] = result['title'] + ' (' + result['year'] + ')'
+                elif stage == 'plex':
+                        result['library_dir'] = facts['plex'].get('library_dir')
+                        result['duplicate'] = facts['plex']['duplicate']
+                        result['old_file'] = facts['plex']['old_file']
+                else:
+                        result['quality'] = facts['score']['quality']
+                        result['remove'] = facts['score']['remove']
+                        result['staging'] = facts['score']['staging']
+                        result['error'] = facts['score']['error']
+
+        result['complete'] = True
+
+        yield ('result', result)
+
+
+def getDisposition( inResult, inReplace ):
+### getDisposition
+#       Input : inResult (dict), inReplace (BOOL)
+#       Output: disposition (string) one of 'skip', 'repeat', 'remove', 'staging', 'replace', 'library'
+
+        if not inResult or not inResult['complete']:
+                disposition = 'skip'
+        elif inResult.get('repeat_of'):
+                disposition = 'repeat'
+        elif inResult['remove']:
+                disposition = 'remove'
+        elif inResult['staging']:
+                disposition = 'staging'
+        elif inResult['duplicate'] and inReplace:
+                disposition = 'replace'
+        else:
+                disposition = 'library'
+
+        return disposition
+
+
+def performDisposition( inResult, inReplace, inLibraryDir, inStagingDir, inTrashDir, inFFProbe, inDryRun ):
+### performDisposition
+#       Input : inResult (dict), inReplace (BOOL), inLibraryDir (string) for files whose section has no library_dir,
+#               inStagingDir (string), inTrashDir (string), inFFProbe (string), inDryRun (BOOL)
+#       Output: error (int)
+#               Sets library_file in inResult to where the file ended up in the library
+
+        disposition = getDisposition( inResult, inReplace )
+        error = int(inResult['error']) if inResult else 1
+
+        if disposition == 'skip':
+                return 1
+
+        full_path = inResult['file']
+        src_file = os.path.basename(full_path)
+        dest_dir = inResult['dest_dir']
+        library_dir = inResult['library_dir'] if inResult.get('library_dir') else inLibraryDir
+
+        if disposition == 'repeat':
+                log.info('#### FINISH: ' + src_file + ' is identical to ' + inResult['repeat_of'] + ', deleting it.')
+                if not inDryRun:
+                        os.remove(full_path)
+        elif disposition == 'remove':
+                log.error('#### FINISH: ' + src_file + ' does not meet standards, deleting it.')
+                if not inDryRun:
+                        os.remove(full_path)
+                error = 1
+        elif disposition == 'staging':
+                log.info('#### FINISH: Unable to disposition ' + src_file + ', moving to staging.')
+                if not inDryRun:
+                        if not os.path.isdir( inStagingDir + '/' + dest_dir ):
+                                os.mkdir( inStagingDir + '/' + dest_dir )
+                        shutil.move( full_path, inStagingDir + '/' + dest_dir + '/' + src_file )
+        elif disposition == 'replace':
+                log.warn('#### FINISH: Replacing old file in Plex library: ' + inResult['old_file'] + '.' )
+                if not inDryRun:
+                        target, steps = libfileops.replaceFile( full_path, inResult['old_file'], inFFProbe, inTrashDir )
+                        if not target:
+                                log.error('#### FINISH: Replace of ' + inResult['old_file'] + ' failed, library file left in place.')
+                                error = 1
+                        inResult['library_file'] = target
+        else:
+                log.info('#### FINISH: Copying ' + src_file + ' to Plex library ' + library_dir + '.')
+                out_file, out_ext = os.path.splitext(src_file)
+                out_file = dest_dir + out_ext
+                if not inDryRun:
+                        if not os.path.isdir( library_dir + '/' + dest_dir ):
+                                os.mkdir( library_dir + '/' + dest_dir )
+                        shutil.move( full_path, library_dir + '/' + dest_dir + '/' + out_file )
+                        inResult['library_file'] = library_dir + '/' + dest_dir + '/' + out_file
+
+        return error
+
@@ -0,0 +1,104 @@
+from __future__ import division
+import json
+import requests
+from fuzzywuzzy import fuzz
+
+mvdb_url = 'https://api.themoviedb.org/3/search/movie'
+
+def getMVDBSession( inPoolSize ):
+### getMVDBSession
+#       Input : inPoolSize (int)
+#       Output: session (requests.Session)
+#               Keeps up to inPoolSize connections to MVDB open for reuse
+
+        pool_size = int(inPoolSize) if inPoolSize else 1
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter( pool_connections=1, pool_maxsize=pool_size )
+        session.mount( 'https://', adapter )
+
+        return session
+
+
+def getMVDBResult( inTitle, inYear, inAPIKey, inSession=None ):
+### getMVDBResult
+#       Input: Title (string), Year (int), APIKey (string), Session (requests.Session)
+#       Output: JSON blob
+#               Errors to None
+
+        title = str(inTitle) if inTitle else ''
+        year = int(inYear) if inYear else 0
+        http = inSession if inSession else requests
+
+        isJSON = False
+
+        payload = {'api_key' : inAPIKey, 'query' : inTitle, 'year' : inYear }
+        response = http.request("GET", mvdb_url, data=payload)
+
+        if response.status_code == requests.codes.ok:
+                res_json = response.json()
+
+                try:
+                        json.dumps(res_json)
+                        isJSON = True
+                except ValueError:
+                        isJSON = False
+
+        if isJSON and res_json and res_json['results']:
+                return( res_json['results'] )
+        else:
+                return( None )
+
+
+def matchMVDBResult( inTitle, inYear, inResults ):
+### matchMVDBResult
+#       Input : inTitle (string), inYear (string), inResults (JSON blob)
+#       Output: score (int), title (string), date (string), language (string), genres (list)
+#               Errors to None
+
+        title = str(inTitle) if inTitle else ''
+        year = str(inYear) if inYear else ''
+        res = inResults if inResults else []
+
+        prev_score = None
+        mvdb_title = None
+        mvdb_date = None
+        mvdb_language = None
+        mvdb_genres = None
+
+        for idx in range(len(res)):
+                if year in res[idx]['release_date']:
+                        title_len = len(title)
+                        res_len = len(res[idx]['title'])
+                        threshold = 55 + (( 1 - ( abs(title_len - res_len) / max(title_len, res_len))) * 30 )
+                        score = fuzz.token_sort_ratio(title.lower(), res[idx]['title'].lower())
+                        if score >= threshold and score > prev_score:
+                                prev_score = score
+                                mvdb_title = res[idx]['title'].lower()
+                                mvdb_date = res[idx]['release_date']
+                                mvdb_language = res[idx]['original_language']
+                                mvdb_genres = res[idx]['genre_ids']
+
+        if not prev_score and res:
+                if str(year) in res[0]['release_date'] or str(int(year) - 1) in res[0]['release_date'] or \
+                str(int(year) + 1) in res[0]['release_date']:
+                        if ':' in res[0]['title'] or '-' in res[0]['title']:
+                                split_mvdb = res[0]['title'].replace('-', ':').split(':')
+                                munge_title = split_mvdb[0].lower()
+                                threshold = 90
+                        else:
+                                title_len = len(title)
+                                res_len = len(res[0]['title'])
+                                munge_title = res[0]['title'].lower()
+                                threshold = 55 + (( 1 - ( abs(title_len - res_len) / max(title_len, res_len))) * 25 )
+
+                        score = fuzz.token_sort_ratio( title.lower(), munge_title )
+                        if score >= threshold:
+                                prev_score = score
+                                mvdb_title = res[0]['title'].lower()
+                                mvdb_date = res[0]['release_date']
+                                mvdb_language = res[0]['original_language']
+                                mvdb_genres = res[0]['genre_ids']
+
+        return prev_score, mvdb_title, mvdb_date, mvdb_language, mvdb_genres
+
@@ -0,0 +1,263 @@
+import Queue
+import errno
+import logging
+import os
+import select
+import subprocess
+import sys
+from collections import deque
+from multiprocessing.pool import ThreadPool
+import libffprobe
+
+log = logging.getLogger('process_files.py')
+
+######
+### Drivers for the steps yielded by libmovie.processMovie.
+###
+### runTask runs a single file step by step, blocking on every call.
+### runPipeline runs many files at once on one event loop: ffprobe runs as
+### non-blocking child processes whose pipes are watched with select(), MVDB
+### calls share a small pool of threads (and the pooled requests.Session handed
+### to processMovie), Plex DB calls go to their own dedicated thread(s) and
+### blocking file reads to another small pool. The callback for each finished
+### file moves it, so it runs on a thread of its own, one file at a time, and
+### the loop keeps probing the rest of the batch meanwhile.
+### Both drivers send the same values back into the generator, so a file gets
+### the same disposition whichever driver runs it. A step that fails is thrown
+### into the generator, and a file that doesn't handle it is logged and ends in
+### None under either driver.
+######
+
+def runStep( inStep ):
+### runStep
+#       Input : inStep (tuple)
+#       Output: value (object) to send back into the generator
+
+        kind = inStep[0]
+
+        if kind == 'probe':
+                value = libffprobe.runFFProbe( inStep[1], len(inStep) > 2 and inStep[2] == 'stderr' )
+        else:
+                value = inStep[1]( *inStep[2] )
+
+        return value
+
+
+def runTask( inTask ):
+### runTask
+#       Input : inTask (generator)
+#       Output: result (dict)
+#               Errors to None
+
+        value = None
+        result = None
+
+        try:
+                step = inTask.send( None )
+                while step[0] != 'result':
+                        try:
+                                value = runStep( step )
+                        except Exception, e:
+                                step = inTask.throw( *sys.exc_info() )
+                                continue
+                        step = inTask.send( value )
+                result = step[1]
+        except StopIteration:
+                result = None
+        except Exception, e:
+                log.exception('Pipeline step failed: ' + str(e))
+                result = None
+        finally:
+                inTask.close()
+
+        return result
+
+
+def callStep( inFunc, inArgs ):
+### callStep
+#       Input : inFunc (function), inArgs (tuple)
+#       Output: ok (BOOL), value (object or exc_info)
+
+        try:
+                return True, inFunc( *inArgs )
+        except Exception, e:
+                return False, sys.exc_info()
+
+
+def runPipeline( inTasks, inMaxProbes, inHTTPWorkers, inDBWorkers, inCallback=None, inIOWorkers=None ):
+### runPipeline
+#       Input : inTasks (list of generators), inMaxProbes (int), inHTTPWorkers (int), inDBWorkers (int),
+#               inCallback (function) called as inCallback(index, result) as each file finishes, off the loop thread,
+#               one file at a time, runPipeline returns once every call has returned
+#               inIOWorkers (int) threads for file reads, 2 if not given
+#       Output: results (list of dict), in the same order as inTasks
+#               Errors to None for that file
+
+        max_probes = int(inMaxProbes) if inMaxProbes else 1
+        http_workers = int(inHTTPWorkers) if inHTTPWorkers else 1
+        db_workers = int(inDBWorkers) if inDBWorkers else 1
+        io_workers = int(inIOWorkers) if inIOWorkers else 2
+
+        tasks = list(inTasks)
+        results = [ None ] * len(tasks)
+        remaining = len(tasks)
+
+        if not tasks:
+                return results
+
+        http_pool = ThreadPool( http_workers )
+        db_pool = ThreadPool( db_workers )
+        io_pool = ThreadPool( io_workers )
+        ### One thread, so two files of the same movie are never moved at once
+        finish_pool = ThreadPool( 1 )
+
+        ### Worker threads hand back results on a queue and write a byte to the
+        ### wake pipe so the select() below returns right away
+        done_queue = Queue.Queue()
+        wake_r, wake_w = os.pipe()
+
+        probe_queue = deque()
+        probes = {}
+        finishing = set()
+
+        def finish( idx, result ):
+                results[idx] = result
+                if inCallback:
+                        def done( res, idx=idx ):
+                                done_queue.put( ( idx, res[0], res[1], True ) )
+                                os.write( wake_w, 'x' )
+
+                        finishing.add( idx )
+                        finish_pool.apply_async( callStep, ( inCallback, ( idx, result ) ), callback=done )
+
+        def advance( idx, ok, value ):
+                try:
+                        if ok:
+                                step = tasks[idx].send( value )
+                        else:
+                                step = tasks[idx].throw( *value )
+                except StopIteration:
+                        finish( idx, None )
+                        return False
+                except Exception, e:
+                        log.exception('Pipeline step failed: ' + str(e))
+                        finish( idx, None )
+                        return False
+
+                kind = step[0]
+
+                if kind == 'result':
+                        tasks[idx].close()
+                        finish( idx, step[1] )
+                        return False
+                elif kind == 'probe':
+                        probe_queue.append( ( idx, step[1], len(step) > 2 and step[2] == 'stderr' ) )
+                else:
+                        if kind == 'http':
+                                pool = http_pool
+                        elif kind == 'io':
+                                pool = io_pool
+                        else:
+                                pool = db_pool
+
+                        def done( res, idx=idx ):
+                                done_queue.put( ( idx, res[0], res[1], False ) )
+                                os.write( wake_w, 'x' )
+
+                        pool.apply_async( callStep, ( step[1], step[2] ), callback=done )
+
+                return True
+
+        def startProbes():
+                finished = 0
+                while probe_queue and len(probes) < max_probes:
+                        idx, cmd, use_stderr = probe_queue.popleft()
+                        proc = None
+
+                        if cmd:
+                                try:
+                                        if use_stderr:
+                                                proc = subprocess.Popen( cmd, stdout=devnull, stderr=subprocess.PIPE )
+                                        else:
+                                                proc = subprocess.Popen( cmd, stdout=subprocess.PIPE, stderr=devnull )
+                                except OSError:
+                                        proc = None
+
+                        if proc:
+                                pipe = proc.stderr if use_stderr else proc.stdout
+                                probes[pipe.fileno()] = ( idx, proc, pipe, [] )
+                        elif not advance( idx, True, None ):
+                                finished += 1
+
+                return finished
+
+        devnull = open( os.devnull, 'w' )
+
+        try:
+                for idx in range(len(tasks)):
+                        if not advance( idx, True, None ):
+                                remaining -= 1
+
+                while remaining or finishing:
+                        remaining -= startProbes()
+                        if not remaining and not finishing:
+                                break
+
+                        try:
+                                readable, writable, failed = select.select( list(probes.keys()) + [ wake_r ], [], [] )
+                        except select.error, e:
+                                if e.args[0] == errno.EINTR:
+                                        continue
+                                raise
+
+                        for fd in readable:
+                                if fd == wake_r:
+                                        os.read( wake_r, 4096 )
+                                        while True:
+                                                try:
+                                                        idx, ok, value, finished = done_queue.get_nowait()
+                                                except Queue.Empty:
+                                                        break
+                                                if finished:
+                                                        finishing.discard( idx )
+                                                        if not ok:
+                                                                log.error('Pipeline callback failed', exc_info=value)
+                                                elif not advance( idx, ok, value ):
+                                                        remaining -= 1
+                                        continue
+
+                                idx, proc, pipe, chunks = probes[fd]
+                                chunk = os.read( fd, 65536 )
+
+                                if chunk:
+                                        chunks.append( chunk )
+                                        continue
+
+                                del probes[fd]
+                                pipe.close()
+                                output = ''.join( chunks ) if proc.wait() == 0 else None
+
+                                if not advance( idx, True, output ):
+                                        remaining -= 1
+
+        finally:
+                for idx, proc, pipe, chunks in probes.values():
+                        if proc.poll() is None:
+                                proc.kill()
+                        proc.wait()
+
+                http_pool.close()
+                db_pool.close()
+                io_pool.close()
+                finish_pool.close()
+                http_pool.join()
+                db_pool.join()
+                io_pool.join()
+                finish_pool.join()
+
+                os.close( wake_r )
+                os.close( wake_w )
+                devnull.close()
+
+        return results
+
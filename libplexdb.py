@@ -1,6 +1,40 @@
+import logging
 import os
 import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
 from fuzzywuzzy import fuzz
+from libmediainfo import VideoInfo, AudioInfo
+
+log = logging.getLogger('process_files.py')
+
+### Rows fetched from the cursor per round trip by iterPlexDB
+plex_batch_size = 500
+
+### Tables copied by snapshotPlexDB, and the columns the queries below look rows up by
+snapshot_tables = ( 'library_sections', 'metadata_items', 'media_items', 'media_parts', 'media_streams', 'directories' )
+snapshot_indexes = ( ( 'library_sections', 'name' ), ( 'metadata_items', 'id' ), ( 'metadata_items', 'library_section_id' ),
+                     ( 'media_items', 'id' ), ( 'media_items', 'metadata_item_id' ), ( 'media_parts', 'media_item_id' ),
+                     ( 'media_streams', 'media_item_id' ), ( 'directories', 'id' ) )
+
+MediaTitleRow = namedtuple('MediaTitleRow', 'title year media_id')
+AudioStreamRow = namedtuple('AudioStreamRow', 'codec language channels bitrate')
+MediaStreamRow = namedtuple('MediaStreamRow', [ 'norm_title', 'title', 'year', 'genres', 'media_id', 'width', 'height', 'fps',
+                                                'video_codec', 'size', 'file', 'codec', 'bitrate', 'language', 'channels',
+                                                'stream_type' ])
+
+def openPlexDB( inPlexDB ):
+### openPlexDB
+#       Input : inPlexDB (string) the live database or a snapshot
+#       Output: db_conn (sqlite3 connection) that refuses to write, the lookups only ever read
+
+        db_conn = sqlite3.connect( inPlexDB )
+        db_conn.execute( 'PRAGMA query_only = ON' )
+
+        return db_conn
+
 
 def queryPlexDB( inPlexDB, inQuery ):
 ### queryPlexDB
@@ -14,7 +48,7 @@ def queryPlexDB( inPlexDB, inQuery ):
         rows = None
 
         if query:
-                db_conn = sqlite3.connect(plexdb)
+                db_conn = openPlexDB( plexdb )
                 db = db_conn.cursor()
                 db.execute( query )
                 rows = db.fetchall()
@@ -23,6 +57,41 @@ def queryPlexDB( inPlexDB, inQuery ):
         return rows
 
 
+def iterPlexDB( inPlexDB, inQuery, inBatchSize=None, inRowType=None, inFunctions=None ):
+### iterPlexDB
+#       Input : inPlexDB (string), inQuery (string), inBatchSize (int), inRowType (namedtuple class),
+#               inFunctions (dict of name: function) SQL functions to register on the connection
+#       Output: generator of rows (tuples, or inRowType when given)
+#               Rows are fetched inBatchSize at a time, the connection is closed when the generator finishes
+
+        query = str(inQuery) if inQuery else ''
+        plexdb = str(inPlexDB) if inPlexDB else ''
+        batch_size = int(inBatchSize) if inBatchSize else plex_batch_size
+
+        if not query:
+                return
+
+        db_conn = openPlexDB( plexdb )
+
+        try:
+                if inFunctions:
+                        for name, func in inFunctions.items():
+                                db_conn.create_function( name, 1, func )
+
+                db = db_conn.cursor()
+                db.arraysize = batch_size
+                db.execute( query )
+
+                while True:
+                        rows = db.fetchmany()
+                        if not rows:
+                                break
+                        for row in rows:
+                                yield inRowType._make(row) if inRowType else row
+        finally:
+                db_conn.close()
+
+
 def getPlexSectionID( inPlexDB, inSectionName ):
 ### getPlexSectionID
 #       Input : inPlexDB (string), inSectionName (string)
@@ -68,12 +137,10 @@ def getPlexMediaID( inPlexDB, inTitle, inYear, inSection ):
                         WHERE   metadata_items.id = media_items.metadata_item_id \
                                 AND metadata_items.library_section_id = ' + str(section) + ';'
 
-        rows = queryPlexDB( plexdb, query )
-
-        for row in rows:
-                row_title = row[0]
-                row_year = row[1]
-                row_id = row[2]
+        for row in iterPlexDB( plexdb, query, inRowType=MediaTitleRow ):
+                row_title = row.title
+                row_year = row.year
+                row_id = row.media_id
 
                 if year == row_year:
                         score = int(fuzz.token_sort_ratio( title, row_title ))
@@ -119,7 +186,7 @@ def getPlexFileInfo ( inPlexDB, inMediaID ):
 def getPlexVideoInfo( inPlexDB, inMediaID ):
 ### getPlexVideoInfo
 #       Input: inPlexDB (string), inMediaID (int)
-#       Output: codec (string), bitrate (int), pixels (int), framerate (float)
+#       Output: VideoInfo( codec (string), bitrate (int), pixels (int), framerate (float) ), aspect is not stored by Plex
 #               Errors to None
 
         media_id = int(inMediaID) if inMediaID else 0
@@ -155,18 +222,15 @@ def getPlexVideoInfo( inPlexDB, inMediaID ):
         pixels = int(pixels) if pixels else None
         fps = float(fps) if fps else None
 
-        return codec, bitrate, pixels, fps
+        return VideoInfo( codec, bitrate, None, pixels, fps )
 
 
-def getPlexAudioInfo( inPlexDB, inMediaID ):
-### getPlexMediaID
-#       Input: inPlexDB (string) inMediaID (int)
-#       Output: codec (string), language (string), channels (int), bitrate (int)
+def pickPlexAudio( inRows ):
+### pickPlexAudio
+#       Input : inRows (iterable of [codec, language, channels, bitrate])
+#       Output: AudioInfo( codec (string), language (string), channels (int), bitrate (int) )
 #               Errors to None
 
-        media_id = int(inMediaID) if inMediaID else 0
-	plexdb = str(inPlexDB) if inPlexDB else ''
-
         codec = None
         language = None
         channels = 0
@@ -177,21 +241,13 @@ def getPlexAudioInfo( inPlexDB, inMediaID ):
         english = False
         foreign = False
 
-        query = '       SELECT  media_streams.codec, media_streams.language, media_streams.channels, media_streams.bitrate \
-                        FROM    media_streams JOIN media_items \
-                        WHERE   media_streams.media_item_id = ' + str(media_id) + ' \
-                                AND media_streams.media_item_id = media_items.id;'
-
-        rows = queryPlexDB( plexdb, query )
-
-        for row in rows:
+        for row in inRows:
                 row_codec = row[0]
                 row_lang = row[1]
                 row_chan = row[2]
                 row_bit = row[3]
-		
 
-                if row_codec.lower() in [ 'aac', 'ac3', 'eac3', 'dca', 'mp3', 'wmav1', 'wmav2' ]:
+                if row_codec and row_codec.lower() in [ 'aac', 'ac3', 'eac3', 'dca', 'mp3', 'wmav1', 'wmav2' ]:
                         if row_lang and row_lang == 'eng':
                                 english = True
                                 if row_chan >= en_chan:
@@ -221,6 +277,171 @@ def getPlexAudioInfo( inPlexDB, inMediaID ):
         channels = int(channels) if channels else None
         bitrate = int(bitrate) if bitrate else None
 
-        return codec, language, channels, bitrate
+        return AudioInfo( codec, language, channels, bitrate )
+
+
+def getPlexAudioInfo( inPlexDB, inMediaID ):
+### getPlexAudioInfo
+#       Input: inPlexDB (string) inMediaID (int)
+#       Output: AudioInfo( codec (string), language (string), channels (int), bitrate (int) )
+#               Errors to None
+
+        media_id = int(inMediaID) if inMediaID else 0
+        plexdb = str(inPlexDB) if inPlexDB else ''
+
+        query = '       SELECT  media_streams.codec, media_streams.language, media_streams.channels, media_streams.bitrate \
+                        FROM    media_streams JOIN media_items \
+                        WHERE   media_streams.media_item_id = ' + str(media_id) + ' \
+                                AND media_streams.media_item_id = media_items.id;'
+
+        return pickPlexAudio( iterPlexDB( plexdb, query, inRowType=AudioStreamRow ) )
+
+
+def normalizeTitle( inTitle ):
+### normalizeTitle
+#       Input : inTitle (string)
+#       Output: title (string) lower case, punctuation dropped, single spaced
+#               Errors to ''
+
+        title = unicode(inTitle).lower() if inTitle else u''
+
+        title = u''.join([ c if c.isalnum() else u' ' for c in title ])
+        title = u' '.join(title.split())
+
+        return title
+
+
+def iterPlexMediaStreams( inPlexDB, inSection, inBatchSize=None ):
+### iterPlexMediaStreams
+#       Input : inPlexDB (string), inSection (int), inBatchSize (int)
+#       Output: generator of MediaStreamRow, one per stream of every media item in the section, ordered by
+#               normalized title, year and media item so that copies of a movie arrive together
+
+        section = int(inSection) if inSection else 0
+        plexdb = str(inPlexDB) if inPlexDB else ''
+
+        query = '       SELECT  normalize_title(metadata_items.title), metadata_items.title, metadata_items.year, \
+                                metadata_items.tags_genre, \
+                                media_items.id, media_items.width, media_items.height, media_items.frames_per_second, \
+                                media_items.video_codec, media_items.size, \
+                                ( SELECT media_parts.file FROM media_parts \
+                                  WHERE media_parts.media_item_id = media_items.id ORDER BY media_parts.id LIMIT 1 ), \
+                                media_streams.codec, media_streams.bitrate, media_streams.language, \
+                                media_streams.channels, media_streams.stream_type_id \
+                        FROM    metadata_items JOIN media_items \
+                                ON metadata_items.id = media_items.metadata_item_id \
+                                LEFT JOIN media_streams ON media_streams.media_item_id = media_items.id \
+                        WHERE   metadata_items.library_section_id = ' + str(section) + ' \
+                        ORDER BY 1, metadata_items.year, media_items.id;'
+
+        return iterPlexDB( plexdb, query, inBatchSize, MediaStreamRow, { 'normalize_title': normalizeTitle } )
+
+
+def iterPlexFiles( inPlexDB, inSection ):
+### iterPlexFiles
+#       Input : inPlexDB (string), inSection (int)
+#       Output: generator of file paths (string) of every media part in the section
+
+        section = int(inSection) if inSection else 0
+        plexdb = str(inPlexDB) if inPlexDB else ''
+
+        query = '       SELECT  media_parts.file \
+                        FROM    metadata_items JOIN media_items \
+                                ON metadata_items.id = media_items.metadata_item_id \
+                                JOIN media_parts ON media_parts.media_item_id = media_items.id \
+                        WHERE   metadata_items.library_section_id = ' + str(section) + ';'
+
+        for row in iterPlexDB( plexdb, query ):
+                if row[0]:
+                        yield row[0]
+
+
+def snapshotPlexDB( inPlexDB, inSnapshot ):
+### snapshotPlexDB
+#       Input : inPlexDB (string), inSnapshot (string) path of the local copy
+#       Output: snapshot (string)
+#               Errors to None
+#               Copies snapshot_tables as of a single moment into a new file, indexes it and renames it over
+#               inSnapshot, so readers never see a half-built copy and Plex's own writers are held up as
+#               briefly as possible. Connections already open on the old copy keep reading it.
+
+        plexdb = str(inPlexDB) if inPlexDB else ''
+        snapshot = os.path.abspath( inSnapshot )
+        snapshot_dir = os.path.dirname( snapshot )
+
+        start = time.time()
+        temp_file = None
+
+        try:
+                if not os.path.isdir( snapshot_dir ):
+                        os.makedirs( snapshot_dir )
+
+                fd, temp_file = tempfile.mkstemp( prefix='.plex-snapshot-', dir=snapshot_dir )
+                os.close( fd )
+                os.remove( temp_file )
+
+                db_conn = sqlite3.connect( plexdb, timeout=30 )
+                db_conn.isolation_level = None
+
+                try:
+                        db_conn.execute( 'ATTACH DATABASE ? AS snapshot', ( temp_file, ) )
+
+                        ### One read transaction, so every table is copied as of the same moment
+                        db_conn.execute( 'BEGIN' )
+                        for table in snapshot_tables:
+                                db_conn.execute( 'CREATE TABLE snapshot.' + table + ' AS SELECT * FROM main.' + table )
+                        db_conn.execute( 'COMMIT' )
+
+                        for table, column in snapshot_indexes:
+                                db_conn.execute( 'CREATE INDEX snapshot.' + table + '_' + column + ' ON ' + table + ' ( ' + column + ' )' )
+
+                        db_conn.execute( 'DETACH DATABASE snapshot' )
+                finally:
+                        db_conn.close()
+
+                os.rename( temp_file, snapshot )
+        except ( sqlite3.Error, OSError ), e:
+                log.error('Unable to snapshot the Plex database: ' + str(e))
+                if temp_file and os.path.exists( temp_file ):
+                        os.remove( temp_file )
+                return None
+
+        log.debug('Plex database snapshot taken in ' + str(round( time.time() - start, 2 )) + 's, ' \
+                  + str(int( os.path.getsize( snapshot ) / 1048576 )) + 'MB')
+
+        return snapshot
+
+
+def getPlexSnapshot( inPlexDB, inSnapshot, inMaxAge ):
+### getPlexSnapshot
+#       Input : inPlexDB (string), inSnapshot (string), inMaxAge (int) seconds
+#       Output: snapshot (string), reusing the existing one when it is younger than inMaxAge
+#               Errors to None
+
+        max_age = int(inMaxAge) if inMaxAge else 0
+
+        if os.path.isfile( inSnapshot ) and time.time() - os.path.getmtime( inSnapshot ) < max_age:
+                return os.path.abspath( inSnapshot )
+
+        return snapshotPlexDB( inPlexDB, inSnapshot )
+
+
+def startSnapshotRefresh( inPlexDB, inSnapshot, inInterval ):
+### startSnapshotRefresh
+#       Input : inPlexDB (string), inSnapshot (string), inInterval (int) seconds
+#       Output: stop (threading.Event), set it to stop refreshing
+#               Takes a new snapshot every inInterval seconds on a background thread
+
+        interval = int(inInterval) if inInterval else 0
+        stop = threading.Event()
+
+        def refresh():
+                while not stop.wait( interval ):
+                        snapshotPlexDB( inPlexDB, inSnapshot )
 
+        if interval > 0:
+                thread = threading.Thread( target=refresh, name='plex-snapshot' )
+                thread.daemon = True
+                thread.start()
 
+        return stop
@@ -0,0 +1,191 @@
+from __future__ import division
+import os
+
+try:
+        import numpy
+except ImportError:
+        numpy = None
+
+from libmediainfo import QualityInfo
+
+######
+### No-reference picture quality from a handful of decoded keyframes.
+### ffmpeg seeks to each sample point, decodes the nearest keyframe on the CPU
+### and writes it as a grey PGM, which carries its own width and height.
+### NumPy then measures:
+###       blockiness  differences across the 8 pixel block edges, over the
+###                   differences inside blocks. About 1.0 is clean, higher is blocky.
+###       sharpness   variance of the Laplacian, low is soft or blurry
+###       letterbox   black rows and columns at the edges, giving the aspect
+###                   ratio of the picture actually shown (in stored pixels)
+######
+
+### Rows or columns darker than this are black bars
+letterbox_level = 24
+
+def hasNumPy():
+### hasNumPy
+#       Output: BOOL, NumPy is needed for the spot check
+
+        return numpy is not None
+
+
+def getFrameCmd( inFFmpeg, inFile, inTime, inTimeLimit ):
+### getFrameCmd
+#       Input : inFFmpeg (string), inFile (string), inTime (float), inTimeLimit (int) seconds of CPU time ffmpeg may use
+#       Output: cmd (list) decoding one keyframe at inTime to a grey PGM on stdout
+#               Errors to None
+
+        ffmpeg_path = os.path.abspath( inFFmpeg ) if inFFmpeg else None
+        time_limit = max( 1, int(inTimeLimit) ) if inTimeLimit else 1
+
+        cmd = None
+
+        if inFile and ffmpeg_path:
+                cmd = [ ffmpeg_path ]
+                arg = '-v quiet -nostdin -timelimit ' + str(time_limit) + ' -skip_frame nokey -ss ' + str(round(float(inTime), 3))
+
+                cmd = cmd + arg.split()
+                cmd = cmd + [ '-i', inFile ]
+                cmd = cmd + '-frames:v 1 -vf format=gray -f image2pipe -vcodec pgm -'.split()
+
+        return cmd
+
+
+def getFrameTimes( inDuration, inFrames ):
+### getFrameTimes
+#       Input : inDuration (float), inFrames (int)
+#       Output: times (list of float) spread evenly through the file, skipping the very start and end
+
+        duration = float(inDuration) if inDuration else 0
+        frames = int(inFrames) if inFrames else 0
+
+        return [ duration * ( idx + 1 ) / ( frames + 1 ) for idx in range(frames) ] if duration else []
+
+
+def parsePGM( inOutput ):
+### parsePGM
+#       Input : inOutput (string) binary PGM
+#       Output: frame (numpy array of float)
+#               Errors to None
+
+        if not inOutput or not numpy or not inOutput.startswith('P5'):
+                return None
+
+        ### Header is magic, width, height and maxval separated by whitespace
+        fields = []
+        pos = 2
+        while len(fields) < 3:
+                while pos < len(inOutput) and inOutput[pos].isspace():
+                        pos += 1
+                start = pos
+                while pos < len(inOutput) and not inOutput[pos].isspace():
+                        pos += 1
+                if start == pos:
+                        return None
+                fields.append( int(inOutput[start:pos]) )
+        pos += 1
+
+        width, height, maxval = fields
+        if maxval > 255 or len(inOutput) < pos + width * height:
+                return None
+
+        frame = numpy.frombuffer( inOutput, dtype=numpy.uint8, count=width * height, offset=pos )
+
+        return frame.reshape( ( height, width ) ).astype( numpy.float32 )
+
+
+def findActiveArea( inFrame ):
+### findActiveArea
+#       Input : inFrame (numpy array)
+#       Output: top, bottom, left, right (int) bounds of the picture inside any black bars
+
+        rows = numpy.nonzero( inFrame.mean( axis=1 ) > letterbox_level )[0]
+        cols = numpy.nonzero( inFrame.mean( axis=0 ) > letterbox_level )[0]
+
+        if not len(rows) or not len(cols):
+                return 0, inFrame.shape[0], 0, inFrame.shape[1]
+
+        return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+def calcBlockiness( inFrame ):
+### calcBlockiness
+#       Input : inFrame (numpy array)
+#       Output: blockiness (float)
+#               Errors to None
+
+        h_diff = numpy.abs( numpy.diff( inFrame, axis=1 ) )
+        v_diff = numpy.abs( numpy.diff( inFrame, axis=0 ) )
+
+        if h_diff.shape[1] < 16 or v_diff.shape[0] < 16:
+                return None
+
+        ### diff[:, 7] is the step between column 7 and 8, the first block edge
+        h_edge = h_diff[:, 7::8].mean()
+        v_edge = v_diff[7::8, :].mean()
+
+        h_mask = numpy.ones( h_diff.shape[1], dtype=bool )
+        h_mask[7::8] = False
+        v_mask = numpy.ones( v_diff.shape[0], dtype=bool )
+        v_mask[7::8] = False
+
+        inner = ( h_diff[:, h_mask].mean() + v_diff[v_mask, :].mean() ) / 2
+
+        if not inner:
+                return None
+
+        return ( ( h_edge + v_edge ) / 2 ) / inner
+
+
+def calcSharpness( inFrame ):
+### calcSharpness
+#       Input : inFrame (numpy array)
+#       Output: sharpness (float) variance of the Laplacian
+#               Errors to None
+
+        if inFrame.shape[0] < 3 or inFrame.shape[1] < 3:
+                return None
+
+        laplacian = inFrame[1:-1, :-2] + inFrame[1:-1, 2:] + inFrame[:-2, 1:-1] + inFrame[2:, 1:-1] - 4 * inFrame[1:-1, 1:-1]
+
+        return float( laplacian.var() )
+
+
+def calcQualityInfo( inFrames, inSeconds ):
+### calcQualityInfo
+#       Input : inFrames (list of numpy arrays), inSeconds (float) time spent decoding
+#       Output: QualityInfo( frames (int), blockiness (float), sharpness (float), active_aspect (float), seconds (float) )
+#               Metrics are medians over the frames, measured inside the black bars
+#               Errors to None
+
+        blockiness = []
+        sharpness = []
+        aspects = []
+
+        for frame in inFrames:
+                top, bottom, left, right = findActiveArea( frame )
+                active = frame[top:bottom, left:right]
+
+                if active.shape[0] < 16 or active.shape[1] < 16:
+                        continue
+
+                aspects.append( active.shape[1] / active.shape[0] )
+
+                block = calcBlockiness( frame[top - top % 8:bottom, left - left % 8:right] )
+                if block:
+                        blockiness.append( block )
+
+                sharp = calcSharpness( active )
+                if sharp != None:
+                        sharpness.append( sharp )
+
+        if not aspects:
+                return None
+
+        blockiness = float( numpy.median( blockiness ) ) if blockiness else None
+        sharpness = float( numpy.median( sharpness ) ) if sharpness else None
+        active_aspect = round( float( numpy.median( aspects ) ), 3 )
+
+        return QualityInfo( len(aspects), blockiness, sharpness, active_aspect, round(inSeconds, 3) )
+
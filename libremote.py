@@ -0,0 +1,160 @@
+from __future__ import division
+import logging
+import os
+import tempfile
+import threading
+import time
+
+log = logging.getLogger('process_files.py')
+
+######
+### Probing files on network storage. ffprobe makes many small reads, mostly
+### at the start of a file and, for MP4 moov atoms, AVI indexes and MKV cues,
+### at the end. On NFS or SMB each of those is a round trip. prefetchFile copies
+### just the head and tail with a few large sequential reads into a sparse local
+### file of the same size, so ffprobe finds everything where it expects it and
+### never touches the network. The holes read back as zeros, so only use the copy
+### for header probes (streams, duration), never for decoding or packet reads.
+### An index bigger than the tail is cut short and the copy won't probe, so
+### callers probe the real file when the copy gives nothing back.
+######
+
+### Filesystem types treated as remote, from /proc/mounts
+remote_fstypes = ( 'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'fuse.sshfs', '9p' )
+
+### Bytes to copy from each end of the file, ffprobe reads up to 5MB to find the streams, and the size of each read
+prefetch_head = 8 * 1024 * 1024
+prefetch_tail = 2 * 1024 * 1024
+read_size = 4 * 1024 * 1024
+
+### Running totals for the whole run, see getIOStats
+io_stats = { 'files': 0, 'bytes': 0, 'file_bytes': 0, 'reads': 0, 'seconds': 0.0 }
+io_lock = threading.Lock()
+
+mount_table = None
+
+def getMounts():
+### getMounts
+#       Output: mounts (list of ( mount point, fstype )), longest mount point first
+#               Read from /proc/mounts once per run, errors to empty
+
+        global mount_table
+
+        if mount_table == None:
+                mounts = []
+                try:
+                        with open('/proc/mounts') as f:
+                                for line in f:
+                                        fields = line.split()
+                                        if len(fields) > 2:
+                                                mounts.append( ( fields[1].replace('\\040', ' '), fields[2] ) )
+                except IOError:
+                        pass
+
+                mount_table = sorted( mounts, key=lambda m: len(m[0]), reverse=True )
+
+        return mount_table
+
+
+def isRemoteFile( inFile ):
+### isRemoteFile
+#       Input : inFile (string)
+#       Output: BOOL, the file is on a network filesystem
+
+        path = os.path.realpath( inFile ) if inFile else ''
+
+        for mount, fstype in getMounts():
+                if path == mount or path.startswith( mount.rstrip('/') + '/' ):
+                        return fstype in remote_fstypes
+
+        return False
+
+
+def prefetchFile( inFile, inTempDir=None, inHeadBytes=None, inTailBytes=None ):
+### prefetchFile
+#       Input : inFile (string), inTempDir (string), inHeadBytes (int), inTailBytes (int)
+#       Output: local_file (string) sparse local copy of the head and tail, same size and extension as inFile
+#               Remove it with removePrefetch when done
+#               Errors to None
+
+        head = int(inHeadBytes) if inHeadBytes else prefetch_head
+        tail = int(inTailBytes) if inTailBytes else prefetch_tail
+
+        local_file = None
+        reads = 0
+        copied = 0
+        start = time.time()
+
+        try:
+                size = os.path.getsize( inFile )
+
+                ### Small files are copied whole
+                ranges = [ ( 0, size ) ] if size <= head + tail else [ ( 0, head ), ( size - tail, size ) ]
+
+                fd, local_file = tempfile.mkstemp( suffix=os.path.splitext( inFile )[1], prefix='.prefetch-', dir=inTempDir )
+
+                with os.fdopen( fd, 'wb' ) as out:
+                        out.truncate( size )
+                        with open( inFile, 'rb' ) as src:
+                                for first, last in ranges:
+                                        src.seek( first )
+                                        out.seek( first )
+                                        pos = first
+                                        while pos < last:
+                                                data = src.read( min( read_size, last - pos ) )
+                                                if not data:
+                                                        break
+                                                out.write( data )
+                                                pos += len(data)
+                                                copied += len(data)
+                                                reads += 1
+        except ( IOError, OSError ), e:
+                log.warn('Unable to prefetch ' + inFile + ': ' + str(e))
+                removePrefetch( local_file )
+                return None
+
+        seconds = time.time() - start
+
+        with io_lock:
+                io_stats['files'] += 1
+                io_stats['bytes'] += copied
+                io_stats['file_bytes'] += size
+                io_stats['reads'] += reads
+                io_stats['seconds'] += seconds
+
+        log.debug('Prefetched ' + str(int( copied / 1048576 )) + 'MB of ' + str(int( size / 1048576 )) + 'MB from ' + inFile \
+                  + ' in ' + str(reads) + ' reads, ' + str(round(seconds, 3)) + 's')
+
+        return local_file
+
+
+def prefetchRemoteFile( inFile, inTempDir=None, inHeadBytes=None, inTailBytes=None ):
+### prefetchRemoteFile
+#       Input : see prefetchFile
+#       Output: local_file (string) from prefetchFile if inFile is on a network filesystem
+#               Errors to None
+
+        if not isRemoteFile( inFile ):
+                return None
+
+        return prefetchFile( inFile, inTempDir, inHeadBytes, inTailBytes )
+
+
+def removePrefetch( inLocalFile ):
+### removePrefetch
+#       Input : inLocalFile (string) from prefetchFile
+#       Output: None
+
+        if inLocalFile and os.path.isfile( inLocalFile ):
+                try:
+                        os.remove( inLocalFile )
+                except OSError:
+                        pass
+
+
+def getIOStats():
+### getIOStats
+#       Output: stats (dict) files, bytes copied, file_bytes (total size of the files), reads, seconds
+
+        with io_lock:
+                return dict( io_stats )
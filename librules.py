@@ -0,0 +1,123 @@
+import json
+import logging
+
+log = logging.getLogger('process_files.py')
+
+######
+### Scoring and disposition rules. Every threshold libscore uses lives here so
+### it can be tuned from a JSON file (see rules.json) instead of in the code.
+### A rules file only needs the keys it changes, the rest come from default_rules.
+### compileRules checks the file once per run and turns it into the lookups the
+### scoring uses, like codec ranks and sets, so nothing is parsed per file.
+######
+
+default_rules = {
+        ### Bare minimum, anything below is removed
+        'classic_year': 1977,                   # older movies are exempt from the aspect ratio check and scored leniently
+        'min_aspect': 1.34,
+        'min_bpp': 0.04,
+
+        ### Video score, one point per bits-per-pixel step passed, plus codec bonuses
+        'video_bpp_steps': [ 0.05, 0.08, 0.1, 0.2, 1 ],
+        'video_codec_bonus': { 'h265': 1 },
+
+        ### Audio score
+        'audio_bitrate_steps': [ 98000, 127000, 150000, 256000, 100000000 ],
+        'audio_codec_bonus': { 'ac3': 1, 'eac3': 1, 'dca': 1 },
+        'surround_channels': 6,
+        'surround_bonus': 2,
+        'english_bonus': 2,                     # english audio, or english subtitles
+
+        ### Total score is video * weight + audio * weight
+        'classic_weights': [ 1.2, 1.5 ],
+        'high_def_weights': [ 0.9, 0.75 ],
+        'default_weights': [ 1, 0.9 ],
+
+        ### Totals at or below remove_score are removed, at or below staging_score go to staging
+        'remove_score': 3,
+        'staging_score': 8,
+
+        ### MVDB genres that want a higher quality encode, and the names Plex gives them
+        'high_def_genres': { '12': 'adventure', '14': 'fantasy', '16': 'animation', '27': 'horror', '28': 'action', '878': 'science fiction' },
+
+        ### Replacing a library file: best codec first, bitrates are against the rule of 0.75
+        'codecs': [ 'mpeg2', 'h265', 'h264', 'mpeg4' ],
+        'pixel_exponent': 0.75,
+        'same_codec_ratio': 1.2,
+        'better_codec_ratio': 0.75,
+        'worse_codec_ratio': 1.7,               # one step worse only, goes to staging
+        'min_audio_bitrate': 150000,
+
+        ### Spot check limits, see libquality
+        'blocky_level': 1.3,
+        'clean_level': 1.1,
+        'blurry_level': 30,
+        'sharp_level': 150,
+}
+
+
+def loadRules( inRulesFile ):
+### loadRules
+#       Input : inRulesFile (string) JSON rules file
+#       Output: rules (dict) compiled, see compileRules
+#               Errors to None
+
+        try:
+                with open( inRulesFile ) as f:
+                        config = json.load( f )
+        except ( IOError, ValueError ), e:
+                log.error('Unable to read rules from ' + str(inRulesFile) + ': ' + str(e))
+                return None
+
+        return compileRules( config )
+
+
+def compileRules( inConfig ):
+### compileRules
+#       Input : inConfig (dict) rules, missing keys are taken from default_rules
+#       Output: rules (dict) every key of default_rules, plus:
+#                       codec_rank (dict) codec to rank, 0 is best
+#                       high_def_ids (set of int) MVDB genre ids
+#                       high_def_names (set of string) Plex genre names
+#               Errors to None
+
+        config = inConfig if isinstance( inConfig, dict ) else {}
+        rules = dict( default_rules )
+
+        for key in config:
+                if key not in default_rules:
+                        log.error('Unknown rule: ' + str(key))
+                        return None
+
+                if type(config[key]) != type(default_rules[key]) and not ( isinstance( config[key], ( int, float ) ) \
+                                                                           and isinstance( default_rules[key], ( int, float ) ) ):
+                        log.error('Rule ' + key + ' should be a ' + type(default_rules[key]).__name__)
+                        return None
+
+                rules[key] = config[key]
+
+        for key in [ 'video_bpp_steps', 'audio_bitrate_steps' ]:
+                if rules[key] != sorted(rules[key]):
+                        log.error('Rule ' + key + ' must be in ascending order')
+                        return None
+                rules[key] = tuple([ float(step) for step in rules[key] ])
+
+        for key in [ 'classic_weights', 'high_def_weights', 'default_weights' ]:
+                if len(rules[key]) != 2:
+                        log.error('Rule ' + key + ' must be [ video weight, audio weight ]')
+                        return None
+                rules[key] = tuple([ float(weight) for weight in rules[key] ])
+
+        try:
+                rules['high_def_ids'] = frozenset([ int(genre) for genre in rules['high_def_genres'] ])
+        except ValueError:
+                log.error('Rule high_def_genres must be keyed by MVDB genre id')
+                return None
+
+        rules['high_def_names'] = frozenset([ str(name).lower() for name in rules['high_def_genres'].values() ])
+        rules['codec_rank'] = dict([ ( rules['codecs'][idx], idx ) for idx in range(len(rules['codecs'])) ])
+
+        return rules
+
+
+rules = compileRules( default_rules )
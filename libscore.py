@@ -0,0 +1,563 @@
+from __future__ import division
+import logging
+import librules
+
+try:
+        import numpy
+except ImportError:
+        numpy = None
+
+from libmediainfo import AudioInfo, MediaInfo, QualityInfo, VideoInfo
+
+log = logging.getLogger('process_files.py')
+
+######
+### Every function takes the compiled rules from librules. Without them the
+### built-in defaults (librules.rules) are used.
+######
+
+def mungeCodec( inCodec ):
+### mungeCodec
+#       Input: inCodec (string)
+#       Output: codec (string)
+#               Errors to None
+
+        codec = str(inCodec) if isinstance( inCodec, basestring ) else None
+
+        if codec:
+                if 'mpeg2' in codec or 'mpeg-2' in codec:
+                        codec = 'mpeg2'
+                elif 'hev' in codec or 'h265' in codec:
+                        codec = 'h265'
+                elif 'avc' in codec or 'h264' in codec:
+                        codec = 'h264'
+                elif codec in [ 'dx50', 'xvid', 'div3', 'divx' ] or 'mpeg-4' in codec or 'mpeg4' in codec:
+                        codec = 'mpeg4'
+                else:
+                        codec = 'unknown'
+
+        codec = str(codec) if codec else None
+
+        return codec
+
+
+def isHighDef( inGenres, inRules=None ):
+### isHighDef
+#       Input : inGenres (list of int) MVDB genre ids, inRules (dict) from librules
+#       Output: high_def (BOOL), the movie is in a genre that wants a higher quality file
+
+        rules = inRules if inRules else librules.rules
+
+        for genre in inGenres if inGenres else []:
+                if genre in rules['high_def_ids']:
+                        return True
+
+        return False
+
+
+def calcVideoScore( inCodec, inBitrate, inPixels, inFramerate, inRules=None ):
+### calcVideoScore
+#       Input: codec (string), bitrate (int), pixels (int), framerite (float), inRules (dict) from librules
+#       Outout: score (int)
+#               Errors to 0
+
+        codec = str(inCodec) if inCodec else ''
+        bitrate = int(inBitrate) if inBitrate else 0
+        pixels = int(inPixels) if inPixels else 0
+        framerate = float(inFramerate) if inFramerate else 0
+        rules = inRules if inRules else librules.rules
+
+        score = 0
+
+        if pixels and framerate:
+                bpp = bitrate / ( pixels * framerate )
+        else:
+                bpp = 0
+
+        steps = rules['video_bpp_steps']
+        for i in steps:
+                if bpp > i:
+                        continue
+                else:
+                        score = steps.index(i)
+                        break
+
+        score += rules['video_codec_bonus'].get( codec, 0 )
+
+        score = int(score) if score else 0
+
+        return score
+
+
+def calcAudioScore( inCodec, inBitrate, inChannels, inLanguage, inSubtitles, inRules=None ):
+### calcAudioScore
+#       Input : inCodec (string), inBitrate (int), inChannels (int), inLanguage (string), inSubtitles (BOOL),
+#               inRules (dict) from librules
+#       Output: score (int)
+#               Errors to 0
+
+        codec = str(inCodec) if inCodec else ''
+        bitrate = int(inBitrate) if inBitrate else 0
+        channels = int(inChannels) if inChannels else 0
+        language = str(inLanguage) if inLanguage else 'unknwon'
+        subtitles = True if inSubtitles else False
+        rules = inRules if inRules else librules.rules
+
+        score = 0
+
+        score += rules['surround_bonus'] if channels >= rules['surround_channels'] else 0
+
+        if ( not language == 'english' and subtitles ) or language == 'english':
+                score += rules['english_bonus']
+
+        steps = rules['audio_bitrate_steps']
+        for i in steps:
+                if bitrate > i:
+                        continue
+                else:
+                        score += steps.index(i)
+                        break
+
+        score += rules['audio_codec_bonus'].get( codec, 0 )
+
+        score = int(score) if score else 0
+
+        return score
+
+
+def calcQualityScore( inQuality, inRules=None ):
+### calcQualityScore
+#       Input : inQuality (QualityInfo), inRules (dict) from librules
+#       Output: score (int) -2 to 1, how the decoded frames look
+#               Errors to 0
+
+        blockiness = inQuality.blockiness if inQuality else None
+        sharpness = inQuality.sharpness if inQuality else None
+        rules = inRules if inRules else librules.rules
+
+        score = 0
+
+        if blockiness and blockiness > rules['blocky_level']:
+                score -= 1
+        if sharpness != None and sharpness < rules['blurry_level']:
+                score -= 1
+        if not score and blockiness and blockiness < rules['clean_level'] and sharpness > rules['sharp_level']:
+                score += 1
+
+        return score
+
+
+def calcTotalScore( inVideoScore, inAudioScore, inYear, inHighDef, inQuality=None, inRules=None ):
+### caclTotalScore
+#       Input : inVideoScore (int), inAudioScore (int), inYear (int), inHighDef (BOOL), inQuality (QualityInfo),
+#               inRules (dict) from librules
+#       Output: total_score (float)
+#               Errors to None
+
+        vid_score = int(inVideoScore) if inVideoScore else 0
+        aud_score = int(inAudioScore) if inAudioScore else 0
+        year = int(inYear) if inYear else 0
+        high_def = True if inHighDef else False
+        rules = inRules if inRules else librules.rules
+
+        score = 0
+
+        if year < rules['classic_year']:
+                # Be more lenient on classic movies
+                weights = rules['classic_weights']
+        elif high_def:
+                # Be more stringent on genres that generally require a higher quality encode
+                weights = rules['high_def_weights']
+        else:
+                weights = rules['default_weights']
+
+        score = vid_score * weights[0] + aud_score * weights[1]
+
+        # Borderline scores would go to staging, let the decoded frames tip them
+        if inQuality and score > rules['remove_score'] and score <= rules['staging_score']:
+                score += calcQualityScore( inQuality, inRules )
+
+        score = float(score) if score else 0
+
+        return score
+
+
+
+def getEffectivePixels( inVideo ):
+### getEffectivePixels
+#       Input : inVideo (VideoInfo)
+#       Output: pixels (int) of the picture inside any black bars when crop detection ran, else the whole frame
+#               Errors to 0
+
+        pixels = inVideo.active_pixels if inVideo and inVideo.active_pixels else None
+        pixels = inVideo.pixels if inVideo and not pixels else pixels
+
+        pixels = int(pixels) if pixels else 0
+
+        return pixels
+
+
+def calcMediaScore( inMedia, inYear, inHighDef, inRules=None ):
+### calcMediaScore
+#       Input : inMedia (MediaInfo), inYear (int), inHighDef (BOOL), inRules (dict) from librules
+#       Output: total_score (float)
+#               Errors to 0
+
+        video = inMedia.video
+        audio = inMedia.audio
+
+        vid_score = calcVideoScore( video.codec, video.bitrate, getEffectivePixels( video ), video.framerate, inRules )
+        aud_score = calcAudioScore( audio.codec, audio.bitrate, audio.channels, audio.language, inMedia.eng_subtitles, inRules )
+
+        return calcTotalScore( vid_score, aud_score, inYear, inHighDef, inMedia.quality, inRules )
+
+
+def getCodecRank( inCodec, inRules=None ):
+### getCodecRank
+#       Input : inCodec (string), inRules (dict) from librules
+#       Output: rank (int) 0 is the best codec, codecs not in the rules rank below all of them,
+#               though dispositionMovie sends those to staging before ranks are compared
+
+        rules = inRules if inRules else librules.rules
+
+        return rules['codec_rank'].get( inCodec, len(rules['codecs']) )
+
+
+def dispositionMovie( inMedia, inOldMedia, inYear, inHighDef, inDuplicate, inTitle, inOldFile, inRules=None ):
+### dispositionMovie
+#       Input : inMedia (MediaInfo), inOldMedia (MediaInfo), inYear (int), inHighDef (BOOL), inDuplicate (BOOL),
+#               inTitle (string), inOldFile (string), inRules (dict) from librules
+#       Output: remove (BOOL), staging (BOOL), error (int)
+
+        codec = inMedia.video.codec
+        bitrate = inMedia.video.bitrate
+        ratio = inMedia.video.aspect
+        ### The picture inside the black bars, when a spot check measured it, is what the aspect rule is about
+        if inMedia.quality and inMedia.quality.active_aspect:
+                ratio = inMedia.quality.active_aspect
+        pixels = getEffectivePixels( inMedia.video )
+        framerate = inMedia.video.framerate
+        aud_codec = inMedia.audio.codec
+        language = inMedia.audio.language
+        channels = inMedia.audio.channels
+        aud_bitrate = inMedia.audio.bitrate
+        eng_subtitles = inMedia.eng_subtitles
+        year = int(inYear) if inYear else 0
+        high_def = True if inHighDef else False
+        duplicate = True if inDuplicate else False
+        title = str(inTitle) if inTitle else ''
+        old_file = str(inOldFile) if inOldFile else ''
+        rules = inRules if inRules else librules.rules
+
+        if duplicate:
+                old_codec = inOldMedia.video.codec
+                old_bitrate = inOldMedia.video.bitrate
+                old_pixels = getEffectivePixels( inOldMedia.video )
+                old_fps = inOldMedia.video.framerate
+                old_aud_codec = inOldMedia.audio.codec
+                old_lang = inOldMedia.audio.language
+                old_channels = inOldMedia.audio.channels
+                old_aud_bitrate = inOldMedia.audio.bitrate
+                old_eng_subtitles = inOldMedia.eng_subtitles
+
+        bpp = bitrate / ( pixels * framerate ) if pixels and framerate else 0
+
+        remove = False
+        staging = False
+        error = 0
+
+        if ( year >= rules['classic_year'] and ratio < rules['min_aspect'] ) or bitrate < ( pixels * framerate ) * rules['min_bpp']:
+                log.error('Movie does not meet bare minimum requirements.')
+                remove = True
+                error = 1
+
+        elif codec not in rules['codec_rank']:
+                log.error('Movie video codec unknown: ' + str(codec))
+                staging = True
+
+        elif duplicate and old_codec not in rules['codec_rank']:
+                log.error('Library file video codec unknown: ' + str(old_codec))
+                staging = True
+
+        elif duplicate and ( not old_pixels or not old_bitrate ):
+                log.error('File found in the Plex library, but not analyzed yet. Analyze "' + title + '" in Plex and rerun this script.')
+                error = 1
+
+        elif not duplicate:
+                log.debug('Found in the Plex library: FALSE')
+
+                ### Check video quality
+                log.debug('Video Stats: ' + codec + ', ' + str(int( bitrate / 1000 )) + 'kbps, ' + str(int( pixels / 1000 )) + 'k pixels.' )
+                log.debug('Bits-Per-Pixel (BPP): ' + str(round(bpp, 3)))
+
+                log.debug('High-def genre: ' + str(high_def).upper() )
+
+                vid_score = calcVideoScore( codec, bitrate, pixels, framerate, rules )
+
+                ### SCORE AUDIO
+                log.debug('Audio Stats: ' + language + ', ' + str(channels) + ' channels, ' + str(int( aud_bitrate / 1000 )) + 'kbps' )
+
+                aud_score = calcAudioScore( aud_codec, aud_bitrate, channels, language, eng_subtitles, rules )
+
+                if language == 'english':
+                        log.debug('English audio track: TRUE')
+                else:
+                        log.debug('English audio track: FALSE')
+
+                log.debug('English subtitles: ' + str(eng_subtitles).upper())
+
+                if inMedia.quality:
+                        log.debug('Spot check: blockiness ' + str(inMedia.quality.blockiness) + ', sharpness ' + str(inMedia.quality.sharpness) \
+                                  + ', active aspect ' + str(inMedia.quality.active_aspect))
+
+                total_score = calcTotalScore( vid_score, aud_score, year, high_def, inMedia.quality, rules )
+
+                log.debug('Total quality score: ' + str(total_score))
+
+                if total_score <= rules['remove_score']:
+                        remove = True
+                elif total_score <= rules['staging_score']:
+                        staging = True
+
+        else:
+                log.warn('Found in Plex library: TRUE')
+                log.debug('Duplicate found in ' + old_file)
+
+                estimated_bitrate = ( ( pixels / old_pixels ) ** rules['pixel_exponent'] ) * old_bitrate
+                old_bpp = old_bitrate / ( old_pixels * old_fps ) if old_fps else 0
+
+                #### VIDEO COMPARISON
+                log.debug('Video Stats, OLD: ' + old_codec + ', ' + str(int( old_bitrate / 1000 )) + 'kbps, ' + str(int( old_pixels / 1000 )) \
+                          + 'k pixels, BPP: ' + str(round(old_bpp, 3)) )
+                log.debug('Video Stats, NEW: ' + codec + ', ' + str(int( bitrate / 1000 )) + 'kbps, ' + str(int( pixels / 1000 )) \
+                          + 'k pixels, BPP: ' + str(round(bpp, 3)) )
+
+                log.debug('Target bitrate for the rule of 0.75 is: ' + str(int( estimated_bitrate / 1000 )) + 'kbps.' )
+
+                old_vidscore = calcVideoScore( old_codec, old_bitrate, old_pixels, old_fps, rules )
+                vidscore = calcVideoScore( codec, bitrate, pixels, framerate, rules )
+                rank = getCodecRank( codec, rules )
+                old_rank = getCodecRank( old_codec, rules )
+
+                log.debug('High-def genre: ' + str(high_def).upper() )
+
+                # If the codec is the same, then the bitrate must be 20% than the rule of 0.75
+                if codec == old_codec and int(bitrate) >= ( estimated_bitrate * rules['same_codec_ratio'] ):
+                        log.debug('Movie codec is equal and bitrate is at least ' + str(rules['same_codec_ratio']) + 'x the target.')
+
+                # If the codec is better, the bitrate must be at least 75% of the rule of 0.75
+                elif rank < old_rank and int(bitrate) >= ( estimated_bitrate * rules['better_codec_ratio'] ):
+                        log.debug('Movie codec is better and bitrate is at least ' + str(rules['better_codec_ratio']) + 'x the target.')
+
+                #If the codec is worse, the bitrate must be at least 170% of the rule of 0.75
+                elif rank - old_rank == 1 and int(bitrate) >= ( estimated_bitrate * rules['worse_codec_ratio'] ):
+                        log.debug('Movie codec is older, but the bitrate is at least ' + str(rules['worse_codec_ratio']) + 'x the target.')
+                        staging = True
+
+                else:
+                        log.warn('Movie codec is older than previous and/or it does not meet bitrate target.')
+                        remove = True
+
+                #### AUDIO COMPARISON
+                log.debug('Audio Stats, OLD: ' + old_lang + ', ' + old_aud_codec + ', ' + str(old_channels) + ' channels, ' \
+                          + str(int( old_aud_bitrate / 1000 )) + 'kbps, Eng Subtitles = ' + str(old_eng_subtitles))
+                log.debug('Audio Stats, NEW: ' + language + ', ' + aud_codec + ', ' + str(channels) + ' channels, ' \
+                          + str(int( aud_bitrate / 1000 )) + 'kbps, Eng Subtitles = ' + str(eng_subtitles))
+
+                if ( channels >= old_channels or channels >= rules['surround_channels'] ) and int(aud_bitrate) > rules['min_audio_bitrate']:
+                        log.debug('Movie audio track quality meets or exceeds the previous.')
+                elif channels == 0 or int(aud_bitrate) == 0:
+                        log.debug('Movie audio track quality unknown.')
+                        staging = True
+                else:
+                        log.warn('Movie audio track quality does not meet the standard of the previous.')
+                        remove = True
+
+                old_audscore = calcAudioScore( old_aud_codec, old_aud_bitrate, old_channels, old_lang, old_eng_subtitles, rules )
+                audscore = calcAudioScore( aud_codec, aud_bitrate, channels, language, eng_subtitles, rules )
+
+                old_totalscore = calcTotalScore( old_vidscore, old_audscore, year, high_def, None, rules )
+                totalscore = calcTotalScore( vidscore, audscore, year, high_def, inMedia.quality, rules )
+
+                log.debug('Total Quality Score, OLD: ' + str(round(old_totalscore, 3)))
+                log.debug('Total Quality Score, NEW: ' + str(round(totalscore, 3)))
+
+                if totalscore > old_totalscore and totalscore > rules['remove_score'] and remove == True:
+                        remove = False
+                        staging = True
+
+        return remove, staging, error
+
+
+######
+### Columnar evaluation, the same decisions as dispositionMovie for a whole
+### batch at once with no logging. Columns are equal length lists, one entry
+### per file, named after the locals of dispositionMovie (pixels and old_pixels
+### are the effective pixels). Spot check results are blockiness, sharpness and
+### active_aspect, None when the file wasn't checked. NumPy does the work when
+### it is installed.
+######
+
+decision_columns = ( 'year', 'high_def', 'duplicate', 'codec', 'bitrate', 'aspect', 'pixels', 'framerate',
+                     'aud_codec', 'aud_bitrate', 'channels', 'language', 'eng_subtitles', 'spot_checked', 'blockiness', 'sharpness',
+                     'active_aspect', 'old_codec', 'old_bitrate', 'old_pixels', 'old_fps', 'old_aud_codec', 'old_aud_bitrate',
+                     'old_channels', 'old_lang', 'old_eng_subtitles' )
+
+def getColumnArray( inColumn, inEmpty=0 ):
+### getColumnArray
+#       Input : inColumn (list), inEmpty (float) stands in for None
+#       Output: array (numpy array of float)
+
+        return numpy.array([ inEmpty if value == None else value for value in inColumn ], dtype=numpy.float64)
+
+
+def calcScoreColumns( inCodec, inBitrate, inPixels, inFramerate, inAudCodec, inAudBitrate, inChannels, inLanguage, inSubtitles,
+                      inYear, inHighDef, inRules ):
+### calcScoreColumns
+#       Input : columns (numpy arrays, string lists for codecs and language) as calcVideoScore, calcAudioScore and
+#               calcTotalScore take them, inRules (dict) from librules
+#       Output: total_score (numpy array), before any spot check
+
+        rules = inRules
+
+        pixel_rate = inPixels * inFramerate
+        with numpy.errstate( divide='ignore', invalid='ignore' ):
+                bpp = numpy.where( pixel_rate > 0, inBitrate / pixel_rate, 0 )
+
+        ### Points for each step passed, nothing at all past the last step
+        steps = rules['video_bpp_steps']
+        vid_score = numpy.searchsorted( steps, bpp, side='left' )
+        vid_score = numpy.where( vid_score < len(steps), vid_score, 0 )
+        vid_score = vid_score + numpy.array([ rules['video_codec_bonus'].get( codec, 0 ) for codec in inCodec ])
+
+        steps = rules['audio_bitrate_steps']
+        aud_score = numpy.searchsorted( steps, inAudBitrate, side='left' )
+        aud_score = numpy.where( aud_score < len(steps), aud_score, 0 )
+        aud_score = aud_score + numpy.array([ rules['audio_codec_bonus'].get( codec, 0 ) for codec in inAudCodec ])
+        aud_score = aud_score + numpy.where( inChannels >= rules['surround_channels'], rules['surround_bonus'], 0 )
+
+        english = numpy.array([ language == 'english' for language in inLanguage ], dtype=bool )
+        aud_score = aud_score + numpy.where( english | inSubtitles, rules['english_bonus'], 0 )
+
+        classic = inYear < rules['classic_year']
+        vid_weight = numpy.where( classic, rules['classic_weights'][0], numpy.where( inHighDef, rules['high_def_weights'][0], rules['default_weights'][0] ) )
+        aud_weight = numpy.where( classic, rules['classic_weights'][1], numpy.where( inHighDef, rules['high_def_weights'][1], rules['default_weights'][1] ) )
+
+        return vid_score * vid_weight + aud_score * aud_weight
+
+
+def dispositionColumns( inColumns, inRules=None ):
+### dispositionColumns
+#       Input : inColumns (dict) of decision_columns, inRules (dict) from librules
+#       Output: remove (list of BOOL), staging (list of BOOL), error (list of int)
+
+        rules = inRules if inRules else librules.rules
+        count = len(inColumns['year'])
+
+        if not count:
+                return [], [], []
+
+        if not numpy:
+                return dispositionRows( inColumns, rules )
+
+        cols = dict([ ( name, inColumns[name] ) for name in [ 'codec', 'aud_codec', 'language', 'old_codec', 'old_aud_codec', 'old_lang' ] ])
+        for name in decision_columns:
+                if name not in cols:
+                        cols[name] = getColumnArray( inColumns[name], numpy.nan if name in [ 'blockiness', 'sharpness' ] else 0 )
+
+        high_def = cols['high_def'] > 0
+        duplicate = cols['duplicate'] > 0
+
+        ### NEW FILE SCORE, WITH THE SPOT CHECK FOR BORDERLINE FILES
+        total = calcScoreColumns( cols['codec'], cols['bitrate'], cols['pixels'], cols['framerate'], cols['aud_codec'], cols['aud_bitrate'],
+                                  cols['channels'], cols['language'], cols['eng_subtitles'] > 0, cols['year'], high_def, rules )
+
+        blockiness = cols['blockiness']
+        sharpness = cols['sharpness']
+        with numpy.errstate( invalid='ignore' ):
+                quality = -1 * ( blockiness > rules['blocky_level'] ) - 1 * ( sharpness < rules['blurry_level'] )
+                clean = ( blockiness != 0 ) & ( blockiness < rules['clean_level'] ) & ( sharpness > rules['sharp_level'] )
+        quality = numpy.where( ( quality == 0 ) & clean, 1, quality )
+
+        borderline = ( cols['spot_checked'] > 0 ) & ( total > rules['remove_score'] ) & ( total <= rules['staging_score'] )
+        total = numpy.where( borderline, total + quality, total )
+
+        ### THE RULE CHAIN
+        ratio = numpy.where( ( cols['spot_checked'] > 0 ) & ( cols['active_aspect'] > 0 ), cols['active_aspect'], cols['aspect'] )
+        bare = ( ( cols['year'] >= rules['classic_year'] ) & ( ratio < rules['min_aspect'] ) ) \
+               | ( cols['bitrate'] < cols['pixels'] * cols['framerate'] * rules['min_bpp'] )
+        unknown = ~bare & ( numpy.array([ codec not in rules['codec_rank'] for codec in cols['codec'] ], dtype=bool )
+                            | ( duplicate & numpy.array([ codec not in rules['codec_rank'] for codec in cols['old_codec'] ], dtype=bool ) ) )
+        rest = ~bare & ~unknown
+        unanalyzed = rest & duplicate & ( ( cols['old_pixels'] == 0 ) | ( cols['old_bitrate'] == 0 ) )
+        fresh = rest & ~duplicate
+        compare = rest & duplicate & ~unanalyzed
+
+        ### Against the library file, video by the rule of 0.75 and audio by channels and bitrate
+        with numpy.errstate( divide='ignore', invalid='ignore' ):
+                estimated = ( ( cols['pixels'] / cols['old_pixels'] ) ** rules['pixel_exponent'] ) * cols['old_bitrate']
+
+        bitrate = numpy.floor( cols['bitrate'] )
+        rank = numpy.array([ getCodecRank( codec, rules ) for codec in cols['codec'] ])
+        old_rank = numpy.array([ getCodecRank( codec, rules ) for codec in cols['old_codec'] ])
+        same = numpy.array([ cols['codec'][idx] == cols['old_codec'][idx] for idx in range(count) ], dtype=bool )
+
+        with numpy.errstate( invalid='ignore' ):
+                video_ok = ( same & ( bitrate >= estimated * rules['same_codec_ratio'] ) ) \
+                           | ( ( rank < old_rank ) & ( bitrate >= estimated * rules['better_codec_ratio'] ) )
+                video_staging = ~video_ok & ( rank - old_rank == 1 ) & ( bitrate >= estimated * rules['worse_codec_ratio'] )
+        video_remove = ~video_ok & ~video_staging
+
+        aud_bitrate = numpy.floor( cols['aud_bitrate'] )
+        audio_ok = ( ( cols['channels'] >= cols['old_channels'] ) | ( cols['channels'] >= rules['surround_channels'] ) ) \
+                   & ( aud_bitrate > rules['min_audio_bitrate'] )
+        audio_staging = ~audio_ok & ( ( cols['channels'] == 0 ) | ( aud_bitrate == 0 ) )
+        audio_remove = ~audio_ok & ~audio_staging
+
+        old_total = calcScoreColumns( cols['old_codec'], cols['old_bitrate'], cols['old_pixels'], cols['old_fps'], cols['old_aud_codec'],
+                                      cols['old_aud_bitrate'], cols['old_channels'], cols['old_lang'], cols['old_eng_subtitles'] > 0,
+                                      cols['year'], high_def, rules )
+
+        compare_remove = video_remove | audio_remove
+        compare_staging = video_staging | audio_staging
+        rescued = compare_remove & ( total > old_total ) & ( total > rules['remove_score'] )
+        compare_staging = compare_staging | rescued
+        compare_remove = compare_remove & ~rescued
+
+        remove = bare | ( fresh & ( total <= rules['remove_score'] ) ) | ( compare & compare_remove )
+        staging = unknown | ( fresh & ( total > rules['remove_score'] ) & ( total <= rules['staging_score'] ) ) | ( compare & compare_staging )
+        error = bare | unanalyzed
+
+        return remove.tolist(), staging.tolist(), error.astype(int).tolist()
+
+
+def dispositionRows( inColumns, inRules=None ):
+### dispositionRows
+#       Input : inColumns (dict) of decision_columns, inRules (dict) from librules
+#       Output: remove (list of BOOL), staging (list of BOOL), error (list of int)
+#               One dispositionMovie per file, for when NumPy isn't installed
+
+        remove = []
+        staging = []
+        error = []
+
+        for idx in range(len(inColumns['year'])):
+                row = dict([ ( name, inColumns[name][idx] ) for name in decision_columns ])
+
+                quality = QualityInfo( None, row['blockiness'], row['sharpness'], row['active_aspect'] ) if row['spot_checked'] else None
+                media = MediaInfo( VideoInfo( row['codec'], row['bitrate'], row['aspect'], row['pixels'], row['framerate'] ),
+                                   AudioInfo( row['aud_codec'], row['language'], row['channels'], row['aud_bitrate'] ),
+                                   row['eng_subtitles'], quality )
+                old_media = None
+                if row['duplicate']:
+                        old_media = MediaInfo( VideoInfo( row['old_codec'], row['old_bitrate'], None, row['old_pixels'], row['old_fps'] ),
+                                               AudioInfo( row['old_aud_codec'], row['old_lang'], row['old_channels'], row['old_aud_bitrate'] ),
+                                               row['old_eng_subtitles'] )
+
+                row_remove, row_staging, row_error = dispositionMovie( media, old_media, row['year'], row['high_def'], row['duplicate'],
+                                                                       None, None, inRules )
+                remove.append( row_remove )
+                staging.append( row_staging )
+                error.append( row_error )
+
+        return remove, staging, error
@@ -0,0 +1,106 @@
+import logging
+from collections import namedtuple
+from fuzzywuzzy import fuzz
+import libplexdb
+import libscore
+
+log = logging.getLogger('process_files.py')
+
+######
+### Several Plex movie sections at once, each with its own library directory.
+### A section is a dict:
+###       name (string)           Plex section name
+###       library_dir (string)    where new files for the section are moved
+###       min_pixels (int)        optional, smallest frame the section takes
+###       max_pixels (int)        optional, largest frame the section takes
+###       codecs (list)           optional, video codecs (as libscore.mungeCodec names) the section takes
+### New files go to the first section they fit, so list a catch-all section last.
+### getSectionIndex looks the section IDs up once and builds one title index
+### over all of them, so a duplicate check is a single in-memory pass.
+######
+
+SectionTitleRow = namedtuple('SectionTitleRow', 'title year media_id section_id')
+
+def getSectionIndex( inPlexDB, inSections ):
+### getSectionIndex
+#       Input : inPlexDB (string), inSections (list of section dicts, or a single section name)
+#       Output: index (dict)
+#                       sections (list) of the section dicts, with their Plex id
+#                       titles (dict) of year to a list of ( title, media_id, section_id )
+#               Errors to None
+
+        sections = inSections if isinstance( inSections, list ) else [ { 'name': inSections } ]
+        sections = [ dict( section ) for section in sections if section.get('name') ]
+
+        if not sections:
+                return None
+
+        names = ', '.join([ '"' + str(section['name']) + '"' for section in sections ])
+
+        query = '       SELECT  name, id \
+                        FROM    library_sections \
+                        WHERE   name IN ( ' + names + ' );'
+
+        ids = dict( libplexdb.iterPlexDB( inPlexDB, query ) )
+
+        for section in sections:
+                if not ids.get( section['name'] ):
+                        log.error('#### FINISH: Plex section does not exist: ' + str(section['name']))
+                        return None
+                section['id'] = int( ids[section['name']] )
+
+        query = '       SELECT  metadata_items.title, metadata_items.year, \
+                                media_items.id, metadata_items.library_section_id \
+                        FROM    metadata_items JOIN media_items \
+                        WHERE   metadata_items.id = media_items.metadata_item_id \
+                                AND metadata_items.library_section_id IN ( ' + ', '.join([ str(section['id']) for section in sections ]) + ' );'
+
+        titles = {}
+
+        for row in libplexdb.iterPlexDB( inPlexDB, query, inRowType=SectionTitleRow ):
+                if row.year:
+                        titles.setdefault( int(row.year), [] ).append( ( row.title, row.media_id, row.section_id ) )
+
+        log.debug('Indexed ' + str(sum([ len(t) for t in titles.values() ])) + ' media items in ' + str(len(sections)) + ' Plex sections')
+
+        return { 'sections': sections, 'titles': titles }
+
+
+def routeMovie( inIndex, inVideo ):
+### routeMovie
+#       Input : inIndex (dict) from getSectionIndex, inVideo (VideoInfo) of the new file
+#       Output: section (dict), the first section the file fits
+#               Errors to None
+
+        pixels = int(inVideo.pixels) if inVideo and inVideo.pixels else 0
+        codec = libscore.mungeCodec( inVideo.codec ) if inVideo and inVideo.codec else ''
+
+        for section in inIndex['sections']:
+                if section.get('min_pixels') and pixels < section['min_pixels']:
+                        continue
+                if section.get('max_pixels') and pixels > section['max_pixels']:
+                        continue
+                if section.get('codecs') and codec not in section['codecs']:
+                        continue
+                return section
+
+        return None
+
+
+def findPlexMedia( inIndex, inTitle, inYear ):
+### findPlexMedia
+#       Input : inIndex (dict) from getSectionIndex, inTitle (string), inYear (int)
+#       Output: matches (dict) of section id to the best matching media_id in that section
+#               Errors to empty
+
+        title = str(inTitle) if inTitle else ''
+        year = int(inYear) if inYear else 0
+
+        best = {}
+
+        for row_title, row_id, row_section in inIndex['titles'].get( year, [] ):
+                score = int(fuzz.token_sort_ratio( title, row_title ))
+                if score > 85 and score > best.get( row_section, ( 0, None ) )[0]:
+                        best[row_section] = ( score, row_id )
+
+        return dict([ ( section, best[section][1] ) for section in best ])
@@ -1,178 +1,78 @@
 #!/usr/bin/python
 
 from __future__ import division
-import PTN
 import argparse
-import requests
-import json
 import os
 import sys
+import time
 import logging
-import shutil
-import libffprobe
+import libaudit
+import libcorpus
+import libfileops
+import libfingerprint
+import libledger
+import libmovie
+import libmvdb
+import libpipeline
 import libplexdb
-from fuzzywuzzy import fuzz
+import libquality
+import libremote
+import librules
+import libscore
+import libsections
 
 library_dir = '/mnt/movies'
 staging_dir = '/mnt/staging'
+trash_dir = '/mnt/movies/.trash'
 
 plexdb = '/var/lib/plexmediaserver/Library/Application Support/Plex Media Server/Plug-in Support/Databases/com.plexapp.plugins.library.db'
 plex_library_name = 'Movies'
 
+### PLEX SECTIONS, a new file goes to the first one it fits (see libsections), keep a catch-all last
+### e.g. [ { 'name': 'Movies 4K', 'library_dir': '/mnt/movies4k', 'min_pixels': 3840 * 1600, 'codecs': [ 'h265' ] },
+###        { 'name': plex_library_name, 'library_dir': library_dir } ]
+plex_sections = [ { 'name': plex_library_name, 'library_dir': library_dir } ]
+
 log_file = '/var/log/aria2/process_file.log'
 
 mvdb_apikey = 'MVDB_API_KEY'
 
 ffprobe_path = '/usr/bin/ffprobe'
+ffmpeg_path = '/usr/bin/ffmpeg'
 
-######
-
-def mungeCodec( inCodec ):
-### mungeCodec
-#       Input: inCodec (string)
-#       Output: codec (string)
-#               Errors to None
-
-        codec = str(inCodec) if isinstance( inCodec, basestring ) else None
-
-        if codec:
-                if 'mpeg2' in codec or 'mpeg-2' in codec:
-                        codec = 'mpeg2'
-                elif 'hev' in codec or 'h265' in codec:
-                        codec = 'h265'
-                elif 'avc' in codec or 'h264' in codec:
-                        codec = 'h264'
-                elif codec in [ 'dx50', 'xvid', 'div3', 'divx' ] or 'mpeg-4' in codec or 'mpeg4' in codec:
-                        codec = 'mpeg4'
-                else:
-                        codec = 'unknown'
-
-        codec = str(codec) if codec else None
-
-        return codec
-
-
-def getMVDBResult( inTitle, inYear ):
-### getMVDBResult
-#       Input: Title (string), Year (int)
-#       Output: JSON blob
-#               Errors to None
-
-        title = str(inTitle) if inTitle else ''
-        year = int(inYear) if inYear else 0
-
-        url = "https://api.themoviedb.org/3/search/movie"
-        isJSON = False
-
-        payload = {'api_key' : mvdb_apikey, 'query' : inTitle, 'year' : inYear }
-        response = requests.request("GET", url, data=payload)
-
-        if response.status_code == requests.codes.ok:
-                res_json = response.json()
-
-        	try:
-                	json.dumps(res_json)
-                	isJSON = True
-        	except ValueError:
-                	isJSON = False
-
-        if isJSON and res_json and res_json['results']:
-                return( res_json['results'] )
-        else:
-                return( None )
-
-
-def calcVideoScore( inCodec, inBitrate, inPixels, inFramerate ):
-### calcVideoScore
-#       Input: codec (string), bitrate (int), pixels (int), framerite (float)
-#       Outout: score (int)
-#               Errors to 0
+### CONCURRENCY FOR BATCHES OF FILES
+max_probes = 8
+http_workers = 4
+db_workers = 1
 
-        codec = str(inCodec) if inCodec else ''
-        bitrate = int(inBitrate) if inBitrate else 0
-        pixels = int(inPixels) if inPixels else 0
-        framerate = float(inFramerate) if inFramerate else 0
+### PACKET SAMPLING FOR --sample-bitrate
+sample_windows = 4
+sample_seconds = 10
 
-        score = 0
+### KEYFRAME DECODING FOR --spot-check
+spot_frames = 5
+spot_budget = 10
 
-        if pixels and framerate:
-                bpp = bitrate / ( pixels * framerate )
-        else:
-                bpp = 0
-
-        for i in [ .05, .08, 0.1, 0.2, 1 ]:
-                if bpp > i:
-                        continue
-                else:
-                        score = [ .05, .08, 0.1, 0.2, 1 ].index(i)
-                        break
-
-        score += 1 if codec == 'h265' else 0
-
-        score = int(score) if score else 0
+### CROPDETECT FOR --detect-crop, results are kept in cache_db
+crop_segments = 3
+crop_seconds = 10
+cache_db = '/var/cache/process_movies/cache.db'
 
-        return score
+### SCORING RULES, see librules for what each one does
+rules_file = os.path.join( os.path.dirname( os.path.abspath(__file__) ), 'rules.json' )
 
+### PROCESSING LEDGER, what each file's stages found and how it was dispositioned
+ledger_db = '/var/cache/process_movies/ledger.db'
 
-def calcAudioScore( inCodec, inBitrate, inChannels, inLanguage, inSubtitles ):
-### calcAudioScore
-#       Input : inCodec (string), inBitrate (int), inChannels (int), inLanguage (string), inSubtitles (BOOL)
-#       Output: score (int)
-#               Errors to 0
+### CONTENT FINGERPRINTS OF PROCESSED DOWNLOADS AND LIBRARY FILES, exact repeats are removed without processing
+fingerprint_db = '/var/cache/process_movies/fingerprints.db'
 
-        codec = str(inCodec) if inCodec else ''
-        bitrate = int(inBitrate) if inBitrate else 0
-        channels = int(inChannels) if inChannels else 0
-        language = str(inLanguage) if inLanguage else 'unknwon'
-        subtitles = True if inSubtitles else False
-
-        score = 0
-
-        score += 2 if channels >= 6 else 0
-
-        if ( not language == 'english' and subtitles ) or language == 'english':
-                score += 2
-
-        for i in [ 98000, 127000, 150000, 256000, 100000000 ]:
-                if bitrate > i:
-                        continue
-                else:
-                        score += [ 98000, 127000, 150000, 256000, 100000000 ].index(i)
-                        break
-
-        score += 1 if codec in [ 'ac3', 'eac3', 'dca' ] else 0
-
-        score = int(score) if score else 0
-
-        return score
-
-
-def calcTotalScore( inVideoScore, inAudioScore, inYear, inHighDef ):
-### caclTotalScore
-#       Input : inVideoScore (int), inAudioScore (int), inYear (int), inHighDef (BOOL)
-#       Output: total_score (float)
-#               Errors to None
-
-        vid_score = int(inVideoScore) if inVideoScore else 0
-        aud_score = int(inAudioScore) if inAudioScore else 0
-        year = int(inYear) if inYear else 0
-        high_def = True if inHighDef else False
-
-        score = 0
-
-        if year < 1977:
-                # Be more lenient on classic movies
-                score = vid_score * 1.2 + aud_score * 1.5
-        elif high_def:
-                # Be more stringent on genres that generally require a higher quality encode
-                score = vid_score * 0.9 + aud_score * 0.75
-        else:
-                score = vid_score + aud_score * 0.9
-
-        score = float(score) if score else 0
-
-        return score
+### LOCAL COPIES FOR --prefetch-remote, None for the system temp directory
+prefetch_dir = None
 
+### LOCAL COPY OF THE PLEX DATABASE FOR --plex-snapshot, retaken when older than plex_snapshot_age seconds
+plex_snapshot = '/var/cache/process_movies/plex-snapshot.db'
+plex_snapshot_age = 600
 
 ### CONFIGURE LOGGING
 log = logging.getLogger('process_files.py')
@@ -185,377 +85,353 @@ log.setLevel(logging.INFO)
 
 ### CONFIGURE ARGUMENT PARSING
 aparse = argparse.ArgumentParser(description='Process movie files into Plex')
-aparse.add_argument('-f', '--file', dest='file', required=True, help='a file to process')
+aparse.add_argument('-f', '--file', dest='files', action='append', default=[], help='a file to process, repeat for a batch')
 aparse.add_argument('-d', '--dry-run', dest='dryrun', action='store_true', help='process files but do not move them')
 aparse.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='get more detail')
 aparse.add_argument('-r', '--replace', dest='replace', action='store_true', help='replace files in your library if better exists')
 aparse.add_argument('--mvdb-api-key', dest='mvdb_apikey', help='mvdb api key')
+aparse.add_argument('-j', '--jobs', dest='jobs', type=int, default=max_probes, help='ffprobe processes to run at once in a batch')
+aparse.add_argument('--sample-bitrate', dest='sample_bitrate', action='store_true', help='measure the video bitrate from sampled packets instead of trusting the tags')
+aparse.add_argument('--spot-check', dest='spot_check', action='store_true', help='decode a few keyframes to judge borderline files')
+aparse.add_argument('--detect-crop', dest='detect_crop', action='store_true', help='score on the picture inside any black bars')
+aparse.add_argument('--plex-snapshot', dest='plex_snapshot', action='store_true', help='read a local snapshot of the Plex database instead of the live one')
+aparse.add_argument('--prefetch-remote', dest='prefetch_remote', action='store_true', help='probe library files on network storage through a local copy of their head and tail')
+aparse.add_argument('--no-ledger', dest='no_ledger', action='store_true', help='process files from scratch and do not record them in the ledger')
+aparse.add_argument('--no-fingerprint', dest='no_fingerprint', action='store_true', help='process files even if they are identical to one already seen')
+aparse.add_argument('--index-library', dest='index_library', action='store_true', help='fingerprint the files in the Plex sections so repeats of them are recognized')
+aparse.add_argument('--rescore', dest='rescore', action='store_true', help='re-score files in the ledger from their stored facts and report changed dispositions')
+aparse.add_argument('--rules', dest='rules_file', help='scoring rules file (default ' + rules_file + ')')
+aparse.add_argument('--what-if', dest='what_if', help='replay the ledger against a candidate rules file and report changed dispositions')
+aparse.add_argument('--record', dest='record', help='record every step of the run in a corpus for --simulate, implies --no-ledger')
+aparse.add_argument('--simulate', dest='simulate', help='replay a recorded corpus, with --rules to try candidate rules, and report changed dispositions')
+aparse.add_argument('--rollback', dest='rollback', help='put a replaced library file back from the trash')
+aparse.add_argument('--audit', dest='audit', action='store_true', help='report upgrade candidates and redundant copies in the Plex library')
+aparse.add_argument('--audit-limit', dest='audit_limit', type=int, default=50, help='number of entries in each audit report')
 
 args = aparse.parse_args()
 
-full_path = os.path.abspath(args.file)
+files = [ os.path.abspath(f) for f in args.files ]
 verbose = args.verbose
 replace = args.replace
 dryrun = args.dryrun
 
 if args.mvdb_apikey:
-	mvdb_apikey = args.mvdb_apikey
+        mvdb_apikey = args.mvdb_apikey
 
 if verbose:
         log.setLevel(logging.DEBUG)
 
+max_probes = args.jobs if args.jobs else max_probes
 
-### START PROCESSING FILE
-if not os.path.exists(full_path):
-        log.error('#### FINISH: File does not exist: ' + full_path)
-        sys.exit(1)
+### A recording needs every stage to run, not be resumed from the ledger
+if args.no_ledger or args.record:
+        ledger_db = None
 
-log.info('#### START: Processing: ' + full_path )
-if dryrun:
-        log.info('Dry Run enabled, no file operations will be performed')
-if replace:
-        log.info('Replace enabled')
+if args.no_fingerprint:
+        fingerprint_db = None
 
-src_file = os.path.basename(full_path)
+if not files and not args.audit and not args.rollback and not args.rescore and not args.what_if and not args.simulate and not args.index_library:
+        aparse.error('a file to process (-f), --audit, --index-library, --rescore, --what-if, --simulate or --rollback is required')
 
+### Compile the rules once for the whole run, the built-in defaults if there's no rules file
+if args.rules_file:
+        rules_file = args.rules_file
 
-### GET FFPROBE INFORMATION FROM FILE
-video = libffprobe.getFFProbeInfo( ffprobe_path, full_path, 'v' )
-if video:
-        codec, bitrate, ratio, pixels, framerate = libffprobe.getVideoInfo( video )
-else:
-        log.error('#### FINISH: Error reading: ' + full_path)
-        sys.exit(1)
-
-codec = '' if not codec else codec
-bitrate = 0 if not bitrate else bitrate
-if not bitrate:
-        log.warn('Bitrate not found in metadata, calculating average bitrate.')
-        bitrate = libffprobe.calcBitRate( ffprobe_path, full_path )
-
-ratio = 0 if not ratio else ratio
-pixels = 0 if not pixels else pixels
-framerate = 0 if not framerate else framerate
-
-audio = libffprobe.getFFProbeInfo( ffprobe_path, full_path, 'a' )
-if audio:
-        aud_codec, language, channels, aud_bitrate = libffprobe.getAudioInfo( audio )
+if os.path.isfile( rules_file ) or args.rules_file:
+        rules = librules.loadRules( rules_file )
+        if not rules:
+                sys.exit(1)
 else:
-        log.error('#### FINISH: Error reading: ' + full_path)
-        sys.exit(1)
-
-aud_codec = '' if not aud_codec else aud_codec
-language = '' if not language else language
-channels = 0 if not channels else channels
-aud_bitrate = 0 if not aud_bitrate else aud_bitrate
+        rules = librules.rules
 
-subtitles = libffprobe.getFFProbeInfo( ffprobe_path, full_path, 's' )
-
-if subtitles:
-        eng_subtitles = libffprobe.hasEngSubtitles( subtitles )
-else:
-        eng_subtitles = False
 
-bpp = bitrate / ( pixels * framerate )
+### ROLL BACK A REPLACED FILE
+if args.rollback:
+        restored = libfileops.rollbackReplace( os.path.abspath(args.rollback) )
+        sys.exit(0 if restored else 1)
 
 
-### PARSE FILE AND PATH INFORMATION FOR MOVIE TITLE AND DATE
-file_info = PTN.parse(src_file)
+### READ A SNAPSHOT OF THE PLEX DATABASE, kept fresh in the background during long batches
+snapshot_refresh = None
 
-if 'episode' in file_info:
-        log.error('#### FINISH: TV show detected, skipping.')
-        sys.exit(1)
+if args.plex_snapshot and ( files or args.audit or args.index_library ):
+        snapshot = libplexdb.getPlexSnapshot( plexdb, plex_snapshot, plex_snapshot_age )
 
-if not 'title' in file_info or not 'year' in file_info:
-        log.warn('Filename parsing failure for ' + src_file + ', fuzzy matching on path.')
-        parent_dir = os.path.basename(os.path.dirname(full_path))
+        if snapshot:
+                if len(files) > 1:
+                        snapshot_refresh = libplexdb.startSnapshotRefresh( plexdb, plex_snapshot, plex_snapshot_age )
+                plexdb = snapshot
+        else:
+                log.warn('Reading the live Plex database')
 
-        file_info = PTN.parse(parent_dir)
 
-        if not 'title' in file_info or not 'year' in file_info:
-                log.error('#### FINISH: Failure parsing path ' + parent_dir + ', manual processing needed.')
-                sys.exit(1)
+### AUDIT THE PLEX LIBRARY
+if args.audit:
+        for section in plex_sections:
+                plex_section_id = libplexdb.getPlexSectionID( plexdb, section['name'] )
 
-title = file_info['title'].replace('.',' ').strip(",'!%/ ").title()
-year = str(file_info['year'])
+                if not plex_section_id:
+                        log.error('#### FINISH: Plex section does not exist: ' + section['name'])
+                        sys.exit(1)
 
+                upgrades, redundant, totals = libaudit.auditLibrary( plexdb, plex_section_id, args.audit_limit, rules )
 
-### SEARCH MVDB FOR INFORMATION
-log.debug('Checking MVDB for: \'' + title + '\' in ' + year )
-res = getMVDBResult( title, year )
+                print('Audited ' + str(totals['movies']) + ' movies, ' + str(totals['items']) + ' media items in ' + section['name'])
+                print('')
+                print('Upgrade candidates: ' + str(totals['upgrades']) + ' (lowest score first)')
+                for score, title, year, filename in upgrades:
+                        print('  ' + str(round(score, 2)).rjust(6) + '  ' + title + ' (' + str(year) + ')  ' + str(filename))
+                print('')
+                print('Redundant copies: ' + str(totals['redundant']) + ', ' + str(int( totals['reclaimable'] / 1000000 )) + 'MB reclaimable (most first)')
+                for reclaim, title, year, filenames in redundant:
+                        print('  ' + str(int( reclaim / 1000000 )).rjust(8) + 'MB  ' + title + ' (' + str(year) + ')')
+                        for filename in filenames:
+                                print('              ' + str(filename))
+                print('')
 
-if not res:
-        log.warn('No results from MVDB for: \'' + title + '\' in ' + year)
-        if '-' in title or ':' in title:
-                split_title = title.replace('-', ':').strip().split(':')
-                log.debug('Attempting munge title: \'' + split_title[0] + '\' in ' + year)
-                res = getMVDBResult( split_title[0], year )
+        sys.exit(0)
 
-        if not res:
-                log.error('#### FINISH: No results from MVDB, check ' + src_file + ' for naming errors.')
-                sys.exit(1)
 
-prev_score = None
-
-for idx in range(len(res)):
-        if year in res[idx]['release_date']:
-                title_len = len(title)
-                res_len = len(res[idx]['title'])
-                threshold = 55 + (( 1 - ( abs(title_len - res_len) / max(title_len, res_len))) * 30 )
-                score = fuzz.token_sort_ratio(title.lower(), res[idx]['title'].lower())
-                if score >= threshold and score > prev_score:
-                        prev_score = score
-                        mvdb_title = res[idx]['title'].lower()
-                        mvdb_date = res[idx]['release_date']
-                        mvdb_language = res[idx]['original_language']
-                        mvdb_genres = res[idx]['genre_ids']
-
-if not prev_score:
-        log.warn('A definitive match cannot be found in mVDB, munging title and searching again')
-        if str(year) in res[0]['release_date'] or str(int(year) - 1) in res[0]['release_date'] or str(int(year) + 1) in \
-	res[0]['release_date']:
-                if ':' in res[0]['title'] or '-' in res[0]['title']:
-                        split_mvdb = res[0]['title'].replace('-', ':').split(':')
-                        munge_title = split_mvdb[0].lower()
-                        threshold = 90
-                else:
-                        title_len = len(title)
-                        res_len = len(res[0]['title'])
-                        munge_title = res[0]['title'].lower()
-                        threshold = 55 + (( 1 - ( abs(title_len - res_len) / max(title_len, res_len))) * 25 )
-
-                score = fuzz.token_sort_ratio( title.lower(), munge_title )
-                if score >= threshold:
-                        prev_score = score
-                        mvdb_title = res[0]['title'].lower()
-                        mvdb_date = res[0]['release_date']
-                        mvdb_language = res[0]['original_language']
-                        mvdb_genres = res[0]['genre_ids']
-
-if prev_score:
-        log.debug('MVDB match at ' + str(prev_score) + '%: ' + title + ', ' + year + ' => ' \
-		+  mvdb_title.title() + ', ' + mvdb_date )
-        title = mvdb_title.strip(",'!%/").replace(":", " -").title()
-else:
-        log.error('#### FINISH: MVDB has results but a definitive match was not found, edit filename and try again' )
-        sys.exit(1)
+### FINGERPRINT THE PLEX LIBRARY
+if args.index_library:
+        if not fingerprint_db:
+                aparse.error('--index-library needs the fingerprint index')
 
+        for section in plex_sections:
+                plex_section_id = libplexdb.getPlexSectionID( plexdb, section['name'] )
 
-#MVDB Genres
-# 12:Adventure, 14:Fantasy, 16:Animation, 27:Horror, 28:Action, 878:Science-Fiction
+                if not plex_section_id:
+                        log.error('#### FINISH: Plex section does not exist: ' + section['name'])
+                        sys.exit(1)
 
-### If file is in one of the above genres, it wants for a higher quality file
-high_def = False
+                start = time.time()
+                indexed, unchanged, missing = libfingerprint.indexLibrary( fingerprint_db, libplexdb.iterPlexFiles( plexdb, plex_section_id ) )
 
-for genre in [ 12, 14, 16, 27, 28, 878 ]:
-        if genre in mvdb_genres:
-                high_def = True
-                break
+                print('Fingerprinted ' + str(indexed) + ' files in ' + section['name'] + ' in ' + str(round(time.time() - start, 2)) + 's, ' \
+                      + str(unchanged) + ' unchanged, ' + str(missing) + ' missing')
 
+        sys.exit(0)
 
-### SEARCH PLEX DATABASE FOR FILE
-codeclist = [ 'mpeg2', 'h265', 'h264', 'mpeg4' ]
-dest_dir = title + ' (' + year + ')'
-duplicate = False
 
-plex_section_id = libplexdb.getPlexSectionID( plexdb, plex_library_name )
+### RE-SCORE FROM THE LEDGER
+if args.rescore:
+        if not ledger_db:
+                aparse.error('--rescore needs the ledger')
 
-if plex_section_id:
-        plex_media_id = libplexdb.getPlexMediaID( plexdb, title, year, plex_section_id )
+        checked = 0
+        changed = 0
 
-        if plex_media_id:
-                duplicate = True
-                old_dir, old_file = libplexdb.getPlexFileInfo( plexdb, plex_media_id )
+        for path, entry in libledger.iterScoredEntries( ledger_db ):
+                facts = libledger.getStoredStages( entry, entry['file_key'] )
+                if 'score' not in facts:
+                        continue
 
-                old_dir = '' if not old_dir else old_dir
-                old_file = '' if not old_file else old_file
+                checked += 1
+                remove, staging, error = libmovie.decideMovie( facts, facts['score'], rules )
+                old = { 'complete': True, 'remove': facts['score']['remove'], 'staging': facts['score']['staging'], 'duplicate': facts['plex']['duplicate'] }
+                new = { 'complete': True, 'remove': remove, 'staging': staging, 'duplicate': facts['plex']['duplicate'] }
+                old_disposition = libmovie.getDisposition( old, replace )
+                new_disposition = libmovie.getDisposition( new, replace )
 
-                old_codec, old_bitrate, old_pixels, old_fps = libplexdb.getPlexVideoInfo( plexdb, plex_media_id )
+                if old_disposition != new_disposition:
+                        changed += 1
+                        done = ', was ' + entry['disposition'] if entry['stage'] == 'done' else ''
+                        print('  ' + old_disposition.ljust(8) + ' -> ' + new_disposition.ljust(8) + '  ' + path + done)
 
-                ### If the information isn't in the Plex library, get it from the file
-                ### If the file is on remote storage, this could be slow
-                if ( not old_codec or not old_bitrate or not old_pixels or not old_fps ) and old_file:
-                        old_video = libffprobe.getFFProbeInfo( ffprobe_path, old_file, 'v' )
-                        if old_video:
-                                old_codec, old_bitrate, old_pixels, old_fps = libffprobe.getVideoInfo( old_audio )
+                ### Files already dispositioned keep the score they were moved on
+                if entry['stage'] != 'done' and not dryrun:
+                        score = dict( facts['score'] )
+                        score['remove'] = remove
+                        score['staging'] = staging
+                        score['error'] = error
+                        libledger.updateStage( ledger_db, path, 'score', score )
 
-                old_codec = '' if not old_codec else str(mungeCodec(old_codec))
-                old_bitrate = 0 if not old_bitrate else old_bitrate
-                old_pixels = 0 if not old_pixels else old_pixels
-                old_fps = 0 if not old_fps else old_fps
+        print('Re-scored ' + str(checked) + ' files, ' + str(changed) + ' changed disposition')
 
-                old_aud_codec, old_lang, old_channels, old_aud_bitrate = libplexdb.getPlexAudioInfo( plexdb, plex_media_id )
+        sys.exit(0)
 
-                ### If the information isn't in the Plex library, get it from the file
-                ### If the file is on remote storage, this could be slow
-                if ( not old_aud_codec or not old_lang or not old_channels or not old_aud_bitrate) and old_file:
-                        old_audio = libffprobe.getFFProbeInfo( ffprobe_path, old_file, 'a' )
-                        if old_audio:
-                                old_aud_codec, old_lang, old_channels, old_aud_bitrate = libffprobe.getAudioInfo( old_audio )
 
-                old_aud_codec = '' if not old_aud_codec else old_aud_codec
-                old_lang = 'unknown' if not old_lang else old_lang
-                old_channels = 0 if not old_channels else old_channels
-                old_aud_bitrate = 0 if not old_aud_bitrate else old_aud_bitrate
+### WHAT-IF, THE LEDGER UNDER CANDIDATE RULES
+if args.what_if:
+        if not ledger_db:
+                aparse.error('--what-if needs the ledger')
 
-                #####
-                ### INSERT CODE TO EXTRACT SUBTITLES FROM PLEXDB
-                old_eng_subtitles = None
-                #####
+        candidate = librules.loadRules( args.what_if )
+        if not candidate:
+                sys.exit(1)
 
-                ### If the information isn't in the Plex library, get it from the file
-                ### If the file is on remote storage, this could be slow
-                if old_eng_subtitles == None and old_file:
-                        old_subtitles = libffprobe.getFFProbeInfo( ffprobe_path, old_file, 's' )
-                        if not old_subtitles:
-                                old_eng_subtitles = libffprobe.hasEngSubtitles( old_subtitles )
-                        else:
-                                old_eng_subtitles = False
+        paths = []
+        facts_list = []
+        for path, entry in libledger.iterScoredEntries( ledger_db ):
+                facts = libledger.getStoredStages( entry, entry['file_key'] )
+                if 'score' in facts:
+                        paths.append( path )
+                        facts_list.append( facts )
 
-else:
-        log.error('#### FINISH: Plex section does not exist: ' + plex_section_id)
-        sys.exit(1)
+        start = time.time()
+        current = libscore.dispositionColumns( libmovie.getDecisionColumns( facts_list, rules ), rules )
+        proposed = libscore.dispositionColumns( libmovie.getDecisionColumns( facts_list, candidate ), candidate )
+        elapsed = time.time() - start
 
+        moves = {}
+        for idx in range(len(paths)):
+                duplicate = facts_list[idx]['plex']['duplicate']
+                old_disposition = libmovie.getDisposition( { 'complete': True, 'remove': current[0][idx], 'staging': current[1][idx], 'duplicate': duplicate }, replace )
+                new_disposition = libmovie.getDisposition( { 'complete': True, 'remove': proposed[0][idx], 'staging': proposed[1][idx], 'duplicate': duplicate }, replace )
 
-### DISPOSITION THE FILE
-remove = False
-staging = False
-error = 0
+                if old_disposition != new_disposition:
+                        moves[( old_disposition, new_disposition )] = moves.get( ( old_disposition, new_disposition ), 0 ) + 1
+                        print('  ' + old_disposition.ljust(8) + ' -> ' + new_disposition.ljust(8) + '  ' + paths[idx])
 
-if ( int(year) >= 1977 and ratio < 1.34 ) or bitrate < ( pixels * framerate ) * 0.04:
-        log.error('Movie does not meet bare minimum requirements.')
-        remove = True
-        error = 1
+        print('Replayed ' + str(len(paths)) + ' files in ' + str(round(elapsed, 3)) + 's, ' + str(sum(moves.values())) + ' changed disposition')
+        for move in sorted(moves):
+                print('  ' + move[0].ljust(8) + ' -> ' + move[1].ljust(8) + '  ' + str(moves[move]))
 
-elif codec == 'unknown':
-        log.error('Movie video codec unknown.')
-        staging = True
+        sys.exit(0)
 
-elif duplicate and ( not old_pixels or not old_bitrate ):
-        log.error('File found in the Plex library, but not analyzed yet. Analyze "' + title + '" in Plex and rerun this script.')
-        error = 1
 
-elif not duplicate:
-        log.debug('Found in the Plex library: FALSE')
+### SIMULATE, A RECORDED CORPUS THROUGH THE CURRENT CODE
+if args.simulate:
+        corpus = libcorpus.loadCorpus( args.simulate )
+        if not corpus:
+                sys.exit(1)
 
-        ### Check video quality
-        log.debug('Video Stats: ' + codec + ', ' + str(int( bitrate / 1000 )) + 'kbps, ' + str(int( pixels / 1000 )) + 'k pixels.' )
-        log.debug('Bits-Per-Pixel (BPP): ' + str(round(bpp, 3)))
+        if not verbose:
+                log.setLevel(logging.WARNING)
+
+        report = libcorpus.simulateCorpus( corpus, rules if args.rules_file else None )
+        count = max( report['files'], 1 )
+
+        print('Simulated ' + str(report['files']) + ' files in ' + str(round(report['seconds'], 3)) + 's, ' \
+              + str(int( report['files'] / max( report['seconds'], 0.001 ) )) + ' files/s, each took ' \
+              + str(round( report['recorded_seconds'] / count, 2 )) + 's end to end when recorded')
+        print('')
+        print('Recorded step latency:')
+        for name in sorted( report['steps'], key=lambda n: report['steps'][n]['seconds'], reverse=True ):
+                stats = report['steps'][name]
+                print('  ' + stats['kind'].ljust(6) + name.ljust(40) + str(stats['count']).rjust(8) + ' steps' \
+                      + str(int( 1000 * stats['seconds'] / stats['count'] )).rjust(8) + 'ms each' \
+                      + str(int( 1000 * stats['seconds'] / count )).rjust(8) + 'ms per file')
+        print('')
+        print('Diverged from the recording: ' + str(len(report['diverged'])))
+        for path in report['diverged']:
+                print('  ' + path)
+        print('Changed disposition: ' + str(len(report['changed'])))
+        for path, recorded, disposition in report['changed']:
+                print('  ' + recorded.ljust(8) + ' -> ' + disposition.ljust(8) + '  ' + path)
+
+        sys.exit(0)
+
+
+if args.spot_check and not libquality.hasNumPy():
+        log.warn('NumPy is not installed, --spot-check is disabled')
+
+### START PROCESSING FILES
+options = {
+        'sample_bitrate': args.sample_bitrate,
+        'sample_windows': sample_windows,
+        'sample_seconds': sample_seconds,
+        'spot_check': args.spot_check,
+        'spot_frames': spot_frames,
+        'spot_budget': spot_budget,
+        'ffmpeg': ffmpeg_path,
+        'ffprobe': ffprobe_path,
+        'detect_crop': args.detect_crop,
+        'crop_segments': crop_segments,
+        'crop_seconds': crop_seconds,
+        'cache_db': cache_db,
+        'ledger_db': ledger_db,
+        'ledger_readonly': dryrun,
+        'rules': rules,
+        'prefetch_remote': args.prefetch_remote,
+        'prefetch_dir': prefetch_dir,
+        'fingerprint_db': fingerprint_db,
+        'fingerprint_seen': {},
+}
 
-        log.debug('High-def genre: ' + str(high_def).upper() )
+if dryrun:
+        log.info('Dry Run enabled, no file operations will be performed')
+if replace:
+        log.info('Replace enabled')
 
-        vid_score = calcVideoScore( codec, bitrate, pixels, framerate )
+def finishFile( inResult ):
+### finishFile
+#       Input : inResult (dict) from libmovie.processMovie
+#       Output: error (int)
 
-        ### SCORE AUDIO
-        log.debug('Audio Stats: ' + language + ', ' + str(channels) + ' channels, ' + str(int( aud_bitrate / 1000 )) + 'kbps' )
+        file_error = libmovie.performDisposition( inResult, replace, library_dir, staging_dir, trash_dir, ffprobe_path, dryrun )
+        disposition = libmovie.getDisposition( inResult, replace )
 
+        ### Only done once the file has left the downloads, a failed replace is tried again next run
+        if ledger_db and not dryrun and inResult and inResult['complete'] and not os.path.exists( inResult['file'] ):
+                libledger.markDone( ledger_db, inResult['file'], disposition )
 
-        aud_score = calcAudioScore( aud_codec, aud_bitrate, channels, language, eng_subtitles )
+        ### Later copies of the same release are recognized from the fingerprint alone
+        if fingerprint_db and not dryrun and inResult and inResult['fingerprint'] and disposition not in ( 'skip', 'repeat' ) \
+           and not os.path.exists( inResult['file'] ):
+                libfingerprint.saveFingerprint( fingerprint_db, inResult['file'], inResult['fingerprint'], 'download', disposition )
+                if inResult['library_file']:
+                        libfingerprint.saveFingerprint( fingerprint_db, inResult['library_file'], inResult['fingerprint'], 'library', disposition )
 
-        if language == 'english':
-                log.debug('English audio track: TRUE')
-        else:
-                log.debug('English audio track: FALSE')
+        return file_error
 
-        log.debug('English subtitles: ' + str(eng_subtitles).upper())
+error = 0
 
-        total_score = calcTotalScore( vid_score, aud_score, year, high_def )
+if len(files) > 1 and ledger_db:
+        done = [ f for f in files if libledger.isDone( ledger_db, f ) ]
+        if done:
+                log.info('Skipping ' + str(len(done)) + ' files already done in the ledger')
+                files = [ f for f in files if f not in done ]
 
-        log.debug('Total quality score: ' + str(total_score))
+### Section IDs and the title index are looked up once for the whole run
+if files:
+        sections = libsections.getSectionIndex( plexdb, plex_sections )
+        if not sections:
+                sys.exit(1)
 
-        if total_score <= 3:
-                remove = True
-        elif total_score <= 8:
-                staging = True
+        if args.record:
+                libcorpus.saveRun( args.record, ffprobe_path, plexdb, sections, options, replace )
 
-else:
-        log.warn('Found in Plex library: TRUE')
-        log.debug('Duplicate found in ' + old_file)
+def newTask( inFile, inSession ):
+### newTask
+#       Input : inFile (string), inSession (requests.Session)
+#       Output: generator of pipeline steps for inFile, recorded if --record was given
 
-        estimated_bitrate = ( ( pixels / old_pixels ) ** 0.75 ) * old_bitrate
-        old_bpp = old_bitrate / ( old_pixels * old_fps )
+        task = libmovie.processMovie( inFile, ffprobe_path, plexdb, sections, mvdb_apikey, inSession, options )
 
-        #### VIDEO COMPARISON
-        log.debug('Video Stats, OLD: ' + old_codec + ', ' + str(int( old_bitrate / 1000 )) + 'kbps, ' + str(int( old_pixels / 1000 )) \
-		  + 'k pixels, BPP: ' + str(round(old_bpp, 3)) )
-        log.debug('Video Stats, NEW: ' + codec + ', ' + str(int( bitrate / 1000 )) + 'kbps, ' + str(int( pixels / 1000 )) \
-		  + 'k pixels, BPP: ' + str(round(bpp, 3)) )
+        if args.record:
+                task = libcorpus.recordTask( args.record, inFile, task )
 
-        log.debug('Target bitrate for the rule of 0.75 is: ' + str(int( estimated_bitrate / 1000 )) + 'kbps.' )
+        return task
 
-        old_vidscore = calcVideoScore( old_codec, old_bitrate, old_pixels, old_fps )
-        vidscore = calcVideoScore( codec, bitrate, pixels, framerate )
+if len(files) == 1:
+        session = libmvdb.getMVDBSession( 1 )
+        result = libpipeline.runTask( newTask( files[0], session ) )
+        error = finishFile( result )
+elif files:
+        log.info('#### START: Processing batch of ' + str(len(files)) + ' files')
+        session = libmvdb.getMVDBSession( http_workers )
+        tasks = [ newTask( f, session ) for f in files ]
 
-        log.debug('High-def genre: ' + str(high_def).upper() )
+        def dispose( idx, result ):
+                global error
 
-        # If the codec is the same, then the bitrate must be 20% than the rule of 0.75
-        if codec == old_codec and int(bitrate) >= ( estimated_bitrate * 1.2 ):
-                log.debug('Movie codec is equal and bitrate is at least 20% better than the previous.')
+                ### One file failing to move must not stop the rest of the batch
+                try:
+                        error = max( error, finishFile( result ) )
+                except Exception, e:
+                        log.exception('#### FINISH: Unable to disposition ' + files[idx] + ': ' + str(e))
+                        error = 1
 
-        # If the codec is better, the bitrate must be at least 75% of the rule of 0.75
-        elif codeclist.index(codec) < codeclist.index(old_codec) and int(bitrate) >= ( estimated_bitrate * 0.75 ):
-                log.debug('Movie codec is better and bitrate is at least 75% of the previous.')
+        libpipeline.runPipeline( tasks, max_probes, http_workers, db_workers, dispose )
 
-        #If the codec is worse, the bitrate must be at least 170% of the rule of 0.75
-        elif codeclist.index(codec) - codeclist.index(old_codec) == 1 and int(bitrate) >= ( estimated_bitrate * 1.7 ):
-                log.debug('Movie codec is older, but the bitrate is more than 170% of the previous.')
-                staging = True
+if snapshot_refresh:
+        snapshot_refresh.set()
 
-        else:
-                log.warn('Movie codec is older than previous and/or it does not meet bitrate target.')
-                remove = True
-
-        #### AUDIO COMPARISON
-        log.debug('Audio Stats, OLD: ' + old_lang + ', ' + old_aud_codec + ', ' + str(old_channels) + ' channels, ' \
-		  + str(int( old_aud_bitrate / 1000 )) + 'kbps, Eng Subtitles = ' + str(old_eng_subtitles))
-        log.debug('Audio Stats, NEW: ' + language + ', ' + aud_codec + ', ' + str(channels) + ' channels, ' \
-		  + str(int( aud_bitrate / 1000 )) + 'kbps, Eng Subtitles = ' + str(eng_subtitles))
-
-        if ( channels >= old_channels or channels >= 6 ) and int(aud_bitrate) > 150000:
-                log.debug('Movie audio track quality meets or exceeds the previous.')
-        elif channels == 0 or int(aud_bitrate) == 0:
-                log.debug('Movie audio track quality unknown.')
-                staging = True
-        else:
-                log.warn('Movie audio track quality does not meet the standard of the previous.')
-                remove = True
-
-        old_audscore = calcAudioScore( old_aud_codec, old_aud_bitrate, old_channels, old_lang, old_eng_subtitles )
-        audscore = calcAudioScore( aud_codec, aud_bitrate, channels, language, eng_subtitles )
-
-        old_totalscore = calcTotalScore( old_vidscore, old_audscore, year, high_def )
-        totalscore = calcTotalScore( vidscore, audscore, year, high_def )
-
-        log.debug('Total Quality Score, OLD: ' + str(round(old_totalscore, 3)))
-        log.debug('Total Quality Score, NEW: ' + str(round(totalscore, 3)))
-
-        if totalscore > old_totalscore and totalscore > 3 and remove == True:
-                remove = False
-                staging = True
-
-
-if remove:
-        log.error('#### FINISH: ' + src_file + ' does not meet standards, deleting it.')
-        if not dryrun:
-                os.remove(full_path)
-        error = 1
-elif staging:
-        log.info('#### FINISH: Unable to disposition ' + src_file + ', moving to staging.')
-        if not dryrun:
-                if not os.path.isdir( staging_dir + '/' + dest_dir ):
-                        os.mkdir( staging_dir + '/' + dest_dir )
-                shutil.move( full_path, staging_dir + '/' + dest_dir + '/' + src_file )
-elif duplicate and replace:
-        log.warn('#### FINISH: Replacing old file in Plex library: ' + old_filename + '.' )
-        if not dryrun:
-                shutil.move( full_path, old_filename )
-else:
-        log.info('#### FINISH: Copying ' + src_file + ' to Plex library.')
-        out_file, out_ext = os.path.splitext(src_file)
-        out_file = title + ' (' + year + ')' + out_ext
-        if not dryrun:
-                if not os.path.isdir( library_dir + '/' + dest_dir ):
-                        os.mkdir( library_dir + '/' + dest_dir )
-                shutil.move( full_path, library_dir + '/' + dest_dir + '/' + out_file )
+io_stats = libremote.getIOStats()
+if io_stats['files']:
+        log.info('Prefetched ' + str(io_stats['files']) + ' library files from network storage: ' + str(int( io_stats['bytes'] / 1048576 )) + 'MB of ' \
+                 + str(int( io_stats['file_bytes'] / 1048576 )) + 'MB read in ' + str(io_stats['reads']) + ' reads, ' \
+                 + str(round( io_stats['seconds'], 2 )) + 's')
 
 sys.exit(error)
@@ -0,0 +1,37 @@
+import os
+import sys
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) )
+
+import libsections
+from libmediainfo import VideoInfo
+
+class RouteMovieTest( unittest.TestCase ):
+
+        def setUp( self ):
+                self.index = { 'sections': [ { 'name': 'Movies 4K', 'id': 2, 'library_dir': '/lib4k', 'min_pixels': 3840 * 1600, 'codecs': [ 'h265' ] },
+                                             { 'name': 'Movies', 'id': 1, 'library_dir': '/lib' } ],
+                               'titles': {} }
+
+        def newVideo( self, inCodec, inWidth, inHeight ):
+                video = VideoInfo()
+                video.codec = inCodec
+                video.pixels = inWidth * inHeight
+                return video
+
+        def test_hevc_goes_to_h265_section( self ):
+                section = libsections.routeMovie( self.index, self.newVideo( 'hevc', 3840, 2160 ) )
+                self.assertEqual( section['library_dir'], '/lib4k' )
+
+        def test_h264_falls_through( self ):
+                section = libsections.routeMovie( self.index, self.newVideo( 'h264', 3840, 2160 ) )
+                self.assertEqual( section['library_dir'], '/lib' )
+
+        def test_small_hevc_falls_through( self ):
+                section = libsections.routeMovie( self.index, self.newVideo( 'hevc', 1920, 1080 ) )
+                self.assertEqual( section['library_dir'], '/lib' )
+
+
+if __name__ == '__main__':
+        unittest.main()